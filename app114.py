@@ -4,11 +4,21 @@
 # =====================================
 import streamlit as st
 import pandas as pd
-from io import BytesIO
-import unicodedata, re
-from openpyxl import Workbook
-from openpyxl.styles import PatternFill
-from openpyxl.utils.dataframe import dataframe_to_rows
+from collections import OrderedDict
+import cProfile, pstats, io, json, hashlib, os, tempfile
+
+import ref_cache
+import audit_history
+
+from audit_core import (
+    FIELD_RULES, fk_cols_needed, ec_cols_needed, original_cols_needed,
+    read_tc_sheets, read_output_sheet, sheet_jobs_of, build_ref_tables, find_missing_contracts,
+    audit_one_sheet, audit_sheets_parallel, build_sheet_artifact, build_missing_artifact,
+    build_key_index, near_miss_report, audit_delta,
+    error_cells_frame, error_cells_bytes, parquet_available,
+    artifact_file_name, MISSING_FILE_NAME, write_result_bundle, measure_call,
+    patch_marked_xlsx,
+)
 
 st.title("📊 模拟人事用薪资计算表自动审核系统-3")
 
@@ -24,6 +34,23 @@ if not uploaded_files or len(uploaded_files) < 4:
     st.warning("⚠️ 请至少上传 提成表、放款明细、二次明细、原表 四个文件")
     st.stop()
 
+# ========== 性能分析 ==========
+# 各阶段 / 各字段的耗时、行数、峰值内存记录，页面底部汇总显示并可导出 JSON
+profile_rows = []
+
+def add_profile(records, cached=False, **extra):
+    """收集 audit_core 返回的性能记录；命中缓存的阶段显示的是首次计算时的数据"""
+    for r in records:
+        profile_rows.append({**extra, **r, "来源": "缓存 (首次计算)" if cached else "本次计算"})
+
+run_cprofile = st.sidebar.checkbox(
+    "启用 cProfile（本次运行）", value=False,
+    help="记录本次运行的函数级耗时；命中缓存的阶段不会重新执行，如需完整分析请先清空缓存"
+)
+profiler = cProfile.Profile() if run_cprofile else None
+if profiler:
+    profiler.enable()
+
 # ========== 工具函数 ==========
 def find_file(files_list, keyword):
     for f in files_list:
@@ -31,168 +58,9 @@ def find_file(files_list, keyword):
             return f
     return None
 
-def normalize_text(val):
-    if pd.isna(val):
-        return ""
-    s = str(val)
-    s = re.sub(r'[\n\r\t ]+', '', s)
-    s = s.replace('\u3000', '')
-    return ''.join(unicodedata.normalize('NFKC', ch) for ch in s).lower().strip()
-
-def normalize_num(val):
-    if pd.isna(val):
-        return None
-    s = str(val).replace(",", "").strip() # <--- 1. 不再替换 "%"
-    if s in ["", "-", "nan"]:
-        return None
-    try:
-        # 2. 在这里检查和处理 "%"
-        if "%" in s:
-            s = s.replace("%", "")
-            return float(s) / 100
-        return float(s)
-    except:
-        return s
-
-def find_col(df_like, keyword, exact=False):
-    key = keyword.strip().lower()
-    columns = df_like.columns if hasattr(df_like, "columns") else df_like.index
-    for col in columns:
-        cname = str(col).strip().lower()
-        if (exact and cname == key) or (not exact and key in cname):
-            return col
-    return None
-
-def normalize_contract_key(series: pd.Series) -> pd.Series:
-    """
-    对合同号 Series 进行标准化处理，用于安全的 pd.merge 操作。
-    """
-    s = series.astype(str)
-    s = s.str.replace(r"\.0$", "", regex=True) 
-    s = s.str.strip()
-    s = s.str.upper() 
-    s = s.str.replace('－', '-', regex=False)
-    # (这个版本不移除内部空格，因为合同号可能包含它们)
-    return s
-
-def prepare_ref_df(df_list, required_cols_dict, prefix):
-    """
-    (新 V2) 预处理参考DF列表：合并、标准化Key、提取列、重命名
-    required_cols_dict: {'合同': ('合同', False), '类型': ('类型', True), ...}
-    """
-    if not df_list or all(df is None for df in df_list):
-        st.warning(f"⚠️ {prefix} 数据列表为空，跳过预处理。")
-        return pd.DataFrame(columns=['__KEY__'])
-        
-    try:
-        df_concat = pd.concat([df for df in df_list if df is not None], ignore_index=True)
-    except Exception as e:
-        st.error(f"❌ 预处理 {prefix} 时合并失败: {e}")
-        return pd.DataFrame(columns=['__KEY__'])
-
-    # 2. 查找合同列 (从字典中获取元组)
-    contract_col_kw, contract_exact = required_cols_dict.get('合同', ('合同', False))
-    contract_col = find_col(df_concat, contract_col_kw, exact=contract_exact)
-    
-    if not contract_col:
-        st.warning(f"⚠️ 在 {prefix} 参考表中未找到'合同'列 (关键字: '{contract_col_kw}', 精确: {contract_exact})，跳过此数据源。")
-        return pd.DataFrame(columns=['__KEY__'])
-        
-    # 3. 提取列 & 重命名
-    cols_to_extract = [contract_col]
-    col_mapping = {} # '原始列名' -> 'ref_prefix_标准名'
-    
-    for std_name, (col_kw, is_exact) in required_cols_dict.items(): # <--- V2: 解包元组
-        if std_name == '合同': continue 
-            
-        actual_col = find_col(df_concat, col_kw, exact=is_exact) # <--- V2: 使用 is_exact
-        
-        if actual_col:
-            cols_to_extract.append(actual_col)
-            col_mapping[actual_col] = f"ref_{prefix}_{std_name}"
-        else:
-            # V2: 提供更详细的警告
-            st.warning(f"⚠️ 在 {prefix} 参考表中未找到列 (关键字: '{col_kw}', 精确: {is_exact})")
-            
-    if len(cols_to_extract) == 1: 
-        st.warning(f"⚠️ 在 {prefix} 参考表中未找到任何所需字段，跳过。")
-        return pd.DataFrame(columns=['__KEY__'])
-
-    # 4. 创建标准DF
-    std_df = df_concat[list(set(cols_to_extract))].copy()
-    std_df['__KEY__'] = normalize_contract_key(std_df[contract_col])
-    std_df = std_df.rename(columns=col_mapping)
-    
-    final_cols = ['__KEY__'] + list(col_mapping.values())
-    
-    # 确保 final_cols 都在 std_df 中
-    final_cols_in_df = [col for col in final_cols if col in std_df.columns]
-    std_df = std_df[final_cols_in_df]
-    
-    # 5. 去重
-    std_df = std_df.drop_duplicates(subset=['__KEY__'], keep='first')
-    return std_df
-
-def compare_series_vec(s_main, s_ref, compare_type='text', tolerance=0, multiplier=1):
-    """
-    (新) 向量化比较函数，复刻所有业务逻辑。
-    """
-    # 0. 识别 Merge 失败
-    merge_failed_mask = s_ref.isna()
-
-    # 1. 预处理空值
-    main_is_na = pd.isna(s_main) | (s_main.astype(str).str.strip().isin(["", "nan", "None"]))
-    ref_is_na = pd.isna(s_ref) | (s_ref.astype(str).str.strip().isin(["", "nan", "None"]))
-    both_are_na = main_is_na & ref_is_na
-    
-    errors = pd.Series(False, index=s_main.index)
-
-    # 2. 日期比较
-    if compare_type == 'date':
-        d_main = pd.to_datetime(s_main, errors='coerce').dt.normalize()
-        d_ref = pd.to_datetime(s_ref, errors='coerce').dt.normalize()
-        
-        valid_dates_mask = d_main.notna() & d_ref.notna()
-        date_diff_mask = (d_main != d_ref)
-        errors = valid_dates_mask & date_diff_mask
-        
-        one_is_date_one_is_not = (d_main.notna() & d_ref.isna() & ~ref_is_na) | \
-                                 (d_main.isna() & ~main_is_na & d_ref.notna())
-        errors |= one_is_date_one_is_not
-
-    # 3. 数值比较
-    elif compare_type == 'num' or compare_type == 'rate' or compare_type == 'term':
-        s_main_norm = s_main.apply(normalize_num)
-        s_ref_norm = s_ref.apply(normalize_num)
-                   
-        # 特殊：期限（乘数）
-        if compare_type == 'term':
-            s_ref_norm = pd.to_numeric(s_ref_norm, errors='coerce') * multiplier
-
-        is_num_main = s_main_norm.apply(lambda x: isinstance(x, (int, float)))
-        is_num_ref = s_ref_norm.apply(lambda x: isinstance(x, (int, float)))
-        both_are_num = is_num_main & is_num_ref
-
-        if both_are_num.any():
-            diff = (s_main_norm[both_are_num] - s_ref_norm[both_are_num]).abs()
-            errors.loc[both_are_num] = (diff > (tolerance + 1e-6))
-            
-        one_is_num_one_is_not = (is_num_main & ~is_num_ref & ~ref_is_na) | \
-                                (~is_num_main & ~main_is_na & is_num_ref)
-        errors |= one_is_num_one_is_not
-
-    # 4. 文本比较
-    else: # compare_type == 'text'
-        s_main_norm_text = s_main.apply(normalize_text)
-        s_ref_norm_text = s_ref.apply(normalize_text)
-        errors = (s_main_norm_text != s_ref_norm_text)
-
-    # 5. 最终错误逻辑
-    final_errors = errors & ~both_are_na
-    lookup_failure_mask = merge_failed_mask & ~main_is_na
-    final_errors = final_errors & ~lookup_failure_mask
-    
-    return final_errors
+def st_notify(level, msg):
+    """audit_core 的提示回调：显示为页面上的 warning / error"""
+    (st.error if level == "error" else st.warning)(msg)
 
 # ========== 读取文件 & 预处理 ==========
 st.info("ℹ️ 正在读取并预处理所有文件...")
@@ -202,331 +70,387 @@ fk_file = find_file(uploaded_files, "放款明细")
 ec_file = find_file(uploaded_files, "二次明细")
 original_file = find_file(uploaded_files, "原表")
 
+# 参考表所需列 (fk_cols_needed 等) 定义在 audit_core 中，命令行批量审核共用同一配置
+
+# ========== 缓存 (按上传内容哈希) ==========
+# 点击下载按钮会触发整页重跑：读取、预处理、审核三个阶段均以
+# “上传文件内容哈希 + 列配置/字段规则” 为键缓存，输入不变时直接复用结果。
+CACHE_TTL_SECONDS = 60 * 60   # 缓存条目 1 小时后过期
+CACHE_MAX_ENTRIES = 16        # 每个阶段最多保留的缓存条目数 (超出按 LRU 淘汰)
+
+cache_misses = [] # 本次运行中实际执行(未命中缓存)的阶段
+
+def file_digest(f):
+    """上传文件内容的 SHA-256 摘要（作为缓存键）"""
+    return hashlib.sha256(f.getvalue()).hexdigest()
+
+def spec_digest(*specs):
+    """列配置 / 字段规则的摘要（配置变化时缓存自动失效）"""
+    return hashlib.sha256(repr(specs).encode("utf-8")).hexdigest()
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_tc_sheets(tc_digest, rules_digest, _tc_file):
+    """
+    读取主表 (提成)：每个工作簿只解析一次，所有需要的 sheet 一次读出。
+    只读审核用到的列 (由 FIELD_RULES 决定)，因此字段规则的摘要也在缓存键中。
+    """
+    cache_misses.append("读取提成表")
+    profile = []
+    return read_tc_sheets(_tc_file, profile), profile
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_ref_tables(ref_digests, cols_spec_digest, _fk_file, _ec_file, _original_file):
+    """读取并预处理参考表 (放款明细-潮掣 / 二次明细 / 原表)"""
+    cache_misses.append("预处理参考表")
+    profile = []
+    all_std_dfs, ref_index = build_ref_tables(_fk_file, _ec_file, _original_file, notify=st_notify, profile=profile)
+    return all_std_dfs, ref_index, profile
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_key_index(ref_digests, cols_spec_digest, _fk_std):
+    """放款明细合同号的近似匹配索引 (生成标注版时才构建，每套参考表只构建一次)"""
+    return build_key_index(_fk_std)
+
+# 参考表磁盘缓存 (跨会话 / 重启保留)：查看与清空
+with st.sidebar.expander("🗄️ 参考表磁盘缓存"):
+    disk_entries = ref_cache.list_entries()
+    st.caption(
+        f"{len(disk_entries)} 个条目，共 {sum(e['bytes'] for e in disk_entries) / 1024 ** 2:.1f} MB"
+        f"（上限 {ref_cache.REF_CACHE_MAX_BYTES / 1024 ** 2:.0f} MB）"
+    )
+    if st.button("清空磁盘缓存", key="clear_ref_cache", disabled=not disk_entries):
+        st.success(f"已删除 {ref_cache.clear()} 个缓存条目")
+
 # 1. 读取主表 (提成)
-# ... (这部分不变, 保持原样) ...
-tc_xls = pd.ExcelFile(tc_file)
-sheet_total = next((s for s in tc_xls.sheet_names if "总" in s), None)
-sheets_qk = [s for s in tc_xls.sheet_names if "轻卡" in s]
-sheets_zk = [s for s in tc_xls.sheet_names if "重卡" in s]
-
-tc_sheets = {
-    "总": [pd.read_excel(tc_file, sheet_name=sheet_total)] if sheet_total else [],
-    "轻卡": [pd.read_excel(tc_file, sheet_name=s) for s in sheets_qk],
-    "重卡": [pd.read_excel(tc_file, sheet_name=s) for s in sheets_zk],
-}
+tc_digest = file_digest(tc_file)
+rules_digest = spec_digest(FIELD_RULES)
+n_misses = len(cache_misses)
+tc_sheets, tc_profile = load_tc_sheets(tc_digest, rules_digest, tc_file)
+add_profile(tc_profile, cached=len(cache_misses) == n_misses)
 
 # 2. 读取并预处理参考表
-# --- 放款明细 (fk) ---
-fk_xls = pd.ExcelFile(fk_file)
-fk_dfs_raw = [pd.read_excel(fk_file, sheet_name=s) for s in fk_xls.sheet_names if "潮掣" in s]
-
-# --- VVVV (【核心修改】更新为 (关键字, 是否精确) 的元组) VVVV ---
-fk_cols_needed = {
-    # {标准名: (关键字, 精确匹配)}
-    '合同': ('合同', False),
-    '放款日期': ('放款日期', False),
-    '提报人员': ('提报人员', False),
-    '城市经理': ('城市经理', False),
-    '租赁本金': ('租赁本金', False),
-    'xirr': ('xirr', False),
-    '租赁期限/年': ('租赁期限/年', False), # 模糊匹配也OK，但精确更好
-    '家访': ('家访', False),
-    '类型': ('类型', True),
-    '放款金额': ('放款金额', False)# <--- 这就是您要的修复！
-}
-fk_std = prepare_ref_df(fk_dfs_raw, fk_cols_needed, "fk")
-
-# --- 二次明细 (ec) ---
-ec_xls = pd.ExcelFile(ec_file)
-ec_dfs_raw = [pd.read_excel(ec_file, sheet_name=s) for s in ec_xls.sheet_names]
-ec_cols_needed = {
-    '合同': ('合同', False),
-    '出本流程时间': ('出本流程时间', False)
-}
-ec_std = prepare_ref_df(ec_dfs_raw, ec_cols_needed, "ec")
-
-# --- 原表 (original) ---
-original_dfs_raw = [pd.read_excel(original_file)]
-original_cols_needed = {
-    '合同': ('合同', False),
-    '年化nim': ('年化nim', False)
-}
-orig_std = prepare_ref_df(original_dfs_raw, original_cols_needed, "orig")
-# --- ^^^^ (修改结束) ^^^^ ---
-
-all_std_dfs = {
-    "fk": fk_std,
-    "ec": ec_std,
-    "orig": orig_std
-}
+ref_digests = (file_digest(fk_file), file_digest(ec_file), file_digest(original_file))
+cols_spec_digest = spec_digest(fk_cols_needed, ec_cols_needed, original_cols_needed)
+n_misses = len(cache_misses)
+all_std_dfs, ref_index, ref_profile = load_ref_tables(ref_digests, cols_spec_digest, fk_file, ec_file, original_file)
+add_profile(ref_profile, cached=len(cache_misses) == n_misses)
+fk_std = all_std_dfs["fk"]
 
 st.success(f"✅ 提成表已读取：总({len(tc_sheets['总'])})、轻卡({len(tc_sheets['轻卡'])})、重卡({len(tc_sheets['重卡'])})")
 st.success("✅ 所有参考文件已预处理完成。")
 
-# 3. 定义 MAPPING (保持不变)
-MAPPING = {
-    "放款日期": ("放款明细", "放款日期", 0, 1),
-    "提报人员": ("放款明细", "提报人员", 0, 1),
-    "城市经理": ("放款明细", "城市经理", 0, 1),
-    "租赁本金": ("放款明细", "租赁本金", 0, 1),
-    "收益率": ("放款明细", "xirr", 0.005, 1), 
-    "期限": ("放款明细", "租赁期限/年", 0.5, 12),
-    "家访": ("放款明细", "家访", 0, 1),
-    "人员类型": ("放款明细", "类型", 0, 1),
-    "二次交接": ("二次明细", "出本流程时间", 0, 1),
-    "计算提成金额": ("放款明细", "放款金额", 0, 1)
-}
-
 # =====================================
 # 🧮 核心审核函数 (向量化版)
 # =====================================
-def audit_one_sheet_vec(tc_df, sheet_label, all_std_dfs):
-    contract_col_main = find_col(tc_df, "合同")
-    if not contract_col_main:
-        st.warning(f"⚠️ {sheet_label}：未找到‘合同’列，跳过。")
-        return None, None, 0, 0
-    
-    # 1. 准备主表
-    tc_df['__ROW_IDX__'] = tc_df.index
-    tc_df['__KEY__'] = normalize_contract_key(tc_df[contract_col_main])
+def audit_one_sheet_vec(tc_df, sheet_label, all_std_dfs, ref_index=None, previous=None):
+    """在页面中审核单个 sheet：调用 audit_core.audit_one_sheet 并显示逐字段进度 (previous 为上一次结果时增量审核)"""
+    progress = st.progress(0)
+    status = st.empty()
 
-    # 2. 一次性合并所有参考数据
-    merged_df = tc_df.copy()
-    for std_df in all_std_dfs.values():
-        if not std_df.empty:
-            merged_df = pd.merge(merged_df, std_df, on='__KEY__', how='left')
+    def on_field(i, total, main_kw):
+        status.text(f"{sheet_label} 审核进度：{i}/{total} - {main_kw}")
+        progress.progress(i / total)
 
-    # 3. === 遍历字段进行向量化比对 ===
-    total_errors = 0
-    errors_locations = set() # 存储 (row_idx, col_name)
-    row_has_error = pd.Series(False, index=merged_df.index)
+    result = audit_one_sheet(tc_df, all_std_dfs, ref_index, on_field=on_field, previous=previous)
+    if result is None:
+        st.warning(f"⚠️ {sheet_label}：未找到‘合同’列，跳过。")
+    else:
+        status.text(f"{sheet_label} 比对完成。")
+    return result
 
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES * 8, show_spinner=False)
+def audit_sheet_cached(tc_digest, tag, ref_digests, cols_spec_digest, rules_digest, _tc_df, _all_std_dfs, _ref_index,
+                       _previous=None):
+    """
+    按 (提成表哈希, sheet, 参考表哈希, 列配置, 字段规则) 缓存单个 sheet 的审核结果 (位图等紧凑结果，不含 xlsx)。
+    _previous 只用于少复核未变化的行，不影响审核结果；结果中的 "delta" 由调用方按当前基准重新计算 (audit_delta)。
+    """
+    cache_misses.append(f"审核 {tag}")
+    return audit_one_sheet_vec(_tc_df, tag, _all_std_dfs, _ref_index, _previous)
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def audit_all_parallel_cached(tc_digest, ref_digests, cols_spec_digest, rules_digest, _sheets, _all_std_dfs, _ref_index, _workers,
+                              _previous=None):
+    """多进程模式：所有 sheet 一起提交到进程池，按 sheet 顺序返回结果 (缓存键与逐个审核相同)"""
+    cache_misses.extend(f"审核 {tag}" for tag in _sheets)
     progress = st.progress(0)
     status = st.empty()
-    n = len(merged_df)
-
-    for i, (main_kw, (src, ref_kw, tol, mult)) in enumerate(MAPPING.items()):
-        
-        exact_main = "期限" in main_kw or main_kw == "人员类型"
-        main_col = find_col(merged_df, main_kw, exact=exact_main)
-        if not main_col:
-            continue
-            
-        status.text(f"{sheet_label} 审核进度：{i+1}/{len(MAPPING)} - {main_kw}")
-        
-        s_main = merged_df[main_col]
-        
-        # 4. === (核心) 处理条件逻辑 ===
-        if main_kw == "收益率":
-            person_type_col = find_col(merged_df, "人员类型", exact=True)
-            if not person_type_col:
-                continue # 无法判断类型，跳过
-                
-            s_ref_fk = merged_df.get('ref_fk_xirr') # 放款明细
-            s_ref_orig = merged_df.get('ref_orig_年化nim') # 原表
-            
-            # (健壮性检查: 如果 'xirr' 列不存在，则创建一个空的 Series)
-            if s_ref_fk is None:
-                s_ref_fk = pd.Series(pd.NA, index=merged_df.index)
-            
-            # 默认使用放款明细
-            s_ref_final = s_ref_fk.copy()
-            
-            # 如果类型为"轻卡", 则覆盖为"原表"的值
-            if s_ref_orig is not None:
-                # --- VVVV (【核心修复】使用 normalize_text) VVVV ---
-                person_type_normalized = merged_df[person_type_col].apply(normalize_text)
-                mask_light_truck = (person_type_normalized == "轻卡") # '轻卡' 已经是小写
-                # --- ^^^^ (修复结束) ^^^^ ---
-                s_ref_final.loc[mask_light_truck] = s_ref_orig.loc[mask_light_truck]
-            
-            errors_mask = compare_series_vec(s_main, s_ref_final, compare_type='rate', tolerance=tol)
-        
-        elif "日期" in main_kw or main_kw == "二次交接":
-            ref_col_name = f"ref_{'ec' if src == '二次明细' else 'fk'}_{ref_kw}"
-            s_ref = merged_df.get(ref_col_name)
-            errors_mask = compare_series_vec(s_main, s_ref, compare_type='date')
-            
-        elif "期限" in main_kw:
-            ref_col_name = f"ref_fk_{ref_kw}"
-            s_ref = merged_df.get(ref_col_name)
-            errors_mask = compare_series_vec(s_main, s_ref, compare_type='term', tolerance=tol, multiplier=mult)
-
-        elif main_kw in ["租赁本金", "家访"]: # 其他数值
-            ref_col_name = f"ref_fk_{ref_kw}"
-            s_ref = merged_df.get(ref_col_name)
-            errors_mask = compare_series_vec(s_main, s_ref, compare_type='num', tolerance=tol)
-
-        else: # 文本
-            ref_col_name = f"ref_fk_{ref_kw}"
-            s_ref = merged_df.get(ref_col_name)
-            errors_mask = compare_series_vec(s_main, s_ref, compare_type='text')
-            
-        # 5. 累积错误
-        if errors_mask is not None and errors_mask.any():
-            total_errors += errors_mask.sum()
-            row_has_error |= errors_mask
-            
-            bad_indices = merged_df[errors_mask]['__ROW_IDX__']
-            for idx in bad_indices:
-                errors_locations.add((idx, main_col))
-                
-        progress.progress((i + 1) / len(MAPPING))
-
-    status.text(f"{sheet_label} 比对完成，正在生成标注文件...")
-
-    # 6. === 快速写入 Excel (替换旧的循环) ===
-    wb = Workbook()
-    ws = wb.active
-    red_fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
-    yellow_fill = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
-
-    # 准备原始列
-    original_cols_list = list(tc_df.drop(columns=['__ROW_IDX__', '__KEY__']).columns)
-    col_name_to_idx = {name: i + 1 for i, name in enumerate(original_cols_list)}
-
-    # 写入表头 + 数据
-    for r in dataframe_to_rows(merged_df[original_cols_list], index=False, header=True):
-        ws.append(r)
-    
-    # 标红
-    for (row_idx, col_name) in errors_locations:
-        if col_name in col_name_to_idx:
-            excel_row = row_idx + 2 # (row_idx 0-based) + (1 for header) + (1 for 1-based)
-            excel_col = col_name_to_idx[col_name]
-            ws.cell(excel_row, excel_col).fill = red_fill
-            
-    # 标黄
-    if contract_col_main in col_name_to_idx:
-        contract_col_excel_idx = col_name_to_idx[contract_col_main]
-        error_row_indices = merged_df[row_has_error]['__ROW_IDX__']
-        for row_idx in error_row_indices:
-            excel_row = row_idx + 2
-            ws.cell(excel_row, contract_col_excel_idx).fill = yellow_fill
-
-    output_full = BytesIO()
-    wb.save(output_full)
-    output_full.seek(0)
-    
-    # 7. === (新) 快速生成精简错误表 ===
-    output_err = BytesIO()
-    error_row_count = row_has_error.sum()
-    
-    if error_row_count > 0:
-        try:
-            df_errors_only = merged_df.loc[row_has_error, original_cols_list].copy()
-            
-            original_indices_with_error = merged_df.loc[row_has_error, '__ROW_IDX__']
-            original_idx_to_new_excel_row = {
-                original_idx: new_row_num 
-                for new_row_num, original_idx in enumerate(original_indices_with_error, start=2)
-            }
-
-            wb_err = Workbook()
-            ws_err = wb_err.active
-            
-            for r in dataframe_to_rows(df_errors_only, index=False, header=True):
-                ws_err.append(r)
-                
-            for (original_row_idx, col_name) in errors_locations:
-                if original_row_idx in original_idx_to_new_excel_row:
-                    new_row = original_idx_to_new_excel_row[original_row_idx]
-                    if col_name in col_name_to_idx:
-                        new_col = col_name_to_idx[col_name]
-                        ws_err.cell(row=new_row, column=new_col).fill = red_fill
-            
-            # 标黄合同号
-            contract_col_excel_idx = col_name_to_idx[contract_col_main]
-            for new_row_num in original_idx_to_new_excel_row.values():
-                 ws_err.cell(row=new_row_num, column=contract_col_excel_idx).fill = yellow_fill
-
-            wb_err.save(output_err)
-            output_err.seek(0)
-        except Exception as e:
-            st.error(f"❌ 生成“错误精简版”文件时出错: {e}")
-            output_err = None # 设为None
-    else:
-        output_err = None # 没有错误
-        
-    return output_full, output_err, total_errors, error_row_count
-    
+
+    def on_sheet_done(tag, n_done, n_total):
+        status.text(f"已完成 {n_done}/{n_total}：{tag}")
+        progress.progress(n_done / n_total)
+
+    sheet_results = audit_sheets_parallel(_sheets, _all_std_dfs, _ref_index, _workers, on_sheet_done, _previous)
+    for tag, result in sheet_results.items():
+        if result is None:
+            st.warning(f"⚠️ {tag}：未找到‘合同’列，跳过。")
+    return sheet_results
+
 # ========== 审核所有 sheet ==========
+audit_workers = st.sidebar.number_input(
+    "并行审核进程数（1 = 逐个 sheet 审核）", min_value=1, max_value=os.cpu_count() or 1, value=1,
+    help="多于 1 时各 sheet 在独立进程中并发审核，适合 sheet 多、行数大的提成表"
+)
+
+incremental = st.sidebar.checkbox(
+    "♻️ 增量复审（只复核变化的行）", value=True,
+    help="重新上传修改后的提成表时，与本会话上一次的审核结果比对行指纹，只复核内容或参考数据有变化的行"
+)
+
+sheet_jobs = sheet_jobs_of(tc_sheets) # tag -> DataFrame (按 总 / 轻卡 / 重卡 顺序)
+
+# 增量复审的基准：本会话中输入 (提成表 / 参考表 / 配置) 不同的上一次审核结果；
+# 输入未变的重跑 (如点击下载) 沿用同一基准，不与本次结果自身比较
+audit_key = (tc_digest, ref_digests, cols_spec_digest, rules_digest)
+audit_runs = st.session_state.setdefault("audit_runs", {"key": None, "results": {}, "baseline": {}})
+if audit_runs["key"] != audit_key:
+    audit_runs["baseline"] = audit_runs["results"]
+previous_results = audit_runs["baseline"] if incremental else {}
 results = {}
-for label, df_list in tc_sheets.items():
-    if not df_list:
-        continue
-    for i, df in enumerate(df_list, start=1):
-        tag = f"{label}{i if len(df_list) > 1 else ''}"
+if audit_workers > 1 and len(sheet_jobs) > 1:
+    st.divider()
+    st.subheader(f"📘 正在并行审核 {len(sheet_jobs)} 个 sheet（{min(audit_workers, len(sheet_jobs))} 个进程）")
+    n_misses = len(cache_misses)
+    sheet_results = audit_all_parallel_cached(
+        tc_digest, ref_digests, cols_spec_digest, rules_digest, sheet_jobs, all_std_dfs, ref_index, audit_workers,
+        previous_results
+    )
+    sheet_cached = {tag: len(cache_misses) == n_misses for tag in sheet_results}
+else:
+    sheet_results, sheet_cached = {}, {}
+    for tag, df in sheet_jobs.items():
         st.divider()
         st.subheader(f"📘 正在审核：{tag}")
-        full, err, errs, rows = audit_one_sheet_vec(df, tag, all_std_dfs)
-        results[tag] = (full, err, errs, rows)
+        n_misses = len(cache_misses)
+        sheet_results[tag] = audit_sheet_cached(
+            tc_digest, tag, ref_digests, cols_spec_digest, rules_digest, df, all_std_dfs, ref_index,
+            previous_results.get(tag)
+        )
+        sheet_cached[tag] = len(cache_misses) == n_misses
+
+for tag, result in sheet_results.items():
+    if result is not None:
+        # 缓存的结果可能是按别的上一次结果 (其他会话 / 更早的基准) 算出的：增量信息按本会话的基准重新计算
+        result = dict(result, delta=audit_delta(sheet_jobs[tag], result, previous_results.get(tag)))
+        results[tag] = (sheet_jobs[tag], result)
+        add_profile(result["profile"], cached=sheet_cached[tag], sheet=tag)
+audit_runs.update(key=audit_key, results={tag: result for tag, (_, result) in results.items()})
+
+# --- 增量复审：复核行数与上次标记后已修正的单元格 ---
+for tag, (_, result) in results.items():
+    delta = result["delta"]
+    if delta is None:
+        continue
+    st.info(f"♻️ {tag}：增量复审，复核 {delta['rechecked_rows']} 行，沿用上次结果 {delta['reused_rows']} 行")
+    fixed = delta["fixed_cells"]
+    if len(fixed):
+        with st.expander(f"✅ {tag}：上次标记的 {len(fixed)} 个单元格已修正"):
+            st.dataframe(fixed, use_container_width=True, hide_index=True)
+
+# ========== 按需生成下载文件 (会话级有界缓存) ==========
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+ARTIFACT_CACHE_MAX_BYTES = 256 * 1024 ** 2 # 已生成文件的缓存上限，超出按最久未用淘汰
+
+def get_artifact(key):
+    cache = st.session_state.setdefault("artifact_cache", OrderedDict())
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    return None
+
+def put_artifact(key, data, stats):
+    cache = st.session_state.setdefault("artifact_cache", OrderedDict())
+    cache[key] = (data, stats)
+    cache.move_to_end(key)
+    while len(cache) > 1 and sum(len(d) for d, _ in cache.values()) > ARTIFACT_CACHE_MAX_BYTES:
+        cache.popitem(last=False)
+    return cache[key]
+
+def lazy_download(cache_key, label, file_name, build, widget_key, mime=XLSX_MIME):
+    """
+    先生成、再下载：只有点击“生成”时才写出文件，生成结果放入有界缓存；
+    缓存中已有的文件直接显示下载按钮 (下载触发的重跑也无需重新生成)。
+    build() 返回 (BytesIO 或 bytes, 写出统计)；缓存只保留 bytes。
+    """
+    entry = get_artifact(cache_key)
+    built_now = False
+    if entry is None and st.button(f"⚙️ 生成 {label}", key=f"build_{widget_key}"):
+        with st.spinner(f"正在生成 {label}..."):
+            data, stats = build()
+        entry = put_artifact(cache_key, data if isinstance(data, bytes) else data.getvalue(), stats)
+        del data # 不再持有生成时的缓冲区
+        built_now = True
+    if entry is not None:
+        data, stats = entry
+        if stats:
+            add_profile([{"阶段": "写出文件", "字段": label, **stats}], cached=not built_now)
+        st.download_button(
+            f"📥 下载 {label}",
+            data=data,
+            file_name=file_name,
+            mime=mime,
+            key=f"download_{widget_key}" # 确保Key唯一
+        )
+        if stats:
+            st.caption(f"{label} 写出 {stats['耗时(s)']}s / 峰值内存 {stats['峰值内存(MB)']}MB")
+
+if not cache_misses:
+    st.info("⚡ 输入文件与配置均未变化：已直接使用缓存结果（读取、预处理、审核均已跳过）。")
+elif len(cache_misses) < len(results) + 2:
+    st.info(f"⚡ 部分命中缓存，本次重新计算：{'、'.join(cache_misses)}")
 
 # ========== 🔍 反向漏填检查（使用标准化Key） ==========
 st.divider()
 st.subheader("🔍 反向漏填检查（仅基于放款明细中包含“潮掣”的sheet）")
 
-# 1. 从 "总" sheet 获取标准合同号
-contracts_total = set()
-if tc_sheets["总"]:
-    df_total = tc_sheets["总"][0]
-    col = find_col(df_total, "合同", exact=False)
-    if col is not None:
-        contracts_total = set(normalize_contract_key(df_total[col].dropna()))
-
-# 2. 从预处理的 fk_std DataFrame 获取标准合同号
-# (这比重新读取 fk_dfs 要快得多，且已标准化)
-contracts_fk = set(fk_std['__KEY__'].dropna())
-
-missing_contracts = sorted(list(contracts_fk - contracts_total))
+missing_contracts = find_missing_contracts(tc_sheets, fk_std)
 
 if missing_contracts:
     st.warning(f"⚠️ 发现 {len(missing_contracts)} 个合同号存在于放款明细中，但未出现在提成表‘总’sheet中")
-    df_missing = pd.DataFrame({"漏填合同号": missing_contracts})
-    output_missing = BytesIO()
-    
-    # (使用 openpyxl 写入，避免额外的 pd.ExcelWriter 依赖)
-    wb_miss = Workbook()
-    ws_miss = wb_miss.active
-    ws_miss.cell(1, 1, "漏填合同号")
-    for r, contract in enumerate(missing_contracts, start=2):
-        ws_miss.cell(r, 1, contract)
-        
-    wb_miss.save(output_missing)
-    output_missing.seek(0)
-    
-    st.download_button(
-        "📥 下载漏填合同号表（基于放款明细-潮掣）",
-        data=output_missing,
-        file_name="提成_漏填合同号_基于放款明细_潮掣.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    lazy_download(
+        (tc_digest, ref_digests, "漏填合同号"),
+        "漏填合同号表（基于放款明细-潮掣）",
+        MISSING_FILE_NAME,
+        lambda: build_missing_artifact(missing_contracts),
+        "missing"
     )
 else:
     st.success("✅ 未发现漏填合同号（基于放款明细-潮掣）。")
 
+# ========== 🗃️ 审核历史 (可选) ==========
+# 本次结果 (逐单元格错误与漏填合同号) 记入本地 SQLite，在“审核历史”页面按合同 / 期间查询
+with st.sidebar.expander("🗃️ 保存到审核历史"):
+    st.caption(f"历史库：{audit_history.HISTORY_DB}")
+    history_period = st.text_input("审核期间 (YYYY-MM)", value=audit_history.current_period())
+    if not audit_history.valid_period(history_period):
+        st.error("审核期间格式应为 YYYY-MM")
+    else:
+        history_key = audit_history.run_key(tc_digest, ref_digests, history_period)
+        history_run = audit_history.find_run(history_key)
+        if history_run is None and st.button("保存本次审核", key="save_history"):
+            with st.spinner("正在记录审核历史..."):
+                history_run, _ = audit_history.record_audit(
+                    history_key,
+                    {"period": history_period, "source": "app", "tc_file": tc_file.name,
+                     "ref_files": {"fk": fk_file.name, "ec": ec_file.name, "orig": original_file.name}},
+                    results, all_std_dfs, ref_index, missing_contracts
+                )
+        if history_run is not None:
+            st.success(f"已记入审核历史：run {history_run}")
+
 # ========== 下载区 ==========
 st.divider()
 st.subheader("📤 下载审核结果文件")
 
-for tag, (full, err, errs, rows) in results.items():
-    st.write(f"📘 **{tag}**：发现 {errs} 个错误，共 {rows} 行异常")
-    st.download_button(
-        f"📥 下载 {tag} 审核标注版",
-        data=full,
-        file_name=f"提成_{tag}_审核标注版.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        key=f"download_full_{tag}" # 确保Key唯一
+# --- 全部打包 (ZIP)：各 sheet 的审核标注版 / 错误精简版、漏填合同号表、汇总表 ---
+# 逐个文件直接写入 ZIP；已单独生成过的文件从缓存复用
+artifact_keys = {MISSING_FILE_NAME: (tc_digest, ref_digests, "漏填合同号")}
+for tag in results:
+    for kind in ["审核标注版", "错误精简版"]:
+        artifact_keys[artifact_file_name(tag, kind)] = (tc_digest, ref_digests, cols_spec_digest, rules_digest, tag, kind)
+
+def build_bundle():
+    def cached(name):
+        entry = get_artifact(artifact_keys[name]) if name in artifact_keys else None
+        return entry[0] if entry else None
+    # ZIP 先写入临时文件，再一次读出为 bytes 放入缓存：内存中只有一份
+    with tempfile.TemporaryFile() as output:
+        _, stats = measure_call(
+            write_result_bundle, output, tc_file, results, missing_contracts,
+            lambda: load_key_index(ref_digests, cols_spec_digest, fk_std), cached
+        )
+        output.seek(0)
+        return output.read(), stats
+
+lazy_download(
+    (tc_digest, ref_digests, cols_spec_digest, rules_digest, "打包下载"),
+    "全部结果 (ZIP)",
+    f"{os.path.splitext(tc_file.name)[0]}_审核结果.zip",
+    build_bundle,
+    "bundle",
+    mime="application/zip"
+)
+
+# --- 原文件标注版：在上传的提成表上直接标色，保留原格式、公式与列宽；只改写被标记的单元格，生成很快 ---
+lazy_download(
+    (tc_digest, ref_digests, cols_spec_digest, rules_digest, "原文件标注版"),
+    "原文件标注版（所有 sheet，保留原格式）",
+    f"{os.path.splitext(tc_file.name)[0]}_标注.xlsx",
+    lambda: patch_marked_xlsx(tc_file, results),
+    "patched"
+)
+
+for tag, (df, result) in results.items():
+    st.write(f"📘 **{tag}**：发现 {result['total_errors']} 个错误，共 {result['error_rows']} 行异常")
+    if len(result["unmatched_rows"]):
+        st.caption(f"🔎 {len(result['unmatched_rows'])} 个合同号在放款明细中查不到，最接近的参考合同号见审核标注版中的“合同号未匹配” sheet")
+    artifact_key = (tc_digest, ref_digests, cols_spec_digest, rules_digest, tag)
+    lazy_download(
+        artifact_key + ("审核标注版",),
+        f"{tag} 审核标注版",
+        artifact_file_name(tag, "审核标注版"),
+        lambda df=df, result=result: build_sheet_artifact(
+            read_output_sheet(tc_file, df), result, "审核标注版",
+            near_miss_report(df, result, load_key_index(ref_digests, cols_spec_digest, fk_std))
+        ),
+        f"full_{tag}"
     )
     
     # --- VVVV (添加检查) VVVV ---
-    if rows > 0 and err is not None:
+    if result["error_rows"] > 0:
     # --- ^^^^ (添加检查) ^^^^ ---
+        lazy_download(
+            artifact_key + ("错误精简版",),
+            f"{tag} 错误精简版（含红黄标记）",
+            artifact_file_name(tag, "错误精简版"),
+            lambda df=df, result=result: build_sheet_artifact(read_output_sheet(tc_file, df), result, "错误精简版"),
+            f"err_{tag}"
+        )
+
+# --- 稀疏错误清单：每个错误单元格一行 (sheet, row, excel_row, column)，供下游工具使用 ---
+if any(result["total_errors"] for _, result in results.values()):
+    st.write("🧾 **错误单元格清单**（所有 sheet，每个错误单元格一行）")
+    error_cells = lambda: error_cells_frame({tag: result for tag, (_, result) in results.items()})
+    cells_key = (tc_digest, ref_digests, cols_spec_digest, rules_digest, "错误单元格")
+    lazy_download(
+        cells_key + ("csv",), "错误单元格清单 (CSV)", "提成_错误单元格.csv",
+        lambda: error_cells_bytes(error_cells(), "csv"), "cells_csv", mime="text/csv"
+    )
+    if parquet_available():
+        lazy_download(
+            cells_key + ("parquet",), "错误单元格清单 (Parquet)", "提成_错误单元格.parquet",
+            lambda: error_cells_bytes(error_cells(), "parquet"), "cells_parquet", mime="application/octet-stream"
+        )
+
+# ========== ⏱️ 性能分析 ==========
+PROFILE_COLUMNS = ["sheet", "阶段", "字段", "行数", "耗时(s)", "峰值内存(MB)", "来源"]
+
+if profiler:
+    profiler.disable()
+
+with st.expander("⏱️ 性能分析（各阶段 / 各字段的耗时、行数、峰值内存）"):
+    profile_df = pd.DataFrame(profile_rows, columns=PROFILE_COLUMNS)
+    st.dataframe(profile_df, use_container_width=True, hide_index=True)
+    computed = profile_df["来源"] == "本次计算"
+    st.caption(f"本次计算的阶段合计 {profile_df.loc[computed, '耗时(s)'].sum():.3f}s；峰值内存为相对阶段开始时的 RSS 增量")
+    st.download_button(
+        "📥 导出性能记录 (JSON)",
+        data=json.dumps(profile_df.astype(object).where(profile_df.notna(), None).to_dict("records"), ensure_ascii=False, indent=2),
+        file_name="审核_性能记录.json",
+        mime="application/json",
+        key="download_profile"
+    )
+    if profiler:
+        stats_text = io.StringIO()
+        pstats.Stats(profiler, stream=stats_text).sort_stats("cumulative").print_stats(40)
+        st.text("cProfile（按累计耗时排序前 40 项，多进程审核时子进程不在其中）")
+        st.code(stats_text.getvalue(), language=None)
         st.download_button(
-            f"📥 下载 {tag} 错误精简版（含红黄标记）",
-            data=err,
-            file_name=f"提成_{tag}_错误精简版.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            key=f"download_err_{tag}" # 确保Key唯一
+            "📥 导出 cProfile 结果",
+            data=stats_text.getvalue(),
+            file_name="审核_cProfile.txt",
+            mime="text/plain",
+            key="download_cprofile"
         )
 
 st.success("✅ 所有sheet审核完成！")
@@ -0,0 +1,327 @@
+# =====================================
+# 命令行批量审核：参考表只构建一次，审核目录中的所有提成表
+# 用法: python audit_cli.py <输入目录> [-o 输出目录] [--workers N] [--stream [--chunk-rows N]] [--zip] [--mark-mode patch]
+#       [--history [--period YYYY-MM]]
+# =====================================
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import audit_history
+import ref_cache
+
+from audit_core import (
+    read_tc_sheets, read_output_sheet, sheet_jobs_of, build_ref_tables, find_missing_contracts,
+    audit_one_sheet, audit_sheets_parallel, build_sheet_artifact, build_missing_artifact,
+    build_key_index, near_miss_report,
+    error_cells_frame, error_cells_bytes,
+    STREAM_CHUNK_ROWS, tc_sheet_names, stream_audit_sheet, missing_contracts_of,
+    artifact_file_name, MISSING_FILE_NAME, write_result_bundle, profile_stage,
+    PATCHED_FILE_NAME, patch_marked_xlsx,
+)
+
+REF_KEYWORDS = {"fk": "放款明细", "ec": "二次明细", "orig": "原表"}
+TC_KEYWORD = "提成"
+
+def log(msg):
+    print(msg, file=sys.stderr, flush=True)
+
+def cli_notify(level, msg):
+    """audit_core 的提示回调：输出到 stderr"""
+    log(f"[{level}] {msg}")
+
+def list_xlsx(directory):
+    """目录中的 xlsx 文件 (按文件名排序，跳过 Excel 打开时生成的 ~$ 临时文件)"""
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(".xlsx") and not name.startswith("~$")
+    )
+
+def find_ref_files(paths):
+    """按文件名关键字找到三个参考文件；缺少任一个时返回 None"""
+    refs = {}
+    for key, keyword in REF_KEYWORDS.items():
+        refs[key] = next((p for p in paths if keyword in os.path.basename(p)), None)
+    missing = [REF_KEYWORDS[k] for k, p in refs.items() if p is None]
+    if missing:
+        log(f"❌ 未找到参考文件：{'、'.join(missing)}")
+        return None
+    return refs
+
+def save_artifact(path, build, profile=None):
+    data, stats = build()
+    with open(path, "wb") as f:
+        f.write(data.getvalue())
+    name = os.path.basename(path)
+    if profile is not None and stats:
+        profile.append({"阶段": "写出文件", "字段": name, **stats})
+    return name
+
+def write_outputs(tc_path, out_dir, sheet_jobs, sheet_results, missing_contracts, write_files=True, profile=None, cells_format=None,
+                  key_index=None, bundle=False, mark_mode="rebuild"):
+    """
+    写出一个提成表的审核文件，返回该文件的汇总 dict；profile 为列表时追加写出阶段的性能记录。
+    cells_format 为 "csv" / "parquet" 时另写出稀疏错误清单 (每个错误单元格一行)。
+    key_index: callable，返回放款明细合同号的近似匹配索引 (标注版中的 “合同号未匹配” sheet 需要时才构建)。
+    分块审核的 sheet (结果中有 "outputs") 已在审核时写出，这里只汇总。
+    bundle 为 True 时所有文件连同汇总表打包为 <out_dir>.zip，不保留单独的文件 (见 write_bundle)。
+    mark_mode 为 "patch" 时不按 sheet 重新生成审核标注版，改为在原文件上直接标色，写出一个原文件标注版。
+    """
+    summary = {"sheets": {}, "skipped_sheets": [], "outputs": []}
+    if write_files and not bundle:
+        os.makedirs(out_dir, exist_ok=True)
+
+    for tag, result in sheet_results.items():
+        if result is None:
+            summary["skipped_sheets"].append(tag) # 未找到‘合同’列
+            continue
+        df = sheet_jobs[tag]
+        summary["sheets"][tag] = {
+            "rows": result["rows"] if "rows" in result else len(df),
+            "total_errors": result["total_errors"],
+            "error_rows": result["error_rows"],
+            "unmatched_contracts": len(result["unmatched_rows"]),
+            "fields": {col: int(n) for col, n in zip(result["marked_cols"], result["error_bitmap"].sum(axis=0))},
+        }
+        if "outputs" in result:
+            summary["outputs"].extend(os.path.basename(p) for p in result["outputs"])
+            continue
+        if not write_files or bundle:
+            continue
+        if mark_mode == "patch" and result["error_rows"] == 0:
+            continue
+        full_df = read_output_sheet(tc_path, df) # 精简读取的 sheet 在写出时才读取整表
+        if mark_mode == "rebuild":
+            summary["outputs"].append(save_artifact(
+                os.path.join(out_dir, artifact_file_name(tag, "审核标注版")),
+                lambda: build_sheet_artifact(full_df, result, "审核标注版",
+                                             near_miss_report(df, result, key_index()) if key_index else None), profile
+            ))
+        if result["error_rows"] > 0:
+            summary["outputs"].append(save_artifact(
+                os.path.join(out_dir, artifact_file_name(tag, "错误精简版")),
+                lambda: build_sheet_artifact(full_df, result, "错误精简版"), profile
+            ))
+
+    summary["missing_contracts"] = len(missing_contracts)
+    if bundle and write_files:
+        summary["bundle"] = write_bundle(tc_path, out_dir, sheet_jobs, sheet_results, missing_contracts, profile,
+                                         cells_format, key_index, mark_mode)
+        summary["outputs"] = []
+        return _sum_totals(summary)
+
+    if mark_mode == "patch" and summary["sheets"] and write_files:
+        sheets = {tag: (sheet_jobs[tag], result) for tag, result in sheet_results.items() if result is not None}
+        summary["outputs"].append(save_artifact(
+            os.path.join(out_dir, PATCHED_FILE_NAME), lambda: patch_marked_xlsx(tc_path, sheets), profile
+        ))
+
+    if cells_format and write_files:
+        summary["outputs"].append(save_artifact(
+            os.path.join(out_dir, f"提成_错误单元格.{cells_format}"),
+            lambda: error_cells_bytes(error_cells_frame(sheet_results), cells_format), profile
+        ))
+
+    if missing_contracts and write_files:
+        summary["outputs"].append(save_artifact(
+            os.path.join(out_dir, MISSING_FILE_NAME),
+            lambda: build_missing_artifact(missing_contracts)
+        ))
+    return _sum_totals(summary)
+
+def _sum_totals(summary):
+    """汇总各 sheet 的错误数与异常行数"""
+    summary["total_errors"] = sum(s["total_errors"] for s in summary["sheets"].values())
+    summary["error_rows"] = sum(s["error_rows"] for s in summary["sheets"].values())
+    return summary
+
+def write_bundle(tc_path, out_dir, sheet_jobs, sheet_results, missing_contracts, profile=None, cells_format=None,
+                 key_index=None, mark_mode="rebuild"):
+    """
+    把一个提成表的全部输出打包为 <out_dir>.zip (见 audit_core.write_result_bundle)，返回 {"file", "entries"}。
+    分块审核已写到 out_dir 的文件复制进 ZIP 后删除。
+    """
+    zip_path = f"{out_dir}.zip"
+    sheets = {tag: (sheet_jobs[tag], result) for tag, result in sheet_results.items() if result is not None}
+    extra = None
+    if cells_format:
+        data, _ = error_cells_bytes(error_cells_frame(sheet_results), cells_format)
+        extra = [(f"提成_错误单元格.{cells_format}", data.getvalue())]
+    os.makedirs(os.path.dirname(zip_path) or ".", exist_ok=True)
+    with profile_stage(profile, "写出文件", os.path.basename(zip_path)):
+        entries = write_result_bundle(zip_path, tc_path, sheets, missing_contracts, key_index, extra=extra,
+                                      mark_mode=mark_mode)
+    for _, result in sheets.values(): # 分块审核已写出的文件已复制进 ZIP
+        for path in result.get("outputs", []):
+            os.remove(path)
+    if os.path.isdir(out_dir) and not os.listdir(out_dir):
+        os.rmdir(out_dir)
+    return {"file": os.path.basename(zip_path), "entries": entries}
+
+def record_history(tc_path, refs, period, sheet_jobs, sheet_results, missing_contracts, all_std_dfs, ref_index):
+    """把一个提成表的审核结果记入审核历史，返回 run_id (同一输入与期间只记录一次)"""
+    ref_digests = tuple(ref_cache.content_digest(refs[k]) for k in REF_KEYWORDS)
+    key = audit_history.run_key(ref_cache.content_digest(tc_path), ref_digests, period)
+    meta = {"period": period, "source": "cli", "tc_file": os.path.basename(tc_path),
+            "ref_files": {k: os.path.basename(p) for k, p in refs.items()}}
+    sheets = {tag: (sheet_jobs[tag], result) for tag, result in sheet_results.items() if result is not None}
+    run_id, created = audit_history.record_audit(key, meta, sheets, all_std_dfs, ref_index, missing_contracts)
+    log(f"   🗃️ 审核历史：{'已记录' if created else '已存在'} run {run_id}")
+    return run_id
+
+def stream_file(tc_path, out_dir, all_std_dfs, ref_index, write_files, chunk_rows, key_index, details, mark_mode="rebuild"):
+    """
+    分块审核一个提成表：逐个 sheet 按块读取、审核并写出标注版 / 错误精简版 (见 audit_core.stream_audit_sheet)。
+    mark_mode 为 "patch" 时只写出错误精简版 (原文件标注版在 write_outputs 中生成)。
+    返回 ({tag: sheet名}, {tag: 审核结果}, 漏填合同号)。
+    """
+    sheet_names = tc_sheet_names(tc_path)
+    if write_files:
+        os.makedirs(out_dir, exist_ok=True)
+    sheet_results = {}
+    kinds = ("审核标注版", "错误精简版") if mark_mode == "rebuild" else ("错误精简版",)
+    for tag, sheet in sheet_names.items():
+        outputs = {kind: os.path.join(out_dir, artifact_file_name(tag, kind)) for kind in kinds} if write_files else None
+        result = stream_audit_sheet(tc_path, sheet, all_std_dfs, ref_index, outputs, chunk_rows,
+                                    key_index() if write_files and mark_mode == "rebuild" else None, details)
+        if result is not None:
+            peak = max((r["峰值内存(MB)"] or 0) for r in result["profile"])
+            log(f"   {tag}：{result['rows']} 行，每块 {chunk_rows} 行，峰值内存增量 {peak} MB")
+        sheet_results[tag] = result
+    total = sheet_results.get("总")
+    return sheet_names, sheet_results, missing_contracts_of(all_std_dfs["fk"], total and total["fk_keys_seen"])
+
+def run_batch(input_dir, output_dir, ref_dir=None, workers=1, write_files=True, ref_disk_cache=True, profile=False,
+              cells_format=None, history_period=None, stream=False, chunk_rows=STREAM_CHUNK_ROWS, bundle=False,
+              mark_mode="rebuild"):
+    """
+    批量审核：参考表只读取、预处理一次，依次审核 input_dir 中文件名含“提成”的每个文件。
+    每个提成表的结果写入 output_dir/<文件名>/，汇总写入 output_dir/summary.json。
+    profile 为 True 时汇总中附带各阶段 / 各字段的耗时、行数、峰值内存记录。
+    history_period 不为 None 时，每个提成表的审核结果记入审核历史 (见 audit_history.py)，期间为该值。
+    stream 为 True 时逐个 sheet 分块审核 (每块 chunk_rows 行) 并直接写出，用于内存放不下的超大提成表。
+    bundle 为 True 时每个提成表的结果打包为 output_dir/<文件名>.zip (含汇总表)。
+    mark_mode: "rebuild" 按 sheet 重新生成审核标注版；"patch" 在原文件上直接标色 (见 audit_core.patch_marked_xlsx)。
+    返回汇总 dict；参考文件不全时返回 None。
+    """
+    t_start = time.perf_counter()
+    input_paths = list_xlsx(input_dir)
+    refs = find_ref_files(list_xlsx(ref_dir) if ref_dir else input_paths)
+    if refs is None:
+        return None
+    tc_paths = [p for p in input_paths if TC_KEYWORD in os.path.basename(p)]
+    if not tc_paths:
+        log(f"⚠️ {input_dir} 中没有文件名包含“{TC_KEYWORD}”的文件")
+
+    # 1. 参考表 (只构建一次)
+    t0 = time.perf_counter()
+    ref_profile = [] if profile else None
+    all_std_dfs, ref_index = build_ref_tables(refs["fk"], refs["ec"], refs["orig"], notify=cli_notify,
+                                              disk_cache=ref_disk_cache, profile=ref_profile)
+    ref_seconds = round(time.perf_counter() - t0, 3)
+    log(f"✅ 参考表已预处理 ({ref_seconds}s)：" + "、".join(f"{k} {len(df)} 行" for k, df in all_std_dfs.items()))
+    key_index_cache = []
+
+    def key_index():
+        """近似匹配索引：第一次写出标注版时构建，所有提成表共用"""
+        if not key_index_cache:
+            key_index_cache.append(build_key_index(all_std_dfs["fk"]))
+        return key_index_cache[0]
+
+    files = []
+    for n, tc_path in enumerate(tc_paths, start=1):
+        name = os.path.basename(tc_path)
+        log(f"📘 [{n}/{len(tc_paths)}] {name}")
+        t0 = time.perf_counter()
+        file_profile = [] if profile else None
+        try:
+            out_dir = os.path.join(output_dir, os.path.splitext(name)[0])
+            if stream:
+                sheet_jobs, sheet_results, missing_contracts = stream_file(
+                    tc_path, out_dir, all_std_dfs, ref_index, write_files, chunk_rows, key_index, history_period is not None,
+                    mark_mode
+                )
+            else:
+                tc_sheets = read_tc_sheets(tc_path, file_profile)
+                sheet_jobs = sheet_jobs_of(tc_sheets)
+                if workers > 1 and len(sheet_jobs) > 1:
+                    sheet_results = audit_sheets_parallel(sheet_jobs, all_std_dfs, ref_index, workers)
+                else:
+                    sheet_results = {tag: audit_one_sheet(df, all_std_dfs, ref_index) for tag, df in sheet_jobs.items()}
+                missing_contracts = find_missing_contracts(tc_sheets, all_std_dfs["fk"])
+            if profile:
+                for tag, result in sheet_results.items():
+                    if result is not None:
+                        file_profile.extend({"sheet": tag, **r} for r in result["profile"])
+            entry = write_outputs(tc_path, out_dir, sheet_jobs, sheet_results, missing_contracts, write_files, file_profile,
+                                  cells_format, key_index, bundle, mark_mode)
+            if history_period is not None:
+                entry["history_run_id"] = record_history(tc_path, refs, history_period, sheet_jobs, sheet_results,
+                                                         missing_contracts, all_std_dfs, ref_index)
+            entry["status"] = "ok"
+        except Exception as e: # 单个文件出错不影响其余文件
+            entry = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+            log(f"❌ {name}：{entry['error']}")
+        entry = {"file": name, **entry, "seconds": round(time.perf_counter() - t0, 3)}
+        if profile:
+            entry["profile"] = file_profile
+        files.append(entry)
+        if entry["status"] == "ok":
+            log(f"   发现 {entry['total_errors']} 个错误，共 {entry['error_rows']} 行异常，漏填合同号 {entry['missing_contracts']} 个")
+
+    summary = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "input_dir": os.path.abspath(input_dir),
+        "reference_files": {k: os.path.basename(p) for k, p in refs.items()},
+        "reference_rows": {k: len(df) for k, df in all_std_dfs.items()},
+        "reference_seconds": ref_seconds,
+        **({"reference_profile": ref_profile} if profile else {}),
+        "files": files,
+        "failed": sum(f["status"] != "ok" for f in files),
+        "seconds": round(time.perf_counter() - t_start, 3),
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="提成表批量审核 (无界面)")
+    parser.add_argument("input_dir", help="包含提成表的目录 (默认参考文件也在此目录中)")
+    parser.add_argument("-o", "--output-dir", help="输出目录，默认 <输入目录>/审核结果")
+    parser.add_argument("--ref-dir", help="参考文件 (放款明细 / 二次明细 / 原表) 所在目录，默认同输入目录")
+    parser.add_argument("--workers", type=int, default=1, help="并行审核进程数，1 = 逐个 sheet 审核")
+    parser.add_argument("--summary-only", action="store_true", help="只写 summary.json，不写 xlsx")
+    parser.add_argument("--no-ref-cache", action="store_true", help="不使用参考表磁盘缓存 (见 ref_cache.py)")
+    parser.add_argument("--cells", choices=["csv", "parquet"], help="另写出稀疏错误清单 (sheet, row, excel_row, column)")
+    parser.add_argument("--profile", action="store_true", help="在 summary.json 中记录各阶段 / 各字段的耗时与峰值内存")
+    parser.add_argument("--stream", action="store_true", help="分块流式审核 (超大提成表：按块读取、审核并直接写出，内存与块大小有关)")
+    parser.add_argument("--chunk-rows", type=int, default=STREAM_CHUNK_ROWS, help=f"--stream 时每块行数，默认 {STREAM_CHUNK_ROWS}")
+    parser.add_argument("--zip", action="store_true", help="每个提成表的结果打包为一个 <文件名>.zip (含汇总表)，不写出单独的文件")
+    parser.add_argument("--mark-mode", choices=["rebuild", "patch"], default="rebuild",
+                        help="审核标注版的生成方式：rebuild 按 sheet 重新写出 (默认)；"
+                             "patch 在原文件上直接标色 (保留原格式与公式，写出开销与错误数成正比)")
+    parser.add_argument("--history", action="store_true", help="把审核结果记入审核历史 (见 audit_history.py)")
+    parser.add_argument("--period", help="审核历史中的期间 (YYYY-MM)，默认当前月份")
+    args = parser.parse_args(argv)
+
+    if args.period and not audit_history.valid_period(args.period):
+        parser.error("--period 格式应为 YYYY-MM")
+    if args.chunk_rows < 1:
+        parser.error("--chunk-rows 应为正整数")
+
+    output_dir = args.output_dir or os.path.join(args.input_dir, "审核结果")
+    summary = run_batch(args.input_dir, output_dir, args.ref_dir, args.workers, not args.summary_only,
+                        not args.no_ref_cache, args.profile, args.cells,
+                        (args.period or audit_history.current_period()) if args.history else None,
+                        args.stream, args.chunk_rows, args.zip, args.mark_mode)
+    if summary is None:
+        return 2
+    log(f"✅ 完成：{len(summary['files'])} 个文件，汇总见 {os.path.join(output_dir, 'summary.json')}")
+    return 1 if summary["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
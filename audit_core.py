@@ -0,0 +1,2091 @@
+# =====================================
+# 审核核心：标准化、参考表索引、字段比对、标注输出
+# (不依赖 Streamlit，可在子进程 / 命令行中直接调用)
+# =====================================
+import os
+import posixpath
+import re
+import shutil
+import sys
+import threading
+import time
+import unicodedata
+import multiprocessing
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+from io import BytesIO
+from itertools import islice, zip_longest
+from xml.etree import ElementTree as ET
+
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import Cell, WriteOnlyCell
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from openpyxl.styles import PatternFill
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.utils.dataframe import dataframe_to_rows
+
+import ref_cache
+
+# ========== 标准化工具 ==========
+def normalize_text(val):
+    if pd.isna(val):
+        return ""
+    s = str(val)
+    s = re.sub(r'[\n\r\t ]+', '', s)
+    s = s.replace('\u3000', '')
+    return ''.join(unicodedata.normalize('NFKC', ch) for ch in s).lower().strip()
+
+def normalize_num(val):
+    if pd.isna(val):
+        return None
+    s = str(val).replace(",", "").strip() # <--- 1. 不再替换 "%"
+    if s in ["", "-", "nan"]:
+        return None
+    try:
+        # 2. 在这里检查和处理 "%"
+        if "%" in s:
+            s = s.replace("%", "")
+            return float(s) / 100
+        return float(s)
+    except:
+        return s
+
+# ---------- 列式 (向量化) 标准化：与上面的逐值函数语义一致 ----------
+def is_blank_vec(series):
+    """
+    向量化空值判断：NA 或 str 后为 ""/"nan"/"None"。
+    数值/日期列的 str 形式只可能因 NA 而为 "nan"/"NaT"，直接用 isna 即可。
+    """
+    na = series.isna()
+    if pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return na
+    txt = series[~na].astype(str).str.strip()
+    return na | txt.isin(["", "nan", "None"]).reindex(series.index, fill_value=False)
+
+def normalize_text_vec(series):
+    """
+    normalize_text 的列式版本：NA -> ""，去除空白/全角空格，整串 NFKC，小写，strip。
+    先按字符串去重，只对唯一值做标准化再映射回整列 (人员、类型等列重复度很高)；
+    纯 ASCII 字符串在 NFKC 下不变，只对含非 ASCII 字符的值做 normalize。
+    """
+    obj = series.astype(object)
+    na = obj.isna()
+    codes, uniques = pd.factorize(obj.where(~na, "").astype(str))
+    txt = pd.Series(uniques, dtype=object)
+    txt = txt.str.replace(r'[\n\r\t ]+', '', regex=True).str.replace('\u3000', '', regex=False)
+    non_ascii = txt.str.contains(r'[^\x00-\x7f]', regex=True)
+    if non_ascii.any():
+        txt[non_ascii] = txt[non_ascii].str.normalize('NFKC')
+    txt = txt.str.lower().str.strip()
+    return pd.Series(txt.to_numpy()[codes], index=series.index)
+
+def num_parts_vec(series):
+    """
+    normalize_num 的列式版本 (不含整列推断，见 _none_as_num)：返回 (values, is_num, none_mask)。
+    values 为 float64 (非数值为 NaN)，is_num 对应逐值版本中 “结果为 float” 的位置 (含 "NaN" 这类解析为 nan 的字符串)。
+    none_mask 为逐值版本返回 None 的位置 (空值、""、"-")。
+    """
+    na = series.isna()
+    if pd.api.types.is_integer_dtype(series.dtype) or pd.api.types.is_float_dtype(series.dtype):
+        # 数值列：float(str(x)) == float(x)，无需经过字符串
+        return series.astype(float), ~na, na
+
+    values = pd.Series(np.nan, index=series.index, dtype=float)
+    is_num = pd.Series(False, index=series.index)
+
+    txt = series[~na].astype(object).astype(str).str.replace(",", "", regex=False).str.strip()
+    is_empty = txt.isin(["", "-", "nan"])
+    none_mask = na | is_empty.reindex(series.index, fill_value=False)
+    txt = txt[~is_empty]
+    if txt.empty:
+        return values, is_num, none_mask
+
+    # 百分号预处理：去掉 "%" 后解析，再 /100
+    pct = txt.str.contains("%", regex=False)
+    body = txt.where(~pct, txt.str.replace("%", "", regex=False))
+    parsed = pd.to_numeric(body, errors='coerce').astype(float)
+    parsed[pct] = parsed[pct] / 100
+
+    ok = parsed.notna()
+    values[parsed.index[ok]] = parsed[ok]
+    is_num[parsed.index[ok]] = True
+
+    # to_numeric 解析不了的少量值 (全角数字、"NaN"、"1_000" 等) 回退到逐值函数，保证结果一致
+    rest = parsed.index[~ok]
+    if len(rest):
+        fallback = series[rest].apply(normalize_num)
+        fb_is_num = fallback.apply(lambda x: isinstance(x, float))
+        values[rest[fb_is_num.to_numpy()]] = fallback[fb_is_num].astype(float)
+        is_num[rest[fb_is_num.to_numpy()]] = True
+    return values, is_num, none_mask
+
+def none_as_num_flag(is_num, none_mask):
+    """整列推断：只含数值与空值 (且至少有一个数值) 时，空值也算数值"""
+    return bool(is_num.any() and not (~is_num & ~none_mask).any())
+
+def _none_as_num(values, is_num, none_mask, as_num=None):
+    """
+    复刻 Series.apply(normalize_num) 的 dtype 推断：结果只含 float 与 None 时，
+    整列被推断为 float64 (None -> NaN)，空值位置在 isinstance(x, float) 检查下也算数值。
+    as_num 给出时使用该整列判定 (只比对部分行时由调用方按整列算出)。
+    """
+    if as_num is None:
+        as_num = none_as_num_flag(is_num, none_mask)
+    if as_num:
+        is_num = is_num | none_mask
+    return values, is_num
+
+# ---------- 日期标准化：逐值解析，结果与列中其他值无关 ----------
+EXCEL_EPOCH = np.datetime64("1899-12-30", "D") # Excel 序列号 0 对应的日期 (1900 日期系统)
+_MAX_EXCEL_SERIAL = (pd.Timestamp.max.date() - EXCEL_EPOCH.astype(object)).days - 1
+# 日期文本的固定格式 (%m / %d / %H 可不补零)；都不匹配的文本不算日期
+DATE_FORMATS = tuple(d + t for d in ("%Y-%m-%d", "%Y/%m/%d", "%Y.%m.%d", "%Y年%m月%d日", "%Y%m%d")
+                     for t in ("", " %H:%M:%S", " %H:%M", "T%H:%M:%S"))
+# 时间后的小数秒与时区 (Z / +08:00 / +0800) 在匹配格式前去掉：按文本所写的当地日期比对，不换算时区
+_FRACTION_SECONDS = r"(\d:\d{2}:\d{2})\.\d{1,9}"
+_TIME_ZONE = r"(\d:\d{2}(?::\d{2})?)\s?(?:Z|[+-]\d{2}:?\d{2})$"
+
+def _date_format_of(text):
+    """文本匹配的 DATE_FORMATS 中的格式，都不匹配时为 None"""
+    for fmt in DATE_FORMATS:
+        try:
+            datetime.strptime(text, fmt)
+            return fmt
+        except ValueError:
+            continue
+    return None
+
+def _excel_serial_dates(values):
+    """Excel 序列号 (1899-12-30 起的天数，小数部分为时间) -> datetime64 日期；超出范围的为 NaT"""
+    days = np.floor(np.asarray(values, dtype=float))
+    ok = (days >= 1) & (days <= _MAX_EXCEL_SERIAL)
+    out = np.full(len(days), np.datetime64("NaT"), dtype="datetime64[ns]")
+    out[ok] = EXCEL_EPOCH + days[ok].astype("timedelta64[D]")
+    return out
+
+def _numeric_dates(values):
+    """
+    数值 -> datetime64 日期：19000101~29991231 之间的整数按 yyyymmdd (与文本 "20250103" 一致，不是有效日期的为 NaT)，
+    其余按 Excel 序列号 (序列号不超过 _MAX_EXCEL_SERIAL，两者不会混淆)
+    """
+    values = np.asarray(values, dtype=float)
+    ymd = (values >= 19000101) & (values <= 29991231) & (values == np.floor(values))
+    out = _excel_serial_dates(np.where(ymd, np.nan, values))
+    if ymd.any():
+        n = values[ymd].astype("int64")
+        out[ymd] = pd.to_datetime(pd.DataFrame({"year": n // 10000, "month": n // 100 % 100, "day": n % 100}),
+                                  errors="coerce").to_numpy()
+    return out
+
+def _text_dates(texts):
+    """
+    日期文本 (已去重) -> datetime64。整列的格式只检测一次 (首个文本匹配的格式)，先按该格式整批解析，
+    剩下的文本再依次按其余格式解析。
+    """
+    texts = pd.Series(texts, dtype=object).str.strip()
+    texts = texts.str.replace(_FRACTION_SECONDS, r"\1", regex=True).str.replace(_TIME_ZONE, r"\1", regex=True)
+    out = pd.Series(pd.NaT, index=texts.index, dtype="datetime64[ns]")
+    first = _date_format_of(texts.iloc[0]) if len(texts) else None
+    todo = texts
+    for fmt in ([first] if first else []) + [f for f in DATE_FORMATS if f != first]:
+        parsed = pd.to_datetime(todo, format=fmt, errors="coerce")
+        out[parsed.index[parsed.notna()]] = parsed[parsed.notna()]
+        todo = todo[parsed.isna()]
+        if todo.empty:
+            break
+    return out.to_numpy()
+
+def _without_tz(value):
+    """带时区的 datetime / Timestamp -> 同一当地时间的无时区值 (其余值不变)"""
+    return value.replace(tzinfo=None) if getattr(value, "tzinfo", None) is not None else value
+
+def _object_dates(values):
+    """datetime / date / Timestamp 等对象 -> datetime64 (带时区的取当地时间)"""
+    parse = lambda v: pd.to_datetime(pd.Series(v, dtype=object), errors="coerce", format="mixed", cache=False)
+    dates = parse(values)
+    # 带时区的值会让结果带时区，或与无时区的值混在一起时解析为 NaT；只有这时才逐值去掉时区重新解析
+    missing = dates.isna().to_numpy()
+    if isinstance(dates.dtype, pd.DatetimeTZDtype) or (missing.any() and pd.notna(values[missing]).any()):
+        dates = parse(np.frompyfunc(_without_tz, 1, 1)(values))
+    return dates.to_numpy(dtype="datetime64[ns]")
+
+def normalize_date_vec(series):
+    """
+    日期比对用的标准化：-> datetime64 Series (只保留日期，不是日期的为 NaT)。
+    按值的表示方式直接换算，不逐值推断：datetime 取日期；数值为 Excel 序列号 (yyyymmdd 形式的整数按年月日)；
+    文本按 DATE_FORMATS 中的固定格式解析 (先去重，只解析唯一值；可带小数秒与时区)。object 列按值的类型分组换算。
+    带时区的值取所写的当地日期 (去掉时区，不换算)。
+    """
+    dtype = series.dtype
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        return series.dt.tz_localize(None).dt.normalize()
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return series.dt.normalize()
+    if pd.api.types.is_bool_dtype(dtype):
+        return pd.Series(pd.NaT, index=series.index, dtype="datetime64[ns]")
+    if pd.api.types.is_numeric_dtype(dtype):
+        return pd.Series(_numeric_dates(series), index=series.index)
+
+    values = np.asarray(series, dtype=object)
+    inferred = pd.api.types.infer_dtype(values, skipna=True)
+    if inferred == "string":
+        groups = [(str, np.ones(len(values), dtype=bool))]
+    elif inferred in ("datetime", "date"):
+        groups = [(datetime, np.ones(len(values), dtype=bool))]
+    else:
+        type_codes, types = pd.factorize(np.frompyfunc(type, 1, 1)(values))
+        groups = [(t, type_codes == code) for code, t in enumerate(types)]
+
+    out = np.full(len(values), np.datetime64("NaT"), dtype="datetime64[ns]")
+    for kind, mask in groups:
+        if issubclass(kind, str):
+            codes, uniques = pd.factorize(values[mask])
+            parsed = np.append(_text_dates(uniques), np.datetime64("NaT")) # 末位：空值 (codes 为 -1)
+            out[mask] = parsed[codes]
+        elif issubclass(kind, (bool, np.bool_)):
+            continue
+        elif issubclass(kind, (int, float, np.number)):
+            out[mask] = _numeric_dates(values[mask].astype(float))
+        else: # datetime / date / Timestamp (含 None)；时间等不算日期
+            out[mask] = _object_dates(values[mask])
+    return pd.Series(out, index=series.index).dt.normalize()
+
+def find_col(df_like, keyword, exact=False):
+    key = keyword.strip().lower()
+    columns = df_like.columns if hasattr(df_like, "columns") else df_like.index
+    for col in columns:
+        cname = str(col).strip().lower()
+        if (exact and cname == key) or (not exact and key in cname):
+            return col
+    return None
+
+def normalize_contract_key(series: pd.Series) -> pd.Series:
+    """
+    对合同号 Series 进行标准化处理，用于安全的 pd.merge 操作。
+    """
+    s = series.astype(str)
+    s = s.str.replace(r"\.0$", "", regex=True) 
+    s = s.str.strip()
+    s = s.str.upper() 
+    s = s.str.replace('－', '-', regex=False)
+    # (这个版本不移除内部空格，因为合同号可能包含它们)
+    return s
+
+# ========== 计时 / 内存统计 ==========
+def current_rss_bytes():
+    """当前进程常驻内存 (RSS)；读取 /proc/self/statm，非 Linux 平台返回 None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+@contextmanager
+def measure():
+    """
+    统计 with 块的耗时与峰值内存，结果在退出时写入 yield 出的 dict：{"耗时(s)": ..., "峰值内存(MB)": ...}
+    峰值内存由后台线程每 10ms 采样一次 RSS 得到，记为相对开始时的增量 (不拖慢被测代码)。
+    """
+    stats = {}
+    baseline = current_rss_bytes()
+    peak = [baseline or 0]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.01):
+            peak[0] = max(peak[0], current_rss_bytes() or 0)
+
+    sampler = threading.Thread(target=sample, daemon=True) if baseline is not None else None
+    if sampler:
+        sampler.start()
+    t0 = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        elapsed = time.perf_counter() - t0
+        done.set()
+        if sampler:
+            sampler.join()
+            peak[0] = max(peak[0], current_rss_bytes() or 0)
+        stats["耗时(s)"] = round(elapsed, 3)
+        stats["峰值内存(MB)"] = round((peak[0] - baseline) / 1024 ** 2, 1) if baseline is not None else None
+
+def measure_call(fn, *args, **kwargs):
+    """执行 fn 并统计耗时与峰值内存，返回 (fn 的结果, {"耗时(s)": ..., "峰值内存(MB)": ...})"""
+    with measure() as stats:
+        result = fn(*args, **kwargs)
+    return result, stats
+
+@contextmanager
+def profile_stage(profile, stage, field="", rows=None):
+    """
+    把 with 块记为一条性能记录，追加到 profile 列表 (profile 为 None 时不记录、不计时)。
+    记录：{"阶段", "字段", "行数", "耗时(s)", "峰值内存(MB)"}；行数在块内才知道时可写入 yield 出的记录。
+    """
+    if profile is None:
+        yield {}
+        return
+    record = {"阶段": stage, "字段": field, "行数": rows}
+    with measure() as stats:
+        yield record
+    record.update(stats)
+    profile.append(record)
+
+# ========== 字段规则 FIELD_RULES (声明式) ==========
+# {提成表字段关键字: 规则}
+#   src / ref  : 参考数据源与参考列关键字 (对应 prepare_ref_df 生成的 ref_<前缀>_<标准名> 列)
+#   compare    : 比对方式 date / num / rate / term / text
+#   tol / mult : 数值容差 / 参考值乘数 (期限：年 -> 月)
+#   exact      : 提成表列名是否精确匹配
+#   override   : 条件覆盖参考值 —— when 列 (精确匹配，标准化后) 等于 equals 的行改用 src / ref；
+#                提成表中没有 when 列时跳过该字段
+# 新增字段只需在这里加一条规则
+FIELD_RULES = {
+    "放款日期": {"src": "放款明细", "ref": "放款日期", "compare": "date"},
+    "提报人员": {"src": "放款明细", "ref": "提报人员", "compare": "text"},
+    "城市经理": {"src": "放款明细", "ref": "城市经理", "compare": "text"},
+    "租赁本金": {"src": "放款明细", "ref": "租赁本金", "compare": "num"},
+    "收益率": {"src": "放款明细", "ref": "xirr", "compare": "rate", "tol": 0.005,
+            "override": {"when": "人员类型", "equals": "轻卡", "src": "原表", "ref": "年化nim"}},
+    "期限": {"src": "放款明细", "ref": "租赁期限/年", "compare": "term", "tol": 0.5, "mult": 12, "exact": True},
+    "家访": {"src": "放款明细", "ref": "家访", "compare": "num"},
+    "人员类型": {"src": "放款明细", "ref": "类型", "compare": "text", "exact": True},
+    "二次交接": {"src": "二次明细", "ref": "出本流程时间", "compare": "date"},
+    "计算提成金额": {"src": "放款明细", "ref": "放款金额", "compare": "text"},
+}
+
+SRC_PREFIX = {"放款明细": "fk", "二次明细": "ec", "原表": "orig"}
+
+def ref_col_name(src, ref_kw):
+    return f"ref_{SRC_PREFIX[src]}_{ref_kw}"
+
+def ref_date_col(col):
+    """参考列预先解析好的日期列 (normalize_date_vec 的结果，随参考表一起缓存)"""
+    return f"{col}__DATE__"
+
+def _rule_ref_cols(rules):
+    return {ref_col_name(r["src"], r["ref"]) for r in rules} | \
+        {ref_col_name(r["override"]["src"], r["override"]["ref"]) for r in rules if "override" in r}
+
+# 按日期比对的参考列 (预处理参考表时解析一次)
+RULE_DATE_REF_COLS = _rule_ref_cols([r for r in FIELD_RULES.values() if r["compare"] == "date"])
+# 规则实际用到的参考列 (查找参考数据时只取这些列)
+RULE_REF_COLS = _rule_ref_cols(FIELD_RULES.values()) | {ref_date_col(c) for c in RULE_DATE_REF_COLS}
+
+# ========== 读取文件 & 参考表预处理 ==========
+# 注：audit_columns / _compact_text_columns 依赖下方的字段规则编译 (compile_sheet_plan)
+def pick_excel_engine():
+    """
+    选择读取 xlsx 的引擎：已安装 python-calamine 时优先使用 calamine (Rust 实现，解析更快)，
+    否则回退到 openpyxl (pandas 默认以 read_only 模式打开)。
+    """
+    try:
+        import python_calamine  # noqa: F401
+        return "calamine"
+    except ImportError:
+        return "openpyxl"
+
+EXCEL_ENGINE = pick_excel_engine()
+
+def read_sheets_once(file, choose_sheets=None, choose_columns=None):
+    """
+    单次解析工作簿：只打开一次 ExcelFile，一次调用读取所有需要的 sheet。
+    file: 文件路径或文件对象 (如 Streamlit 上传的文件)
+    choose_sheets: callable(sheet_names) -> 需要读取的 sheet 名列表；None 表示全部 sheet
+    choose_columns: callable(表头列名列表) -> 需要的列；None 表示全部列 (见 _parse_columns)
+    返回 {sheet名: DataFrame}，顺序与工作簿中一致。
+    """
+    if hasattr(file, "seek"):
+        file.seek(0)
+    xls = pd.ExcelFile(file, engine=EXCEL_ENGINE)
+    try:
+        names = list(xls.sheet_names)
+        if choose_sheets is not None:
+            names = list(choose_sheets(names))
+        if not names:
+            return {}
+        if choose_columns is None:
+            return xls.parse(sheet_name=names)
+        return {name: _parse_columns(xls, name, choose_columns) for name in names}
+    finally:
+        xls.close()
+
+def _convert_cell(cell):
+    """与 pandas 的 openpyxl 读取器相同的单元格转换：空 -> ""，错误值 -> NaN，整数值的浮点 -> int"""
+    if cell.value is None:
+        return ""
+    if cell.data_type == TYPE_ERROR:
+        return np.nan
+    if cell.data_type == TYPE_NUMERIC:
+        val = int(cell.value)
+        return val if val == cell.value else float(cell.value)
+    return cell.value
+
+def _parse_columns(xls, sheet_name, choose_columns):
+    """
+    只解析 sheet 中需要的列。
+    表头仍由 pandas 解析 (重名列、Unnamed 列的命名规则不变)；openpyxl 引擎下逐行流式读取，
+    每行只转换并保留所选列，不在内存中生成整张表的单元格列表 (read_excel 的 usecols 是在整表读入后才筛选)。
+    数据同样经 TextParser 做类型推断，结果与 read_excel 读整表后取这些列一致。其他引擎退回 usecols。
+    """
+    header = list(xls.parse(sheet_name=sheet_name, nrows=0).columns)
+    wanted = set(choose_columns(header))
+    positions = [i for i, c in enumerate(header) if c in wanted]
+    if not positions:
+        return xls.parse(sheet_name=sheet_name)
+    if xls.engine != "openpyxl":
+        return xls.parse(sheet_name=sheet_name, usecols=positions)
+
+    ws = xls.book[sheet_name]
+    if xls.book.read_only:
+        ws.reset_dimensions() # 部分生成工具写出的 dimension 不准确 (与 pandas 相同处理)
+    data = []
+    last_row_with_data = -1
+    for n, row in enumerate(ws.iter_rows(min_row=2)):
+        width = len(row)
+        data.append([_convert_cell(row[p]) if p < width else "" for p in positions])
+        # 是否为空行按整行判断 (与整表读取时裁掉末尾空行的规则一致)
+        if any(cell.value is not None and cell.value != "" for cell in row):
+            last_row_with_data = n
+    data = data[: last_row_with_data + 1]
+    if not data:
+        return xls.parse(sheet_name=sheet_name, usecols=positions)
+    return TextParser(data, names=[header[p] for p in positions], header=None, skip_blank_lines=False).read()
+
+def read_tc_sheets(tc_file, profile=None, lean=True):
+    """
+    读取主表 (提成)：一次读出 “总” sheet 及所有 轻卡 / 重卡 sheet，返回 {"总": [...], "轻卡": [...], "重卡": [...]}
+    lean=True 时只读审核用到的列 (见 audit_columns)，低基数的文本列转为 category；
+    写出标注版时再用 read_output_sheet 按需读取整张 sheet。每个 DataFrame 的 attrs 记录 sheet 名与是否精简读取。
+    """
+    with profile_stage(profile, "读取提成表", "仅审核列" if lean else "整表") as rec:
+        tc_raw = read_sheets_once(tc_file, pick_tc_sheets, audit_columns if lean else None)
+        rec["行数"] = sum(len(df) for df in tc_raw.values())
+    for name, df in tc_raw.items():
+        if lean:
+            _compact_text_columns(df)
+        df.attrs.update(sheet_name=name, lean=lean)
+    return group_tc_sheets(tc_raw)
+
+def pick_tc_sheets(names):
+    """需要审核的 sheet：第一个名称含 “总” 的 sheet，以及所有 轻卡 / 重卡 sheet"""
+    sheet_total = next((s for s in names if "总" in s), None)
+    picked = ([sheet_total] if sheet_total else []) + \
+             [s for s in names if "轻卡" in s or "重卡" in s]
+    return list(dict.fromkeys(picked))
+
+def group_tc_sheets(by_name):
+    """{sheet名: 值} -> {"总": [...], "轻卡": [...], "重卡": [...]} (值为 DataFrame 或 sheet 名)"""
+    sheet_total = next((s for s in by_name if "总" in s), None)
+    return {
+        "总": [by_name[sheet_total]] if sheet_total else [],
+        "轻卡": [v for s, v in by_name.items() if "轻卡" in s],
+        "重卡": [v for s, v in by_name.items() if "重卡" in s],
+    }
+
+def read_output_sheet(tc_file, tc_df):
+    """写出标注版需要整张 sheet：精简读取的 sheet 按 sheet 名重新完整读取一次，整表读取的直接返回"""
+    if not tc_df.attrs.get("lean"):
+        return tc_df
+    name = tc_df.attrs["sheet_name"]
+    full = read_sheets_once(tc_file, lambda names: [name])[name]
+    if len(full) != len(tc_df):
+        raise ValueError(f"sheet {name} 重新读取的行数 ({len(full)}) 与审核时 ({len(tc_df)}) 不一致，文件可能已变化")
+    return full
+
+def sheet_jobs_of(tc_sheets):
+    """把 read_tc_sheets 的结果展开为 {tag: DataFrame}，tag 如 "总"、"轻卡1"、"重卡" (按 总 / 轻卡 / 重卡 顺序)"""
+    jobs = {}
+    for label, df_list in tc_sheets.items():
+        for i, df in enumerate(df_list, start=1):
+            jobs[f"{label}{i if len(df_list) > 1 else ''}"] = df
+    return jobs
+
+# --- 参考表所需列：{标准名: (关键字, 精确匹配)} ---
+fk_cols_needed = {
+    '合同': ('合同', False),
+    '放款日期': ('放款日期', False),
+    '提报人员': ('提报人员', False),
+    '城市经理': ('城市经理', False),
+    '租赁本金': ('租赁本金', False),
+    'xirr': ('xirr', False),
+    '租赁期限/年': ('租赁期限/年', False), # 模糊匹配也OK，但精确更好
+    '家访': ('家访', False),
+    '类型': ('类型', True),
+    '放款金额': ('放款金额', False)
+}
+ec_cols_needed = {
+    '合同': ('合同', False),
+    '出本流程时间': ('出本流程时间', False)
+}
+original_cols_needed = {
+    '合同': ('合同', False),
+    '年化nim': ('年化nim', False)
+}
+
+def _notify(notify, level, msg):
+    """把提示交给调用方显示 (页面用 st.warning / st.error，命令行打印到 stderr)"""
+    if notify:
+        notify(level, msg)
+
+def prepare_ref_df(df_list, required_cols_dict, prefix, notify=None):
+    """
+    (新 V2) 预处理参考DF列表：合并、标准化Key、提取列、重命名
+    required_cols_dict: {'合同': ('合同', False), '类型': ('类型', True), ...}
+    notify(level, msg)：level 为 "warning" / "error"
+    """
+    if not df_list or all(df is None for df in df_list):
+        _notify(notify, "warning", f"⚠️ {prefix} 数据列表为空，跳过预处理。")
+        return pd.DataFrame(columns=['__KEY__'])
+        
+    try:
+        df_concat = pd.concat([df for df in df_list if df is not None], ignore_index=True)
+    except Exception as e:
+        _notify(notify, "error", f"❌ 预处理 {prefix} 时合并失败: {e}")
+        return pd.DataFrame(columns=['__KEY__'])
+
+    # 2. 查找合同列 (从字典中获取元组)
+    contract_col_kw, contract_exact = required_cols_dict.get('合同', ('合同', False))
+    contract_col = find_col(df_concat, contract_col_kw, exact=contract_exact)
+    
+    if not contract_col:
+        _notify(notify, "warning", f"⚠️ 在 {prefix} 参考表中未找到'合同'列 (关键字: '{contract_col_kw}', 精确: {contract_exact})，跳过此数据源。")
+        return pd.DataFrame(columns=['__KEY__'])
+        
+    # 3. 提取列 & 重命名
+    cols_to_extract = [contract_col]
+    col_mapping = {} # '原始列名' -> 'ref_prefix_标准名'
+    
+    for std_name, (col_kw, is_exact) in required_cols_dict.items(): # <--- V2: 解包元组
+        if std_name == '合同': continue 
+            
+        actual_col = find_col(df_concat, col_kw, exact=is_exact) # <--- V2: 使用 is_exact
+        
+        if actual_col:
+            cols_to_extract.append(actual_col)
+            col_mapping[actual_col] = f"ref_{prefix}_{std_name}"
+        else:
+            # V2: 提供更详细的警告
+            _notify(notify, "warning", f"⚠️ 在 {prefix} 参考表中未找到列 (关键字: '{col_kw}', 精确: {is_exact})")
+            
+    if len(cols_to_extract) == 1: 
+        _notify(notify, "warning", f"⚠️ 在 {prefix} 参考表中未找到任何所需字段，跳过。")
+        return pd.DataFrame(columns=['__KEY__'])
+
+    # 4. 创建标准DF
+    std_df = df_concat[list(set(cols_to_extract))].copy()
+    std_df['__KEY__'] = normalize_contract_key(std_df[contract_col])
+    std_df = std_df.rename(columns=col_mapping)
+    
+    final_cols = ['__KEY__'] + list(col_mapping.values())
+    
+    # 确保 final_cols 都在 std_df 中
+    final_cols_in_df = [col for col in final_cols if col in std_df.columns]
+    std_df = std_df[final_cols_in_df]
+    
+    # 5. 去重
+    std_df = std_df.drop_duplicates(subset=['__KEY__'], keep='first')
+
+    # 6. 按日期比对的列预先解析 (随参考表缓存，审核时不再解析参考侧日期)
+    for col in [c for c in std_df.columns if c in RULE_DATE_REF_COLS]:
+        std_df[ref_date_col(col)] = normalize_date_vec(std_df[col])
+    return std_df
+
+def _std_ref_table(file, prefix, cols_needed, choose_sheets, sheet_rule, notify=None, disk_cache=True, profile=None):
+    """
+    读取单个参考文件并预处理为标准DF；disk_cache 为 True 时先查磁盘缓存 (按文件内容哈希 + 列配置)，
+    命中时跳过 xlsx 解析与 prepare_ref_df，并重新显示预处理时记录的提示。
+    sheet_rule: choose_sheets 的文字描述，作为缓存键的一部分
+    """
+    key = ref_cache.entry_key(ref_cache.content_digest(file), prefix, (sheet_rule, cols_needed)) if disk_cache else None
+    if key:
+        with profile_stage(profile, "参考表磁盘缓存", prefix) as rec:
+            hit = ref_cache.load(key)
+            rec["行数"] = len(hit[0]) if hit is not None else 0
+        if hit is not None:
+            std_df, notices = hit
+            for level, msg in notices:
+                _notify(notify, level, msg)
+            return std_df
+
+    notices = []
+    def record(level, msg):
+        notices.append((level, msg))
+        _notify(notify, level, msg)
+
+    with profile_stage(profile, "读取参考表", prefix) as rec:
+        dfs_raw = list(read_sheets_once(file, choose_sheets).values())
+        rec["行数"] = sum(len(df) for df in dfs_raw)
+    with profile_stage(profile, "预处理参考表", prefix, rows=rec.get("行数")):
+        std_df = prepare_ref_df(dfs_raw, cols_needed, prefix, record)
+    if key:
+        ref_cache.store(key, std_df, notices)
+    return std_df
+
+def build_ref_tables(fk_file, ec_file, original_file, notify=None, disk_cache=True, profile=None):
+    """
+    读取并预处理参考表 (放款明细-潮掣 / 二次明细 / 原表)，同时建立预连接索引。
+    返回 (all_std_dfs, ref_index)；批量审核时只需构建一次，供所有提成表复用。
+    profile：传入列表时，各阶段的耗时 / 内存记录追加到其中
+    """
+    all_std_dfs = {
+        # --- 放款明细 (fk) ---
+        "fk": _std_ref_table(fk_file, "fk", fk_cols_needed,
+                             lambda names: [s for s in names if "潮掣" in s], "sheet名含潮掣", notify, disk_cache, profile),
+        # --- 二次明细 (ec) ---
+        "ec": _std_ref_table(ec_file, "ec", ec_cols_needed, None, "全部sheet", notify, disk_cache, profile),
+        # --- 原表 (original) ---
+        "orig": _std_ref_table(original_file, "orig", original_cols_needed,
+                               lambda names: names[:1], "第一个sheet", notify, disk_cache, profile),
+    }
+    with profile_stage(profile, "预连接索引") as rec:
+        ref_index = build_ref_index(all_std_dfs)
+        rec["行数"] = len(ref_index)
+    return all_std_dfs, ref_index
+
+# ========== 参考表索引 & 比对 ==========
+def build_ref_index(all_std_dfs):
+    """
+    预连接所有参考表：以各表 __KEY__ 的并集为索引，每个数据源一列，
+    记录该 Key 在对应参考表中的行号 (-1 表示该表中没有此合同)。
+    每个 sheet 只需一次 get_indexer 即可定位到所有参考表的行。
+    """
+    sources = {name: df for name, df in all_std_dfs.items() if not df.empty}
+    if not sources:
+        return pd.DataFrame(index=pd.Index([], name='__KEY__'))
+
+    all_keys = pd.concat([df['__KEY__'] for df in sources.values()], ignore_index=True)
+    keys = pd.Index(all_keys.unique(), name='__KEY__')
+    ref_index = pd.DataFrame(index=keys)
+    for name, std_df in sources.items():
+        ref_index[name] = pd.Index(std_df['__KEY__']).get_indexer(keys)
+    return ref_index
+
+def lookup_ref_columns(keys, ref_index, all_std_dfs, needed_cols, missing_sources=()):
+    """
+    按标准化 Key 从预连接索引取出所需的参考列，结果与主表逐行对齐。
+    等价于对每个参考表依次 left merge (缺失行的 dtype 提升规则相同)，
+    但只做一次哈希查找，且只取 needed_cols 中的列，不复制主表。
+    missing_sources：分块查找时，整张 sheet 中有查找失败的数据源 —— 本块即使全部命中，
+    也按有缺失值提升 dtype (整数列 -> float 等)，与整表查找的结果一致。
+    """
+    rows = ref_index.index.get_indexer(keys)
+    found = rows >= 0
+    out = {}
+    for name in ref_index.columns:
+        std_df = all_std_dfs[name]
+        cols = [c for c in std_df.columns if c in needed_cols]
+        if not cols:
+            continue
+        src_pos = np.where(found, ref_index[name].to_numpy()[rows], -1)
+        pad = name in missing_sources
+        for c in cols:
+            # 按行号取值；-1 不在 RangeIndex 中 -> 缺失值
+            vals = std_df[c].reset_index(drop=True).reindex(np.append(src_pos, -1) if pad else src_pos)
+            if pad:
+                vals = vals.iloc[:-1]
+            vals.index = keys.index
+            out[c] = vals
+    return pd.DataFrame(out, index=keys.index)
+
+def compare_series_vec(s_main, s_ref, compare_type='text', tolerance=0, multiplier=1,
+                       num_parts=(None, None), as_num=(None, None), dates=(None, None)):
+    """
+    (新) 向量化比较函数，复刻所有业务逻辑。
+    以下可选参数均为 (主表, 参考) 两侧，供增量审核 / 分块审核使用：
+    num_parts：已算好的 num_parts_vec 结果，避免重复解析；
+    as_num：空值是否算数值的整列判定，None 表示按传入的行推断 (只比对部分行时须传入整列的判定)；
+    dates：已算好的 normalize_date_vec 结果 (参考侧在预处理参考表时已解析)。
+    """
+    # 0. 识别 Merge 失败
+    merge_failed_mask = s_ref.isna()
+
+    # 1. 预处理空值
+    main_is_na = is_blank_vec(s_main)
+    ref_is_na = is_blank_vec(s_ref)
+    both_are_na = main_is_na & ref_is_na
+    
+    errors = pd.Series(False, index=s_main.index)
+
+    # 2. 日期比较
+    if compare_type == 'date':
+        d_main = dates[0] if dates[0] is not None else normalize_date_vec(s_main)
+        d_ref = dates[1] if dates[1] is not None else normalize_date_vec(s_ref)
+        
+        valid_dates_mask = d_main.notna() & d_ref.notna()
+        date_diff_mask = (d_main != d_ref)
+        errors = valid_dates_mask & date_diff_mask
+        
+        one_is_date_one_is_not = (d_main.notna() & d_ref.isna() & ~ref_is_na) | \
+                                 (d_main.isna() & ~main_is_na & d_ref.notna())
+        errors |= one_is_date_one_is_not
+
+    # 3. 数值比较
+    elif compare_type == 'num' or compare_type == 'rate' or compare_type == 'term':
+        main_parts = num_parts[0] if num_parts[0] is not None else num_parts_vec(s_main)
+        ref_parts = num_parts[1] if num_parts[1] is not None else num_parts_vec(s_ref)
+        s_main_norm, is_num_main = _none_as_num(*main_parts, as_num=as_num[0])
+        s_ref_norm, is_num_ref = _none_as_num(*ref_parts, as_num=as_num[1])
+                   
+        # 特殊：期限（乘数）
+        # (转为数值后非数值变为 NaN，NaN 仍按 float 计入 “是数值”)
+        if compare_type == 'term':
+            s_ref_norm = s_ref_norm * multiplier
+            is_num_ref = pd.Series(True, index=s_ref.index)
+
+        both_are_num = is_num_main & is_num_ref
+
+        if both_are_num.any():
+            diff = (s_main_norm[both_are_num] - s_ref_norm[both_are_num]).abs()
+            errors.loc[both_are_num] = (diff > (tolerance + 1e-6))
+            
+        one_is_num_one_is_not = (is_num_main & ~is_num_ref & ~ref_is_na) | \
+                                (~is_num_main & ~main_is_na & is_num_ref)
+        errors |= one_is_num_one_is_not
+
+    # 4. 文本比较
+    else: # compare_type == 'text'
+        s_main_norm_text = normalize_text_vec(s_main)
+        s_ref_norm_text = normalize_text_vec(s_ref)
+        errors = (s_main_norm_text != s_ref_norm_text)
+
+    # 5. 最终错误逻辑
+    final_errors = errors & ~both_are_na
+    lookup_failure_mask = merge_failed_mask & ~main_is_na
+    final_errors = final_errors & ~lookup_failure_mask
+    
+    return final_errors
+
+# ========== 标注输出 (write_only 流式写出) ==========
+RED_FILL = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
+YELLOW_FILL = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
+
+def _filled_cell(ws, value, fill):
+    if isinstance(value, Cell):
+        value = value.value
+    cell = WriteOnlyCell(ws, value=value)
+    cell.fill = fill
+    return cell
+
+def write_marked_xlsx(df, error_bitmap, marked_cols, contract_col, row_flags, extra_sheets=None, output=None):
+    """
+    以 openpyxl write_only 模式流式写出 df (表头 + 数据)，不在内存中保留整张工作表。
+    写每一行时按预先算好的错误位图直接生成带填充的 WriteOnlyCell：
+    错误格标红，有错误的行合同号标黄。
+    error_bitmap: (行数, len(marked_cols)) 的 bool 数组；row_flags: 每行是否有错误
+    extra_sheets: {sheet名: DataFrame}，原样追加在标注 sheet 之后 (如合同号未匹配清单)
+    output: 写入的文件对象 (如 ZIP 中的条目)；None 时写入新的 BytesIO 并返回
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet")
+    columns = list(df.columns)
+    marked_pos = [columns.index(c) for c in marked_cols]
+    contract_pos = columns.index(contract_col) if contract_col in columns else None
+
+    rows = dataframe_to_rows(df, index=False, header=True)
+    ws.append(next(rows))
+    _append_marked_rows(ws, rows, error_bitmap, marked_pos, contract_pos, row_flags)
+    _append_extra_sheets(wb, extra_sheets)
+    return _save_workbook(wb, output)
+
+def _save_workbook(wb, output=None):
+    if output is not None:
+        wb.save(output)
+        return output
+    output = BytesIO()
+    wb.save(output)
+    output.seek(0)
+    return output
+
+def _append_marked_rows(ws, rows, error_bitmap, marked_pos, contract_pos, row_flags):
+    """逐行写出：错误格标红，有错误的行合同号标黄 (marked_pos 为错误位图各列在行中的位置)"""
+    for r, errs, flagged in zip(rows, error_bitmap, row_flags):
+        if flagged:
+            for j in np.flatnonzero(errs):
+                r[marked_pos[j]] = _filled_cell(ws, r[marked_pos[j]], RED_FILL)
+            if contract_pos is not None:
+                r[contract_pos] = _filled_cell(ws, r[contract_pos], YELLOW_FILL)
+        ws.append(r)
+
+def _append_extra_sheets(wb, extra_sheets):
+    for name, extra in (extra_sheets or {}).items():
+        ws_extra = wb.create_sheet(name)
+        for r in dataframe_to_rows(extra, index=False, header=True):
+            ws_extra.append(r)
+
+@lru_cache(maxsize=256)
+def compile_sheet_plan(header):
+    """
+    按表头把 FIELD_RULES 编译为审核计划：一次性解析出合同列和每个字段的主表列 / 参考列 / 比对参数。
+    header: 表头元组 (同时作为缓存键，表头相同的 sheet 直接复用计划，不再逐字段 find_col)。
+    返回 {"contract_col": ..., "steps": [...]}；没有合同列时 contract_col 为 None。
+    """
+    columns = pd.DataFrame(columns=list(header)) # 只有表头的空表，供 find_col 使用
+    steps = []
+    for i, (main_kw, rule) in enumerate(FIELD_RULES.items()):
+        main_col = find_col(columns, main_kw, exact=rule.get("exact", False))
+        if main_col is None:
+            continue
+        override = rule.get("override")
+        when_col = None
+        if override:
+            when_col = find_col(columns, override["when"], exact=True)
+            if when_col is None:
+                continue # 无法判断条件，跳过该字段
+        steps.append({
+            "index": i,
+            "field": main_kw,
+            "main_col": main_col,
+            "ref_col": ref_col_name(rule["src"], rule["ref"]),
+            "compare": {"compare_type": rule["compare"], "tolerance": rule.get("tol", 0), "multiplier": rule.get("mult", 1)},
+            "override": override and {
+                "when_col": when_col,
+                "equals": override["equals"],
+                "ref_col": ref_col_name(override["src"], override["ref"]),
+            },
+        })
+    return {"contract_col": find_col(columns, "合同"), "steps": steps}
+
+def audit_columns(header):
+    """审核实际用到的列：合同列 + 各字段规则的主表列 / 条件列 (其余列只在写出标注版时需要)"""
+    plan = compile_sheet_plan(tuple(header))
+    used = {plan["contract_col"]} | {step["main_col"] for step in plan["steps"]} | \
+        {step["override"]["when_col"] for step in plan["steps"] if step["override"]}
+    return [c for c in header if c in used]
+
+def _compact_text_columns(tc_df):
+    """按文本比对的 object 列若重复值多 (人员、类型等)，原地转为 category 以减少内存；比对结果不变"""
+    plan = compile_sheet_plan(tuple(tc_df.columns))
+    for step in plan["steps"]:
+        col = step["main_col"]
+        if step["compare"]["compare_type"] != "text" or tc_df[col].dtype != object:
+            continue
+        if tc_df[col].nunique(dropna=True) <= len(tc_df) // 2:
+            tc_df[col] = tc_df[col].astype("category")
+
+def _ref_series_for(step, tc_df, ref_df, dates=False):
+    """
+    取一个字段的参考值：参考表缺该列时为全空；有条件覆盖时按行替换为覆盖来源的值。
+    dates=True 时取预解析的参考日期 (见 ref_date_col)；不是日期字段或参考表中没有预解析列时返回 None。
+    """
+    col_of = ref_date_col if dates else (lambda col: col)
+    if dates and step["compare"]["compare_type"] != "date":
+        return None
+    s_ref = ref_df.get(col_of(step["ref_col"]))
+    if s_ref is None:
+        if dates:
+            return None
+        s_ref = pd.Series(pd.NA, index=tc_df.index)
+    override = step["override"]
+    if override:
+        s_override = ref_df.get(col_of(override["ref_col"]))
+        if s_override is not None:
+            s_ref = s_ref.copy()
+            mask = normalize_text_vec(tc_df[override["when_col"]]) == override["equals"]
+            s_ref.loc[mask] = s_override.loc[mask]
+    return s_ref
+
+def _lookup_sheet_refs(keys, contracts, ref_index, all_std_dfs, missing_sources=()):
+    """
+    查找一个 sheet (或一块行) 的参考列，返回 (ref_df, unmatched_rows)。
+    unmatched_rows：合同号非空、但放款明细中查不到的行号 (比对时按查找失败跳过；近似匹配见 near_miss_report)
+    """
+    ref_df = lookup_ref_columns(keys, ref_index, all_std_dfs, RULE_REF_COLS, missing_sources)
+    if "fk" not in ref_index.columns:
+        return ref_df, np.array([], dtype=np.int64)
+    fk_rows = ref_index["fk"].to_numpy()
+    pos = ref_index.index.get_indexer(keys)
+    in_fk = (pos >= 0) & (fk_rows[pos] >= 0)
+    return ref_df, np.flatnonzero(~in_fk & ~is_blank_vec(contracts).to_numpy())
+
+# ========== 增量审核 (行指纹) ==========
+def row_fingerprints(frame):
+    """
+    逐行指纹 (uint64)：各列的值连同值的类型一起哈希
+    (1 与 "1"、日期与日期文本的比对结果可能不同，不能视为同一值)。
+    """
+    parts = {}
+    for i in range(frame.shape[1]):
+        s = frame.iloc[:, i].reset_index(drop=True)
+        parts[f"v{i}"] = s
+        if s.dtype == object or isinstance(s.dtype, pd.CategoricalDtype):
+            # 类型按类型名的 crc32 编码为整数 (跨进程、跨次运行稳定)
+            codes, types = pd.factorize(pd.Series(np.asarray(s, dtype=object)).map(type))
+            type_ids = np.array([zlib.crc32(t.__name__.encode()) for t in types] + [0], dtype=np.uint64)
+            parts[f"t{i}"] = type_ids[codes]
+    return pd.util.hash_pandas_object(pd.DataFrame(parts, index=range(len(frame))), index=False).to_numpy()
+
+def _previous_rows(previous, header, fingerprints):
+    """当前各行在上一次结果中指纹相同的行号 (没有则为 -1)；上一次结果不可复用时返回 None"""
+    state = (previous or {}).get("delta_state")
+    if not state or state["header"] != header:
+        return None
+    prev_fp, first_pos = np.unique(state["fingerprints"], return_index=True)
+    idx = pd.Index(prev_fp).get_indexer(fingerprints)
+    return np.where(idx >= 0, first_pos[idx], -1)
+
+def _num_classes(parts):
+    """num_parts_vec 结果中的逐行分类 (is_num, none_mask)，保存为 numpy 数组供下次增量审核"""
+    return tuple((p[1].to_numpy(dtype=bool), p[2].to_numpy(dtype=bool)) for p in parts)
+
+def _compare_step(step, j, s_main, s_ref, prev_state, prev_pos, state, ref_dates=None):
+    """
+    比对一个字段并记录增量审核状态，返回 (错误位置的 bool 数组, 实际比对的行数)。
+    有上一次结果时只比对指纹变化的行，其余行沿用上次结果。
+    数值字段 “空值是否算数值” 取决于整列：用上次保存的逐行分类与本次变化行的分类算出整列判定，
+    判定与上次不同时整列比对。ref_dates：日期字段预解析的参考日期。
+    """
+    compare = step["compare"]
+    numeric = compare["compare_type"] in ("num", "rate", "term")
+    n = len(s_main)
+    if prev_state is not None:
+        changed = np.flatnonzero(prev_pos < 0)
+        reused = ~(prev_pos < 0)
+        sub_main, sub_ref = s_main.iloc[changed], s_ref.iloc[changed]
+        extra = {} if ref_dates is None else {"dates": (None, ref_dates.iloc[changed])}
+        if numeric:
+            parts = (num_parts_vec(sub_main), num_parts_vec(sub_ref))
+            classes = []
+            for (prev_is_num, prev_none), (sub_is_num, sub_none) in zip(prev_state["num_classes"][j], _num_classes(parts)):
+                is_num, none = np.empty(n, dtype=bool), np.empty(n, dtype=bool)
+                is_num[reused], none[reused] = prev_is_num[prev_pos[reused]], prev_none[prev_pos[reused]]
+                is_num[changed], none[changed] = sub_is_num, sub_none
+                classes.append((is_num, none))
+            flags = tuple(none_as_num_flag(is_num, none) for is_num, none in classes)
+            if flags == prev_state["num_flags"][j]:
+                state["num_classes"][j], state["num_flags"][j] = tuple(classes), flags
+                extra = {"num_parts": parts, "as_num": flags}
+            else:
+                prev_state = None # 整列判定变化：整列比对
+        if prev_state is not None:
+            errors = np.zeros(n, dtype=bool)
+            errors[reused] = prev_state["error_matrix"][prev_pos[reused], j]
+            if len(changed):
+                errors[changed] = compare_series_vec(sub_main, sub_ref, **compare, **extra).to_numpy(dtype=bool)
+            return errors, len(changed)
+
+    if numeric:
+        parts = (num_parts_vec(s_main), num_parts_vec(s_ref))
+        classes = _num_classes(parts)
+        state["num_classes"][j] = classes
+        state["num_flags"][j] = tuple(none_as_num_flag(is_num, none) for is_num, none in classes)
+        errors = compare_series_vec(s_main, s_ref, **compare, num_parts=parts)
+    else:
+        errors = compare_series_vec(s_main, s_ref, **compare, dates=(None, ref_dates))
+    return errors.to_numpy(dtype=bool), n
+
+def _delta_of(prev_state, prev_pos, state, contracts):
+    """增量信息：复核行数、沿用行数与上次标记后已修正的单元格"""
+    rechecked = int((prev_pos < 0).sum())
+    plan_cols = list(dict.fromkeys(step["main_col"] for step in compile_sheet_plan(state["header"])["steps"]))
+    return {
+        "rechecked_rows": rechecked,
+        "reused_rows": len(prev_pos) - rechecked,
+        "fixed_cells": _fixed_cells(prev_state, state, plan_cols, contracts),
+    }
+
+def audit_delta(tc_df, result, previous):
+    """
+    按 previous (同一 sheet 的另一次审核结果) 重新计算 result 的 "delta"，不重新比对；不可比较时返回 None。
+    审核结果被缓存、由不同的上一次结果复用时 (页面缓存跨会话共享)，用它得到相对当前上一次结果的增量信息。
+    """
+    state = result.get("delta_state")
+    if state is None:
+        return None
+    prev_pos = _previous_rows(previous, state["header"], state["fingerprints"])
+    if prev_pos is None:
+        return None
+    return _delta_of(previous["delta_state"], prev_pos, state, tc_df[result["contract_col"]])
+
+def _fixed_cells(prev_state, state, plan_cols, contracts):
+    """上一次标记、本次不再标记的单元格 (按合同 Key 对应到当前行；合同已不在表中的不计)"""
+    prev_rows, prev_cols = np.nonzero(prev_state["error_matrix"])
+    cur_rows, cur_cols = np.nonzero(state["error_matrix"])
+    cells = pd.DataFrame({"key": prev_state["key_hashes"][prev_rows], "col": prev_cols}).drop_duplicates()
+    still = pd.DataFrame({"key": state["key_hashes"][cur_rows], "col": cur_cols}).drop_duplicates()
+    cells = cells.merge(still, how="left", on=["key", "col"], indicator=True)
+    cells = cells[cells["_merge"] == "left_only"]
+    keys, first_row = np.unique(state["key_hashes"], return_index=True)
+    idx = pd.Index(keys).get_indexer(cells["key"])
+    rows, cols = first_row[idx[idx >= 0]], cells["col"].to_numpy()[idx >= 0]
+    fixed = pd.DataFrame({
+        "row": rows,
+        "excel_row": rows + 2,
+        "contract": contracts.to_numpy()[rows],
+        "column": np.array(plan_cols, dtype=object)[cols],
+    })
+    return fixed.sort_values(["row", "column"], ignore_index=True)
+
+# =====================================
+# 🧮 核心审核函数 (向量化版)
+# =====================================
+def audit_one_sheet(tc_df, all_std_dfs, ref_index=None, on_field=None, previous=None):
+    """
+    审核单个 sheet (纯计算，不依赖 Streamlit)，返回紧凑的审核结果 dict；未找到‘合同’列时返回 None。
+    on_field(i, total, main_kw)：每个字段比对完成后回调，用于进度显示。
+    结果中的 "profile" 为查找参考列与每个字段比对的耗时 / 内存记录。
+    previous：同一 sheet 上一次的审核结果 (增量审核)。行指纹 (比对用到的列 + Key + 查到的参考值) 未变的行
+    沿用上次结果，只复核变化的行；结果中的 "delta" 记录复核行数与已修正的错误单元格。
+    """
+    profile = []
+    header = tuple(c for c in tc_df.columns if c not in ('__ROW_IDX__', '__KEY__'))
+    plan = compile_sheet_plan(header)
+    contract_col_main = plan["contract_col"]
+    if not contract_col_main:
+        return None
+    
+    # 1. 准备主表
+    tc_df['__ROW_IDX__'] = tc_df.index
+    tc_df['__KEY__'] = normalize_contract_key(tc_df[contract_col_main])
+
+    # 2. 一次性查找所有参考数据 (预连接索引，只取规则需要的参考列)
+    if ref_index is None:
+        ref_index = build_ref_index(all_std_dfs)
+    with profile_stage(profile, "查找参考列", rows=len(tc_df)):
+        ref_df, unmatched_rows = _lookup_sheet_refs(tc_df['__KEY__'], tc_df[contract_col_main], ref_index, all_std_dfs)
+
+    # 3. === 遍历字段进行向量化比对 ===
+    # 错误矩阵：行 × 计划中的主表列 (同一列被多个规则比对时合并到同一列)
+    plan_cols = list(dict.fromkeys(step["main_col"] for step in plan["steps"]))
+    col_pos = {c: j for j, c in enumerate(plan_cols)}
+    error_matrix = np.zeros((len(tc_df), len(plan_cols)), dtype=bool)
+    total_errors = 0
+
+    # 增量审核状态：每个比对列只对应一个规则时，错误矩阵的列即各规则的结果，可按行复用
+    state, prev_state, prev_pos = None, None, None
+    if len(plan_cols) == len(plan["steps"]):
+        with profile_stage(profile, "行指纹", rows=len(tc_df)):
+            # 合同列只经 Key 参与比对，用 Key 的哈希代替原值
+            key_hashes = pd.util.hash_pandas_object(tc_df['__KEY__'], index=False)
+            fp_cols = [c for c in audit_columns(header) if c != contract_col_main]
+            state = {
+                "header": header,
+                "fingerprints": row_fingerprints(pd.concat([key_hashes, tc_df[fp_cols], ref_df], axis=1)),
+                "key_hashes": key_hashes.to_numpy(),
+                "num_classes": {},
+                "num_flags": {},
+            }
+            prev_pos = _previous_rows(previous, header, state["fingerprints"])
+        if prev_pos is not None:
+            prev_state = previous["delta_state"]
+
+    for step in plan["steps"]:
+        main_col = step["main_col"]
+
+        # 4. === 按计划比对 (参考列、条件覆盖、比对参数均已在编译时确定) ===
+        with profile_stage(profile, "字段比对", step["field"], rows=len(tc_df)) as rec:
+            s_ref = _ref_series_for(step, tc_df, ref_df)
+            ref_dates = _ref_series_for(step, tc_df, ref_df, dates=True)
+            if state is None:
+                errors = compare_series_vec(tc_df[main_col], s_ref, **step["compare"],
+                                            dates=(None, ref_dates)).to_numpy(dtype=bool)
+            else:
+                errors, rec["行数"] = _compare_step(step, col_pos[main_col], tc_df[main_col], s_ref,
+                                                   prev_state, prev_pos, state, ref_dates)
+
+        # 5. 累积错误 (直接写入矩阵对应列)
+        n_errors = int(errors.sum())
+        if n_errors:
+            total_errors += n_errors
+            error_matrix[:, col_pos[main_col]] |= errors
+                
+        if on_field:
+            on_field(step["index"] + 1, len(FIELD_RULES), step["field"])
+
+    # 6. === 紧凑的审核结果 (xlsx 在用户请求下载时才生成) ===
+    # 只保留有错误的列；行标记 = 任一列有错
+    has_errors = error_matrix.any(axis=0)
+    marked_cols = [c for c, keep in zip(plan_cols, has_errors) if keep]
+    error_bitmap = error_matrix[:, has_errors]
+    row_flags = error_bitmap.any(axis=1)
+
+    delta = None
+    if state is not None:
+        state["error_matrix"] = error_matrix
+        if prev_state is not None:
+            delta = _delta_of(prev_state, prev_pos, state, tc_df[contract_col_main])
+
+    return {
+        "contract_col": contract_col_main,
+        "marked_cols": marked_cols,
+        "error_bitmap": error_bitmap,
+        "row_flags": row_flags,
+        "total_errors": total_errors,
+        "error_rows": int(row_flags.sum()),
+        "unmatched_rows": unmatched_rows,
+        "profile": profile,
+        "delta": delta,
+        "delta_state": state,
+    }
+
+def build_sheet_artifact(tc_df, result, kind, near_miss=None, output=None):
+    """
+    按需把单个 sheet 的审核结果写成 xlsx。
+    tc_df: 整张 sheet (精简读取时先用 read_output_sheet 读取整表)，行与审核时一致
+    kind: "审核标注版" (整表) 或 "错误精简版" (只含有错误的行)
+    near_miss: near_miss_report 的结果；非空时在审核标注版中追加 “合同号未匹配” sheet
+    output: 写入的文件对象；None 时写入新的 BytesIO
+    返回 (BytesIO 或 output, 写出统计)
+    """
+    cols = [c for c in tc_df.columns if c not in ('__ROW_IDX__', '__KEY__')]
+    bitmap, flags = result["error_bitmap"], result["row_flags"]
+    if kind == "错误精简版":
+        output, stats = measure_call(
+            write_marked_xlsx, tc_df.loc[flags, cols], bitmap[flags],
+            result["marked_cols"], result["contract_col"], flags[flags], output=output
+        )
+        return output, dict(stats, 行数=int(flags.sum()))
+    extra = {NEAR_MISS_SHEET: near_miss} if near_miss is not None and len(near_miss) else None
+    output, stats = measure_call(write_marked_xlsx, tc_df[cols], bitmap, result["marked_cols"], result["contract_col"], flags,
+                                 extra, output)
+    return output, dict(stats, 行数=len(tc_df))
+
+def build_missing_artifact(missing_contracts, output=None):
+    """漏填合同号表 (使用 openpyxl 写入，避免额外的 pd.ExcelWriter 依赖)；output 同 build_sheet_artifact"""
+    wb_miss = Workbook(write_only=True)
+    ws_miss = wb_miss.create_sheet("Sheet")
+    ws_miss.append(["漏填合同号"])
+    for contract in missing_contracts:
+        ws_miss.append([contract])
+    return _save_workbook(wb_miss, output), {}
+
+def artifact_file_name(tag, kind):
+    """单个 sheet 输出文件的文件名 (kind 为 "审核标注版" / "错误精简版")"""
+    return f"提成_{tag}_{kind}.xlsx"
+
+MISSING_FILE_NAME = "提成_漏填合同号_基于放款明细_潮掣.xlsx"
+
+# ========== 原文件标注版 (直接修改 xlsx 包) ==========
+# 复制上传的提成表 xlsx：只改写有错误的 sheet XML 中被标记单元格的 s= (样式序号)，并在 styles.xml 追加
+# 红 / 黄填充及对应的单元格样式，其余部件逐字节复制。原表的格式、公式、列宽、批注等都保留，
+# 写出时不解析、不重新生成单元格，开销与错误数而不是表格大小成正比 (sheet XML 只做一次逐块扫描复制)。
+PATCHED_FILE_NAME = "提成_原文件标注版.xlsx"
+PATCH_BLOCK_SIZE = 1 << 20 # 逐块复制 sheet XML 时每块字节数
+
+_NS_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_DOC_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+
+# 只用正则定位需要的标签 (命名空间前缀可有可无，属性值可用单 / 双引号)
+_ROW_START = re.compile(rb"<((?:\w+:)?)row\b[^>]*>")
+_ROW_END = re.compile(rb"</(?:\w+:)?row>")
+_ROW_NUM = re.compile(rb"""\sr=["'](\d+)["']""")
+_CELL_TAG = re.compile(rb"<((?:\w+:)?)c\b([^>]*?)(/?)>")
+_CELL_REF = re.compile(rb"""\sr=["']([A-Z]+)\d+["']""")
+_STYLE_ATTR = re.compile(rb"""\ss=["'](\d+)["']""")
+
+def _xlsx_parts(zf):
+    """xlsx 包的部件路径 {"sheets": {sheet名: worksheet 路径}, "styles": 路径, "sharedStrings": 路径}，按工作簿关系解析"""
+    def targets(rels_path, base):
+        rels = ET.fromstring(zf.read(rels_path))
+        out = {}
+        for rel in rels.iter(f"{_NS_REL}Relationship"):
+            target = rel.get("Target")
+            path = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join(base, target))
+            out[rel.get("Id")] = (rel.get("Type").rsplit("/", 1)[-1], path)
+        return out
+
+    workbook = next(path for kind, path in targets("_rels/.rels", "").values() if kind == "officeDocument")
+    base, name = posixpath.split(workbook)
+    rels = targets(posixpath.join(base, "_rels", name + ".rels"), base)
+    sheets = {s.get("name"): rels[s.get(f"{_NS_DOC_REL}id")][1]
+              for s in ET.fromstring(zf.read(workbook)).iter(f"{_NS_MAIN}sheet")}
+    return {"sheets": sheets, **{kind: next((path for k, path in rels.values() if k == kind), None)
+                                 for kind in ("styles", "sharedStrings")}}
+
+def _set_attr(tag, name, value):
+    """在开始标签中设置属性 (已有则替换值)"""
+    value = str(value).encode()
+    pattern = re.compile(rb"""(\s%s=)(["'])[^"']*\2""" % name)
+    if pattern.search(tag):
+        return pattern.sub(lambda m: m.group(1) + m.group(2) + value + m.group(2), tag, count=1)
+    end = -2 if tag.endswith(b"/>") else -1
+    return tag[:end] + b' %s="%s"' % (name, value) + tag[end:]
+
+def _block(xml, tag):
+    """styles.xml 中的 <tag ...>...</tag> 块：(开始标签的 match, 结束标签的 match)；没有或为空元素时返回 None"""
+    start = re.search(rb"<((?:\w+:)?)%s\b[^>]*?(/?)>" % tag, xml)
+    if start is None or start.group(2):
+        return None
+    return start, re.compile(rb"</(?:\w+:)?%s>" % tag).search(xml, start.end())
+
+def _style_patcher(styles_xml):
+    """
+    解析 styles.xml 的填充与单元格样式，返回 (style_of, 写出新 styles.xml 的函数)。
+    style_of(原样式序号, "red" / "yellow") -> 新样式序号：复制原样式并改为对应填充，同一组合只追加一次。
+    """
+    fills, xfs = _block(styles_xml, b"fills"), _block(styles_xml, b"cellXfs")
+    if fills is None or xfs is None:
+        raise ValueError("styles.xml 中没有 fills / cellXfs，无法在原文件上标注")
+    p = fills[0].group(1)
+    n_fills = len(re.findall(rb"<(?:\w+:)?fill\b", styles_xml[fills[0].end():fills[1].start()]))
+    fill_ids = {"red": n_fills, "yellow": n_fills + 1}
+    new_fills = b"".join(
+        b'<%sfill><%spatternFill patternType="solid"><%sfgColor rgb="%s"/><%sbgColor rgb="%s"/></%spatternFill></%sfill>'
+        % (p, p, p, fill.fgColor.rgb.encode(), p, fill.bgColor.rgb.encode(), p, p)
+        for fill in (RED_FILL, YELLOW_FILL)
+    )
+    # 现有单元格样式的开始标签 (子元素如 <alignment> 随后原样复制)
+    xf_re = re.compile(rb"<(?:\w+:)?xf\b[^>]*?/>|<(?:\w+:)?xf\b[^>]*>.*?</(?:\w+:)?xf>", re.S)
+    base_xfs = xf_re.findall(styles_xml, xfs[0].end(), xfs[1].start())
+    added, index = [], {}
+
+    def style_of(style, color):
+        key = (style, color)
+        if key not in index:
+            xf = base_xfs[style] if style < len(base_xfs) else b'<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+            head = re.match(rb"<[^>]*>", xf).group(0)
+            patched = _set_attr(_set_attr(head, b"fillId", fill_ids[color]), b"applyFill", 1)
+            added.append(patched + xf[len(head):])
+            index[key] = len(base_xfs) + len(added) - 1
+        return index[key]
+
+    def render():
+        def with_count(start, count):
+            return _set_attr(start.group(0), b"count", count)
+        return b"".join([
+            styles_xml[:fills[0].start()], with_count(fills[0], n_fills + 2),
+            styles_xml[fills[0].end():fills[1].start()], new_fills,
+            styles_xml[fills[1].start():xfs[0].start()], with_count(xfs[0], len(base_xfs) + len(added)),
+            styles_xml[xfs[0].end():xfs[1].start()], *added,
+            styles_xml[xfs[1].start():],
+        ])
+    return style_of, render
+
+def _patch_row(row_xml, row_num, row_marks, style_of):
+    """
+    改写一个 <row> 元素：row_marks ({列号: 颜色}) 中的单元格换成带填充的样式；
+    原文件中没有单元格元素的 (空单元格) 按列序插入空单元格。
+    """
+    start = _ROW_START.match(row_xml)
+    prefix = start.group(1)
+    if start.group(0).endswith(b"/>"): # 没有单元格的空行
+        row_xml = start.group(0)[:-2] + b"></" + prefix + b"row>"
+    todo = dict(row_marks)
+
+    def new_cells(cols):
+        return [b'<%sc r="%s%d" s="%d"/>' % (prefix, get_column_letter(c).encode(), row_num, style_of(0, todo.pop(c)))
+                for c in sorted(cols)]
+
+    out, pos, col = [], 0, 0
+    for m in _CELL_TAG.finditer(row_xml):
+        ref = _CELL_REF.search(m.group(2))
+        col = column_index_from_string(ref.group(1).decode()) if ref else col + 1
+        out.append(row_xml[pos:m.start()])
+        out.extend(new_cells([c for c in todo if c < col]))
+        tag = m.group(0)
+        if col in todo:
+            style = _STYLE_ATTR.search(m.group(2))
+            tag = _set_attr(tag, b"s", style_of(int(style.group(1)) if style else 0, todo.pop(col)))
+        out.append(tag)
+        pos = m.end()
+        if not todo: # 其余单元格原样保留
+            break
+    end = _ROW_END.search(row_xml, pos).start()
+    out.append(row_xml[pos:end])
+    out.extend(new_cells(list(todo)))
+    out.append(row_xml[end:])
+    return b"".join(out)
+
+def _patch_sheet_xml(src, dst, marks, style_of, block_size=PATCH_BLOCK_SIZE):
+    """
+    逐块复制一个 worksheet XML，只改写 marks ({Excel 行号: {列号: 颜色}}) 中的行，其余内容原样写出。
+    被标记的行读完整后再改写；其余部分不解析，内存只与块大小有关。
+    """
+    buf, base, last_start, row_num = b"", 0, -1, 0 # base: buf 在整个 XML 中的偏移
+    eof = False
+    while not eof:
+        data = src.read(block_size)
+        eof = not data
+        buf += data
+        pos, keep = 0, None
+        for m in _ROW_START.finditer(buf):
+            if base + m.start() > last_start: # 同一行标签跨块时只计数一次
+                num = _ROW_NUM.search(m.group(0))
+                row_num = int(num.group(1)) if num else row_num + 1
+                last_start = base + m.start()
+            row_marks = marks.get(row_num)
+            if not row_marks or m.start() < pos:
+                continue
+            if m.group(0).endswith(b"/>"):
+                end = m.end()
+            else:
+                close = _ROW_END.search(buf, m.end())
+                if close is None: # 这一行还没读完
+                    keep = m.start()
+                    break
+                end = close.end()
+            dst.write(buf[pos:m.start()])
+            dst.write(_patch_row(buf[m.start():end], row_num, row_marks, style_of))
+            pos = end
+        if keep is None:
+            # 末尾可能是不完整的标签，从最后一个 "<" 起留到下一块
+            keep = len(buf) if eof else max(buf.rfind(b"<"), pos)
+        dst.write(buf[pos:keep])
+        buf, base = buf[keep:], base + keep
+
+def _sheet_marks(header, result):
+    """{Excel 行号: {列号: 颜色}}：错误单元格红色，有错误的行合同号黄色 (第 1 行为表头，列号从 1 起)"""
+    pos = {c: i + 1 for i, c in enumerate(header)}
+    marked = [pos[c] for c in result["marked_cols"]]
+    contract = pos[result["contract_col"]]
+    marks = {}
+    for i in np.flatnonzero(result["row_flags"]):
+        row = {contract: "yellow"}
+        row.update((marked[j], "red") for j in np.flatnonzero(result["error_bitmap"][i]))
+        marks[int(i) + 2] = row
+    return marks
+
+def _xlsx_header_row(zf, sheet_part, strings_part):
+    """
+    sheet 第 1 行的单元格值 (与 _convert_cell 相同的转换，日期单元格按数值)。
+    只解析到第一行结束，共享字符串只读到用到的最大序号，不打开整个工作簿。
+    """
+    cells, shared = {}, {} # shared: {列号: 共享字符串序号}
+    with zf.open(sheet_part) as f:
+        for event, elem in ET.iterparse(f, events=("start", "end")):
+            tag = elem.tag.rsplit("}", 1)[-1]
+            if event == "start":
+                if tag == "row" and elem.get("r", "1") != "1": # 第 1 行为空行
+                    break
+                continue
+            if tag == "row":
+                break
+            if tag != "c":
+                continue
+            ref = elem.get("r")
+            col = column_index_from_string(re.match(r"[A-Z]+", ref).group()) if ref else len(cells) + 1
+            kind, v = elem.get("t", "n"), elem.findtext(f"{_NS_MAIN}v")
+            if kind == "inlineStr":
+                cells[col] = "".join(t.text or "" for t in elem.iter(f"{_NS_MAIN}t"))
+            elif not v: # 没有缓存值的公式等
+                cells[col] = ""
+            elif kind == "s":
+                shared[col] = int(v)
+            elif kind == "e":
+                cells[col] = np.nan
+            elif kind == "b":
+                cells[col] = v == "1"
+            elif kind in ("str", "d"):
+                cells[col] = v
+            else:
+                num = float(v)
+                cells[col] = int(num) if num.is_integer() else num
+    if shared and strings_part:
+        texts, need = {}, set(shared.values())
+        last = max(need)
+        with zf.open(strings_part) as f:
+            n = 0
+            for _, elem in ET.iterparse(f):
+                if elem.tag != f"{_NS_MAIN}si":
+                    continue
+                if n in need: # 注音 (rPh) 中的文字不计入，与 openpyxl 相同
+                    texts[n] = "".join(t.text or "" for t in elem.findall(f"{_NS_MAIN}t") + elem.findall(f"{_NS_MAIN}r/{_NS_MAIN}t"))
+                elem.clear()
+                n += 1
+                if n > last:
+                    break
+        cells.update((col, texts.get(i, "")) for col, i in shared.items())
+    values = [cells.get(c, "") for c in range(1, max(cells, default=0) + 1)]
+    while values and values[-1] == "":
+        values.pop()
+    return values
+
+def patch_marked_xlsx(tc_file, sheets, output=None):
+    """
+    原文件标注版：在上传的提成表 xlsx 上直接标色 (错误单元格红色，有错误的行合同号黄色)，所有 sheet 写入同一个文件。
+    sheets: {tag: (DataFrame 或 sheet 名, 审核结果)}；不追加 “合同号未匹配” sheet (见审核标注版)。
+    output: 写入的文件对象；None 时写入新的 BytesIO
+    返回 (BytesIO 或 output, 写出统计)，统计中的行数为标注的行数。
+    """
+    marks = {}
+
+    def write():
+        out = output if output is not None else BytesIO()
+        if hasattr(tc_file, "seek"):
+            tc_file.seek(0)
+        with zipfile.ZipFile(tc_file) as src, zipfile.ZipFile(out, "w") as dst:
+            parts = _xlsx_parts(src)
+            if parts["styles"] is None:
+                raise ValueError("原文件没有样式表 (styles.xml)，无法在原文件上标注")
+            for df, result in sheets.values():
+                if result is None or result["error_rows"] == 0:
+                    continue
+                name = df if isinstance(df, str) else df.attrs["sheet_name"]
+                if isinstance(df, pd.DataFrame) and not df.attrs.get("lean"):
+                    header = [c for c in df.columns if c not in ('__ROW_IDX__', '__KEY__')]
+                else: # 精简读取 / 分块审核：只从原文件解析表头
+                    row = _xlsx_header_row(src, parts["sheets"][name], parts["sharedStrings"])
+                    header = _header_names(row, len(row))
+                marks[parts["sheets"][name]] = _sheet_marks(header, result)
+            styles_part = parts["styles"]
+            style_of, render_styles = _style_patcher(src.read(styles_part))
+            for info in src.infolist():
+                if info.filename == styles_part:
+                    continue
+                entry = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                entry.compress_type = info.compress_type
+                with src.open(info) as fsrc, dst.open(entry, "w") as fdst:
+                    if info.filename in marks:
+                        _patch_sheet_xml(fsrc, fdst, marks[info.filename], style_of)
+                    else:
+                        shutil.copyfileobj(fsrc, fdst)
+            # 新样式在改写 sheet 时才分配，styles.xml 放在最后写出
+            entry = zipfile.ZipInfo(styles_part, date_time=src.getinfo(styles_part).date_time)
+            entry.compress_type = src.getinfo(styles_part).compress_type
+            dst.writestr(entry, render_styles())
+        if output is None:
+            out.seek(0)
+        return out
+
+    output, stats = measure_call(write)
+    return output, dict(stats, 行数=sum(len(m) for m in marks.values()))
+
+# ========== 稀疏错误清单 (供下游工具使用) ==========
+def parquet_available():
+    """是否安装了 pyarrow (Parquet 导出需要；未安装时只提供 CSV)"""
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def error_cells_frame(sheet_results):
+    """
+    {tag: 审核结果} -> 稀疏错误清单 DataFrame(sheet, row, excel_row, column)，每个错误单元格一行。
+    row 为数据行号 (从 0 开始)，excel_row 为工作表中的行号 (第 1 行是表头)。
+    直接由错误位图的非零位置得到，不逐格生成 Python 元组。
+    """
+    parts = []
+    for tag, result in sheet_results.items():
+        if result is None:
+            continue
+        rows, cols = np.nonzero(result["error_bitmap"])
+        parts.append(pd.DataFrame({
+            "sheet": tag,
+            "row": rows,
+            "excel_row": rows + 2,
+            "column": np.array([str(c) for c in result["marked_cols"]], dtype=object)[cols],
+        }))
+    if not parts:
+        return pd.DataFrame({"sheet": [], "row": [], "excel_row": [], "column": []})
+    return pd.concat(parts, ignore_index=True)
+
+def _cell_text(values):
+    """单元格值 -> 文本 (空值为 None；日期为 ISO 格式)，供审核历史保存"""
+    out = []
+    for v in pd.Series(values).astype(object): # datetime64 数组 -> Timestamp
+        if v is None or (not isinstance(v, str) and pd.isna(v)):
+            out.append(None)
+        elif isinstance(v, (pd.Timestamp, datetime)):
+            out.append(v.isoformat())
+        else:
+            out.append(str(v))
+    return out
+
+def error_details(tc_df, result, all_std_dfs, ref_index):
+    """
+    单个 sheet 的逐单元格错误明细：DataFrame(row, contract, contract_key, column, main_value, ref_value)。
+    参考值按审核时的规则 (含条件覆盖) 只对有错误的行重新查找，值均转为文本。
+    """
+    columns = ["row", "contract", "contract_key", "column", "main_value", "ref_value"]
+    flagged = np.flatnonzero(result["row_flags"])
+    if not len(flagged):
+        return pd.DataFrame(columns=columns)
+    plan = compile_sheet_plan(tuple(c for c in tc_df.columns if c not in ('__ROW_IDX__', '__KEY__')))
+    sub = tc_df.iloc[flagged]
+    keys = normalize_contract_key(sub[result["contract_col"]])
+    ref_df = lookup_ref_columns(keys, ref_index, all_std_dfs, RULE_REF_COLS)
+    marked = {c: j for j, c in enumerate(result["marked_cols"])}
+    parts = []
+    for step in plan["steps"]:
+        j = marked.get(step["main_col"])
+        if j is None:
+            continue
+        hit = result["error_bitmap"][flagged, j]
+        if not hit.any():
+            continue
+        s_ref = _ref_series_for(step, sub, ref_df)
+        parts.append(pd.DataFrame({
+            "row": flagged[hit],
+            "contract": _cell_text(sub[result["contract_col"]].to_numpy()[hit]),
+            "contract_key": keys.to_numpy()[hit],
+            "column": str(step["main_col"]),
+            "main_value": _cell_text(sub[step["main_col"]].to_numpy()[hit]),
+            "ref_value": _cell_text(s_ref.to_numpy()[hit]),
+        }))
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(parts, ignore_index=True).sort_values(["row", "column"], ignore_index=True)
+
+def error_cells_bytes(cells, fmt):
+    """把稀疏错误清单写为 "csv" (UTF-8 BOM，Excel 可直接打开) 或 "parquet"，返回 (BytesIO, 写出统计)"""
+    def write():
+        output = BytesIO()
+        if fmt == "parquet":
+            cells.to_parquet(output, index=False)
+        else:
+            output.write(cells.to_csv(index=False).encode("utf-8-sig"))
+        output.seek(0)
+        return output
+    output, stats = measure_call(write)
+    return output, dict(stats, 行数=len(cells))
+
+# ========== 打包下载 (ZIP) ==========
+BUNDLE_SUMMARY_NAME = "提成_审核汇总.csv"
+
+def bundle_summary_frame(sheets, missing_contracts):
+    """打包下载中的汇总表：每个 sheet 一行 (行数、错误数、异常行数、合同号未匹配、各字段错误数)，末行合计"""
+    columns = ["sheet", "行数", "错误数", "异常行数", "合同号未匹配", "各字段错误数", "漏填合同号"]
+    rows = []
+    for tag, (df, result) in sheets.items():
+        fields = zip(result["marked_cols"], result["error_bitmap"].sum(axis=0))
+        rows.append({
+            "sheet": tag,
+            "行数": result["rows"] if "rows" in result else len(df),
+            "错误数": result["total_errors"],
+            "异常行数": result["error_rows"],
+            "合同号未匹配": len(result["unmatched_rows"]),
+            "各字段错误数": "、".join(f"{col}:{int(n)}" for col, n in fields),
+            "漏填合同号": "",
+        })
+    total = {c: sum(r[c] for r in rows) for c in ["行数", "错误数", "异常行数", "合同号未匹配"]}
+    rows.append({"sheet": "合计", **total, "各字段错误数": "", "漏填合同号": len(missing_contracts)})
+    return pd.DataFrame(rows, columns=columns)
+
+def _zip_entry(zf, name):
+    """ZIP 中新文件的写入流；xlsx 本身已是压缩包，按存储方式写入，其余文件压缩"""
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_STORED if name.endswith(".xlsx") else zipfile.ZIP_DEFLATED
+    return zf.open(info, "w")
+
+def write_result_bundle(target, tc_file, sheets, missing_contracts, key_index=None, cached=None, extra=None,
+                        mark_mode="rebuild"):
+    """
+    把一个提成表的全部审核结果打包为一个 ZIP：各 sheet 的审核标注版、错误精简版 (有错误行时)、
+    漏填合同号表 (有漏填时) 与汇总表 (BUNDLE_SUMMARY_NAME)。
+    逐个文件生成并直接写入 ZIP 中的条目，同一时间只生成一个文件，不在内存中另存一份。
+    target: 路径或可写的文件对象
+    sheets: {tag: (DataFrame 或 sheet 名, 审核结果)}；分块审核的结果 (含 "outputs") 已写到磁盘，从文件复制
+    key_index: callable，返回近似匹配索引 (审核标注版的 “合同号未匹配” sheet)
+    cached(文件名)：已生成过的文件内容 (bytes)，没有时返回 None
+    extra: [(文件名, bytes)]，一并打包的其他小文件
+    mark_mode: "rebuild" 为各 sheet 的审核标注版；"patch" 改为一个原文件标注版 (PATCHED_FILE_NAME，见 patch_marked_xlsx)
+    返回打包的文件名列表。
+    """
+    names = []
+    with zipfile.ZipFile(target, "w") as zf:
+        def add(name, write):
+            data = cached(name) if cached else None
+            with _zip_entry(zf, name) as f:
+                if data is not None:
+                    f.write(data)
+                else:
+                    write(f)
+            names.append(name)
+
+        for tag, (df, result) in sheets.items():
+            if "outputs" in result:
+                for path in result["outputs"]:
+                    add(os.path.basename(path), lambda f, path=path: _copy_file(path, f))
+                continue
+            full = [] # 整张 sheet：需要生成时才读取，两个文件共用
+            def full_df():
+                if not full:
+                    full.append(read_output_sheet(tc_file, df))
+                return full[0]
+            if mark_mode == "rebuild":
+                add(artifact_file_name(tag, "审核标注版"), lambda f: build_sheet_artifact(
+                    full_df(), result, "审核标注版", near_miss_report(df, result, key_index()) if key_index else None, f))
+            if result["error_rows"] > 0:
+                add(artifact_file_name(tag, "错误精简版"),
+                    lambda f: build_sheet_artifact(full_df(), result, "错误精简版", output=f))
+        if mark_mode == "patch" and sheets:
+            add(PATCHED_FILE_NAME, lambda f: patch_marked_xlsx(tc_file, sheets, f))
+        if missing_contracts:
+            add(MISSING_FILE_NAME, lambda f: build_missing_artifact(missing_contracts, f))
+        for name, data in extra or []:
+            add(name, lambda f, data=data: f.write(data))
+        add(BUNDLE_SUMMARY_NAME, lambda f: f.write(
+            bundle_summary_frame(sheets, missing_contracts).to_csv(index=False).encode("utf-8-sig")))
+    return names
+
+def _copy_file(path, f):
+    with open(path, "rb") as src:
+        shutil.copyfileobj(src, f)
+
+# ========== 反向漏填检查 ==========
+def find_missing_contracts(tc_sheets, fk_std):
+    """
+    反向漏填检查：放款明细 (潮掣) 中有、但提成表 “总” sheet 中没有的合同号 (均为标准化 Key)。
+    返回排序后的列表。
+    """
+    # 1. 从 "总" sheet 获取标准合同号
+    contracts_total = set()
+    if tc_sheets["总"]:
+        df_total = tc_sheets["总"][0]
+        col = find_col(df_total, "合同", exact=False)
+        if col is not None:
+            contracts_total = set(normalize_contract_key(df_total[col].dropna()))
+
+    # 2. 从预处理的 fk_std DataFrame 获取标准合同号 (已标准化，无需重新读取放款明细)
+    contracts_fk = set(fk_std['__KEY__'].dropna())
+
+    return sorted(list(contracts_fk - contracts_total))
+
+# ========== 合同号近似匹配 (放款明细中查不到的合同号) ==========
+# 删除邻域索引：每个参考 Key 及其删去任一字符后的字符串，按哈希排序存放。
+# 两个 Key 相差一处 (替换 / 增删一个字符 / 相邻交换) 时，必有一对删除变体相同，
+# 因此查询只需对未匹配 Key 的删除变体做二分查找，与参考表规模无关 (n-gram 倒排在
+# “HT-2025-” 这类共同前缀上退化为全表扫描)。
+NEAR_MISS_SHEET = "合同号未匹配"
+KEY_INDEX_CHUNK = 20000 # 构建索引时每批处理的 Key 数 (限制临时字符串的内存)
+
+def _deletion_variants(keys):
+    """每个 Key 自身 (位置 -1) 及删去第 j 个字符后的字符串 -> (变体, 所属 Key 的序号, 删除位置)"""
+    variants, owners, positions = [], [], []
+    for i, key in enumerate(keys):
+        variants.append(key)
+        owners.append(i)
+        positions.append(-1)
+        for j in range(len(key)):
+            variants.append(key[:j] + key[j + 1:])
+            owners.append(i)
+            positions.append(j)
+    return (pd.util.hash_array(np.array(variants, dtype=object)),
+            np.array(owners, dtype=np.int64), np.array(positions, dtype=np.int16))
+
+def build_key_index(fk_std):
+    """对放款明细的 __KEY__ 构建一次近似匹配索引 (dict of numpy 数组，可缓存 / 跨进程传递)"""
+    keys = fk_std['__KEY__'].dropna().astype(str) if '__KEY__' in fk_std.columns else pd.Series([], dtype=object)
+    keys = pd.unique(keys[~keys.isin(["", "NAN"])])
+    parts = []
+    for start in range(0, len(keys), KEY_INDEX_CHUNK):
+        hashes, owners, positions = _deletion_variants(keys[start:start + KEY_INDEX_CHUNK])
+        parts.append((hashes, owners + start, positions))
+    if not parts:
+        parts = [(np.array([], dtype=np.uint64), np.array([], dtype=np.int64), np.array([], dtype=np.int16))]
+    hashes, owners, positions = (np.concatenate(p) for p in zip(*parts))
+    order = np.argsort(hashes, kind="stable")
+    return {"keys": np.asarray(keys, dtype=object), "hashes": hashes[order],
+            "owners": owners[order], "positions": positions[order]}
+
+def suggest_keys(key_index, queries, limit=3):
+    """
+    为每个未匹配的 Key 找出最接近的参考 Key (编辑距离 1 的全部找到；经删除变体偶然命中的距离 2 也保留)。
+    返回 DataFrame(query, key, distance)，每个 query 按 (距离, Key) 取前 limit 个。
+    """
+    queries = np.asarray(pd.unique(pd.Series(queries, dtype=object)), dtype=object)
+    hashes, q_owner, q_pos = _deletion_variants(queries)
+    lo = np.searchsorted(key_index["hashes"], hashes, side="left")
+    hi = np.searchsorted(key_index["hashes"], hashes, side="right")
+    counts = hi - lo
+    hit = np.repeat(np.arange(len(hashes)), counts)
+    idx = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+    pairs = pd.DataFrame({
+        "q": q_owner[hit], "k": key_index["owners"][idx],
+        "q_pos": q_pos[hit].astype(np.int64), "k_pos": key_index["positions"][idx].astype(np.int64),
+    })
+    # 一侧是原串 (增删一个字符) 或同一位置删除 (替换) 为距离 1；相邻位置删除且两字符互换为相邻交换，其余为 2
+    one = (pairs["q_pos"] < 0) | (pairs["k_pos"] < 0) | (pairs["q_pos"] == pairs["k_pos"])
+    adjacent = ((pairs["q_pos"] - pairs["k_pos"]).abs() == 1) & ~one
+    if adjacent.any():
+        swap = [queries[q][i] == key_index["keys"][k][j]
+                for q, k, i, j in pairs.loc[adjacent, ["q", "k", "q_pos", "k_pos"]].itertuples(index=False)]
+        one[adjacent] = swap
+    pairs["distance"] = np.where(one, 1, 2)
+    best = (pairs.sort_values("distance").drop_duplicates(["q", "k"])
+            .assign(key=lambda d: key_index["keys"][d["k"].to_numpy()])
+            .sort_values(["q", "distance", "key"]).groupby("q").head(limit))
+    return pd.DataFrame({
+        "query": queries[best["q"].to_numpy()],
+        "key": best["key"].to_numpy(),
+        "distance": best["distance"].to_numpy(),
+    })
+
+def near_miss_report(tc_df, result, key_index, limit=3):
+    """
+    放款明细中查不到的合同号及最接近的参考合同号 (标注版中的 “合同号未匹配” sheet)。
+    tc_df 为审核时的 sheet (精简或整表均可)，行与审核结果一致。
+    """
+    rows = result["unmatched_rows"]
+    return _near_miss_frame(rows, tc_df[result["contract_col"]].to_numpy()[rows], key_index, limit)
+
+def _near_miss_frame(rows, contracts, key_index, limit=3):
+    """近似匹配结果表：rows 为数据行号，contracts 为这些行的原始合同号"""
+    keys = normalize_contract_key(pd.Series(contracts, dtype=object)).to_numpy()
+    columns = ["行号", "合同号", "标准化合同号", "建议合同号", "编辑距离"]
+    if not len(rows):
+        return pd.DataFrame(columns=columns)
+    best = suggest_keys(key_index, keys, limit)
+    grouped = best.groupby("query", sort=False)
+    suggestions = grouped["key"].agg("、".join)
+    distance = grouped["distance"].min()
+    return pd.DataFrame({
+        "行号": rows + 2,
+        "合同号": contracts,
+        "标准化合同号": keys,
+        "建议合同号": suggestions.reindex(keys).fillna("").to_numpy(),
+        "编辑距离": [None if pd.isna(d) else int(d) for d in distance.reindex(keys)], # 无候选时留空
+    }, columns=columns)
+
+# ========== 分块流式审核 (超大 sheet) ==========
+# 年度汇总的 “总” sheet 可达百万行：按块读取 (openpyxl read_only 逐行解析)、按块审核，标注版 / 错误精简版
+# 以 write_only 模式逐块写出，内存只与块大小有关 (另有每个比对列一字节的错误矩阵)。
+# 整表审核中有几处结果取决于整列：pandas 的列类型推断、空值是否算数值、查找失败时参考列的 dtype 提升。第一遍扫描整张 sheet 记下这些整列信息，第二遍按块审核时按整列的结果处理，
+# 审核结果与标注文件同整表审核一致。(例外：同一文本列中混有布尔值与 0 / 1 时，pandas 整列读取会把
+# 其中一种读成另一种，分块读取不复现这一点。)
+STREAM_CHUNK_ROWS = 50_000 # 默认每块行数
+
+# 各列的整列类型：每块推断出的类型合并为整列类型后，给每块补一行该类型的代表值再推断，使每块与整表读取一致
+_KIND_PAD = {"nan": np.nan, "bool": True, "int": 0, "float": np.nan, "datetime": datetime(2000, 1, 1), "object": "\x00"}
+
+def _open_read_only(file):
+    """与 pandas 的 openpyxl 读取器相同的方式打开工作簿 (只读、取缓存值)"""
+    if hasattr(file, "seek"):
+        file.seek(0)
+    return load_workbook(file, read_only=True, data_only=True, keep_links=False)
+
+def tc_sheet_names(tc_file):
+    """需要审核的 sheet：{tag: sheet名} (tag 与 sheet_jobs_of 相同)，只读取工作簿目录"""
+    wb = _open_read_only(tc_file)
+    try:
+        names = wb.sheetnames
+    finally:
+        wb.close()
+    return sheet_jobs_of(group_tc_sheets({name: name for name in pick_tc_sheets(names)}))
+
+def _iter_sheet_rows(ws):
+    """
+    逐行产出转换后的单元格值 (第一行为表头)。与 pandas 的 openpyxl 读取器相同：
+    去掉行尾的空单元格，末尾的空行不产出 (中间的空行产出为空列表)。
+    """
+    ws.reset_dimensions() # 部分生成工具写出的 dimension 不准确 (与 pandas 相同处理)
+    empty = 0
+    for row in ws.iter_rows():
+        values = [_convert_cell(cell) for cell in row]
+        while values and values[-1] == "":
+            values.pop()
+        if not values:
+            empty += 1 # 后面还有数据时才产出
+            continue
+        yield from ([] for _ in range(empty))
+        empty = 0
+        yield values
+
+def _row_chunks(rows, chunk_rows):
+    while chunk := list(islice(rows, chunk_rows)):
+        yield chunk
+
+def _header_names(header_row, width):
+    """列名 (与 read_excel 相同：空表头为 Unnamed: i，重名列加 .1)；width 为整张 sheet 的最大列数"""
+    return list(TextParser([header_row + [""] * (width - len(header_row))], header=0).read().columns)
+
+def _chunk_frame(rows, names, kinds=None, offset=0):
+    """
+    一块行 -> DataFrame (列名 names，行号从 offset 起)。
+    kinds 给出时按整列类型推断 (见 _KIND_PAD)；否则按本块推断。
+    """
+    width = len(names)
+    data = [r + [""] * (width - len(r)) for r in rows]
+    if kinds is not None:
+        data.insert(0, [_KIND_PAD[k] for k in kinds])
+    frame = TextParser(data, names=names, header=None, skip_blank_lines=False).read()
+    if kinds is not None:
+        frame = frame.iloc[1:]
+    frame.index = pd.RangeIndex(offset, offset + len(rows))
+    return frame
+
+def _column_kind(series):
+    dtype = series.dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        return "bool"
+    if pd.api.types.is_integer_dtype(dtype):
+        return "int"
+    if dtype == object:
+        return "object"
+    if series.isna().all():
+        return "nan" # 整块为空
+    return "datetime" if pd.api.types.is_datetime64_any_dtype(dtype) else "float"
+
+def _combine_kinds(a, b):
+    """两块的列类型 -> 两块合在一起时 pandas 推断出的类型"""
+    if a == b:
+        return a
+    if "nan" in (a, b):
+        other = b if a == "nan" else a
+        return "float" if other in ("bool", "int") else other # 整数 / 布尔列含空值时为 float
+    if "object" in (a, b) or "datetime" in (a, b):
+        return "object"
+    return "float" if "float" in (a, b) else "int"
+
+def _scan_sheet(tc_file, sheet_name, chunk_rows, ref_index, all_std_dfs, kinds=None):
+    """
+    第一遍：逐块扫描整张 sheet，记下按块审核需要的整列信息。没有表头或合同列时返回 None。
+    kinds：已知的整列类型 (重扫时传入)。返回 dict：
+      header_row / width / names：表头与最终列名；rows：数据行数；kinds：各列的整列类型；
+      exact：按块推断的类型是否足以算出下列信息 (否则需带 kinds 重扫)；
+      missing_sources：有查找失败的参考数据源；num_flags：{规则序号: (主表, 参考)}
+    """
+    wb = _open_read_only(tc_file)
+    try:
+        rows = _iter_sheet_rows(wb[sheet_name])
+        header_row = next(rows, None)
+        if header_row is None:
+            return None
+        header = _header_names(header_row, len(header_row))
+        plan = compile_sheet_plan(tuple(header))
+        contract_col = plan["contract_col"]
+        if not contract_col:
+            return None
+        num_steps = [s for s in plan["steps"] if s["compare"]["compare_type"] in ("num", "rate", "term")]
+        num_seen = {s["index"]: [[False, False], [False, False]] for s in num_steps} # 每侧 (有数值, 有非数值非空值)
+        missing_sources = set()
+        width, n_rows = len(header_row), 0
+        known = kinds is not None
+        kinds = list(kinds) if known else []
+        chunk_kinds = {c: set() for c in audit_columns(header)} # 审核列每块推断出的类型
+
+        for chunk in _row_chunks(rows, chunk_rows):
+            width = max([width] + [len(r) for r in chunk])
+            names = _header_names(header_row, len(kinds) if known else width)
+            frame = _chunk_frame(chunk, names, kinds if known else None, n_rows)
+            if not known:
+                this = [_column_kind(frame.iloc[:, i]) for i in range(width)]
+                # 之前各块没有的列 (本块行更宽) 在之前各块中为空
+                kinds = this if not n_rows else [_combine_kinds(a, b) for a, b in zip_longest(kinds, this, fillvalue="nan")]
+                for c in chunk_kinds:
+                    chunk_kinds[c].add(this[header.index(c)])
+            n_rows += len(chunk)
+
+            keys = normalize_contract_key(frame[contract_col])
+            pos = ref_index.index.get_indexer(keys)
+            for name in ref_index.columns:
+                if name not in missing_sources and ((pos < 0) | (ref_index[name].to_numpy()[pos] < 0)).any():
+                    missing_sources.add(name)
+            ref_df = lookup_ref_columns(keys, ref_index, all_std_dfs, RULE_REF_COLS)
+            for step in num_steps:
+                sides = num_seen[step["index"]]
+                for side, values in enumerate((frame[step["main_col"]], _ref_series_for(step, frame, ref_df))):
+                    _, is_num, none_mask = num_parts_vec(values)
+                    sides[side][0] |= bool(is_num.any())
+                    sides[side][1] |= bool((~is_num & ~none_mask).any())
+    finally:
+        wb.close()
+
+    # 按块推断的类型与整列类型只差 “空 / 整数 -> float” 时，上面的数值分类不受影响
+    final = dict(zip(header, kinds))
+    exact = known or all(
+        k in (final[c], "nan") or (k, final[c]) == ("int", "float") for c, ks in chunk_kinds.items() for k in ks
+    )
+    return {
+        "header_row": header_row,
+        "width": width,
+        "names": _header_names(header_row, width),
+        "rows": n_rows,
+        "kinds": kinds or ["nan"] * width,
+        "exact": exact,
+        "missing_sources": missing_sources,
+        "num_flags": {i: tuple(seen_num and not seen_other for seen_num, seen_other in sides)
+                      for i, sides in num_seen.items()},
+    }
+
+def fk_contract_keys(fk_std):
+    """放款明细中的标准化合同号 (去重)，分块审核的漏填检查按此顺序记录是否出现"""
+    return pd.Index(fk_std['__KEY__'].dropna().unique())
+
+def missing_contracts_of(fk_std, seen):
+    """
+    分块审核的反向漏填检查 (结果同 find_missing_contracts)：
+    seen 为 “总” sheet 审核结果中的 fk_keys_seen；没有 “总” sheet 或其中没有合同列时为 None。
+    """
+    keys = fk_contract_keys(fk_std)
+    return sorted(keys[~seen] if seen is not None else keys)
+
+def stream_audit_sheet(tc_file, sheet_name, all_std_dfs, ref_index=None, outputs=None, chunk_rows=STREAM_CHUNK_ROWS,
+                       key_index=None, details=False, on_chunk=None):
+    """
+    分块审核单个 sheet (超大 sheet 用，内存与块大小有关而与 sheet 行数基本无关)。
+    第一遍扫描整列信息，第二遍逐块查找参考列、比对并直接写出，不在内存中保留整张 sheet 或整个工作簿。
+    outputs: {"审核标注版": 路径, "错误精简版": 路径}，只写出给出的文件 (错误精简版在有错误行时才写)
+    key_index: build_key_index 的结果；给出时审核标注版追加 “合同号未匹配” sheet
+    details: 为 True 时收集逐单元格错误明细 (error_details 的格式，审核历史使用)
+    on_chunk(rows_done, rows_total)：每块审核完成后回调
+    返回与 audit_one_sheet 相同结构的结果 dict，另有 "rows"、"outputs" (写出的文件)、
+    "fk_keys_seen" (放款明细各合同号是否出现，见 missing_contracts_of)、"error_details"；未找到‘合同’列时返回 None。
+    """
+    outputs = outputs or {}
+    if ref_index is None:
+        ref_index = build_ref_index(all_std_dfs)
+    profile = []
+    with profile_stage(profile, "流式扫描", f"每块 {chunk_rows} 行") as rec:
+        scan = _scan_sheet(tc_file, sheet_name, chunk_rows, ref_index, all_std_dfs)
+        if scan is not None and not scan["exact"]:
+            scan = _scan_sheet(tc_file, sheet_name, chunk_rows, ref_index, all_std_dfs, scan["kinds"])
+        rec["行数"] = scan and scan["rows"]
+    if scan is None:
+        return None
+
+    names, kinds = scan["names"], scan["kinds"]
+    plan = compile_sheet_plan(tuple(names))
+    contract_col = plan["contract_col"]
+    plan_cols = list(dict.fromkeys(step["main_col"] for step in plan["steps"]))
+    col_pos = {c: j for j, c in enumerate(plan_cols)}
+    marked_pos = [names.index(c) for c in plan_cols]
+    contract_pos = names.index(contract_col)
+    fk_keys = fk_contract_keys(all_std_dfs["fk"]) if "fk" in all_std_dfs else pd.Index([])
+    fk_seen = np.zeros(len(fk_keys), dtype=bool)
+
+    wb_full = wb_err = ws_full = ws_err = None
+    if "审核标注版" in outputs:
+        wb_full = Workbook(write_only=True)
+        ws_full = wb_full.create_sheet("Sheet")
+        ws_full.append(list(names))
+
+    matrices, unmatched, unmatched_contracts, detail_parts = [], [], [], []
+    total_errors = 0
+    wb = _open_read_only(tc_file)
+    try:
+        with profile_stage(profile, "流式审核", f"每块 {chunk_rows} 行", rows=scan["rows"]):
+            rows = _iter_sheet_rows(wb[sheet_name])
+            next(rows) # 表头
+            offset = 0
+            for chunk in _row_chunks(rows, chunk_rows):
+                frame = _chunk_frame(chunk, names, kinds, offset)
+                keys = normalize_contract_key(frame[contract_col])
+                ref_df, chunk_unmatched = _lookup_sheet_refs(keys, frame[contract_col], ref_index, all_std_dfs,
+                                                             scan["missing_sources"])
+                errors = np.zeros((len(frame), len(plan_cols)), dtype=bool)
+                for step in plan["steps"]:
+                    s_ref = _ref_series_for(step, frame, ref_df)
+                    step_errors = compare_series_vec(
+                        frame[step["main_col"]], s_ref, **step["compare"],
+                        as_num=scan["num_flags"].get(step["index"], (None, None)),
+                        dates=(None, _ref_series_for(step, frame, ref_df, dates=True)),
+                    ).to_numpy(dtype=bool)
+                    total_errors += int(step_errors.sum())
+                    errors[:, col_pos[step["main_col"]]] |= step_errors
+                row_flags = errors.any(axis=1)
+
+                # 逐块写出 (write_only：已写出的行不留在内存中)
+                if ws_full is not None:
+                    _append_marked_rows(ws_full, dataframe_to_rows(frame, index=False, header=False), errors,
+                                        marked_pos, contract_pos, row_flags)
+                if "错误精简版" in outputs and row_flags.any():
+                    if ws_err is None:
+                        wb_err = Workbook(write_only=True)
+                        ws_err = wb_err.create_sheet("Sheet")
+                        ws_err.append(list(names))
+                    _append_marked_rows(ws_err, dataframe_to_rows(frame[row_flags], index=False, header=False),
+                                        errors[row_flags], marked_pos, contract_pos, row_flags[row_flags])
+
+                hit = fk_keys.get_indexer(keys[frame[contract_col].notna()])
+                fk_seen[hit[hit >= 0]] = True
+                unmatched.append(chunk_unmatched + offset)
+                unmatched_contracts.append(frame[contract_col].to_numpy()[chunk_unmatched])
+                if details and row_flags.any():
+                    part = error_details(frame, {"row_flags": row_flags, "error_bitmap": errors, "marked_cols": plan_cols,
+                                                 "contract_col": contract_col}, all_std_dfs, ref_index)
+                    detail_parts.append(part.assign(row=part["row"] + offset))
+                matrices.append(errors)
+                offset += len(frame)
+                if on_chunk:
+                    on_chunk(offset, scan["rows"])
+    finally:
+        wb.close()
+
+    error_matrix = np.concatenate(matrices) if matrices else np.zeros((0, len(plan_cols)), dtype=bool)
+    has_errors = error_matrix.any(axis=0)
+    error_bitmap = error_matrix[:, has_errors]
+    row_flags = error_bitmap.any(axis=1)
+    unmatched_rows = np.concatenate(unmatched) if unmatched else np.array([], dtype=np.int64)
+
+    written = []
+    with profile_stage(profile, "写出文件", "流式", rows=scan["rows"]):
+        if wb_full is not None:
+            near_miss = None
+            if key_index is not None:
+                contracts = np.concatenate(unmatched_contracts) if unmatched_contracts else np.array([], dtype=object)
+                near_miss = _near_miss_frame(unmatched_rows, contracts, key_index)
+            _append_extra_sheets(wb_full, {NEAR_MISS_SHEET: near_miss} if near_miss is not None and len(near_miss) else None)
+            wb_full.save(outputs["审核标注版"])
+            written.append(outputs["审核标注版"])
+        if wb_err is not None:
+            wb_err.save(outputs["错误精简版"])
+            written.append(outputs["错误精简版"])
+
+    return {
+        "contract_col": contract_col,
+        "marked_cols": [c for c, keep in zip(plan_cols, has_errors) if keep],
+        "error_bitmap": error_bitmap,
+        "row_flags": row_flags,
+        "total_errors": total_errors,
+        "error_rows": int(row_flags.sum()),
+        "unmatched_rows": unmatched_rows,
+        "profile": profile,
+        "delta": None,
+        "delta_state": None,
+        "rows": scan["rows"],
+        "outputs": written,
+        "fk_keys_seen": fk_seen,
+        "error_details": (pd.concat(detail_parts, ignore_index=True) if detail_parts else
+                          pd.DataFrame(columns=["row", "contract", "contract_key", "column", "main_value", "ref_value"]))
+                         if details else None,
+    }
+
+# ========== 多进程并发审核 ==========
+_WORKER_REFS = {} # 子进程内的参考数据 (由 initializer 每个进程只传一次)
+
+def _init_worker(all_std_dfs, ref_index):
+    _WORKER_REFS["all_std_dfs"] = all_std_dfs
+    _WORKER_REFS["ref_index"] = ref_index
+
+def _audit_in_worker(tc_df, previous=None):
+    return audit_one_sheet(tc_df, _WORKER_REFS["all_std_dfs"], _WORKER_REFS["ref_index"], previous=previous)
+
+@contextmanager
+def _main_script_hidden():
+    """
+    Streamlit 把页面脚本注册为 __main__，而 spawn 子进程启动时会重新执行 __main__.__file__
+    (即整个页面)。创建子进程期间临时去掉该属性，子进程只需导入本模块。
+    """
+    main = sys.modules.get("__main__")
+    main_file = getattr(main, "__file__", None)
+    if main_file is not None:
+        del main.__file__
+    try:
+        yield
+    finally:
+        if main_file is not None:
+            main.__file__ = main_file
+
+def audit_sheets_parallel(sheets, all_std_dfs, ref_index, workers, on_sheet_done=None, previous=None):
+    """
+    用进程池并发审核多个 sheet。
+    sheets: {tag: DataFrame}；参考表与预连接索引通过 initializer 每个子进程只传一次。
+    on_sheet_done(tag, n_done, n_total)：每完成一个 sheet 在主进程中回调一次。
+    previous: {tag: 上一次的审核结果}，用于增量审核 (见 audit_one_sheet)。
+    返回 {tag: 审核结果}，顺序与 sheets 一致 (与完成先后无关)。
+    """
+    if not sheets:
+        return {}
+    workers = max(1, min(workers, len(sheets)))
+    ctx = multiprocessing.get_context("spawn") # 不 fork 正在运行的服务进程
+    done = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=_init_worker, initargs=(all_std_dfs, ref_index)) as pool:
+        with _main_script_hidden(): # 子进程在 submit 时按需创建
+            futures = {pool.submit(_audit_in_worker, df, (previous or {}).get(tag)): tag for tag, df in sheets.items()}
+        for n_done, future in enumerate(as_completed(futures), start=1):
+            tag = futures[future]
+            done[tag] = future.result()
+            if on_sheet_done:
+                on_sheet_done(tag, n_done, len(futures))
+    return {tag: done[tag] for tag in sheets}
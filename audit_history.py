@@ -0,0 +1,262 @@
+# =====================================
+# 审核历史：每次审核的元数据、逐单元格错误 (主表值 / 参考值) 与漏填合同号
+# 保存到本地 SQLite，按合同 Key / 运行编号建索引，历史查询无需重新审核归档文件
+# 用法: python audit_history.py runs | contract <合同号> | repeat [--months 3] | export <run_id> [-o 文件] | delete <run_id>
+# =====================================
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+from contextlib import closing
+from datetime import datetime
+
+import pandas as pd
+
+from audit_core import FIELD_RULES, normalize_contract_key, error_details
+
+HISTORY_DB = os.environ.get("TC_AUDIT_HISTORY_DB") or \
+    os.path.join(os.path.expanduser("~"), ".tc_audit", "history.sqlite3")
+SCHEMA_VERSION = 1 # 表结构变化时递增 (见 connect)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_key           TEXT NOT NULL UNIQUE, -- 提成表 + 参考表 + 字段规则 + 期间的摘要，同一次审核只记录一次
+    created_at        TEXT NOT NULL,
+    period            TEXT NOT NULL,        -- 审核所属期间 (YYYY-MM)，按月查询的依据
+    source            TEXT NOT NULL,        -- app / cli
+    tc_file           TEXT,
+    ref_files         TEXT,                 -- JSON
+    total_errors      INTEGER,
+    error_rows        INTEGER,
+    missing_contracts INTEGER
+);
+CREATE TABLE IF NOT EXISTS run_sheets (
+    run_id              INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    sheet               TEXT NOT NULL,
+    rows                INTEGER,
+    total_errors        INTEGER,
+    error_rows          INTEGER,
+    unmatched_contracts INTEGER
+);
+CREATE TABLE IF NOT EXISTS errors (
+    run_id       INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    sheet        TEXT NOT NULL,
+    row          INTEGER NOT NULL,              -- 数据行号 (从 0 开始，不含表头)
+    contract     TEXT,
+    contract_key TEXT,
+    field        TEXT NOT NULL,
+    main_value   TEXT,
+    ref_value    TEXT
+);
+CREATE TABLE IF NOT EXISTS missing_contracts (
+    run_id       INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    contract_key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_runs_period ON runs(period);
+CREATE INDEX IF NOT EXISTS idx_errors_key ON errors(contract_key);
+CREATE INDEX IF NOT EXISTS idx_errors_run ON errors(run_id);
+CREATE INDEX IF NOT EXISTS idx_missing_key ON missing_contracts(contract_key);
+CREATE INDEX IF NOT EXISTS idx_missing_run ON missing_contracts(run_id);
+"""
+
+def connect(db_path=None):
+    """打开 (必要时创建) 历史库；表结构版本不符时报错，不静默改写已有数据"""
+    db_path = db_path or HISTORY_DB
+    if db_path != ":memory:":
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA foreign_keys = ON")
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version not in (0, SCHEMA_VERSION):
+        conn.close()
+        raise RuntimeError(f"审核历史库 {db_path} 的表结构版本为 {version}，当前程序需要 {SCHEMA_VERSION}")
+    with conn:
+        conn.executescript(SCHEMA)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    return conn
+
+def run_key(tc_digest, ref_digests, period):
+    """同一提成表 / 参考表 / 字段规则 / 期间的审核只记录一次 (页面重跑、重复运行不产生重复记录)"""
+    raw = repr((tc_digest, tuple(ref_digests), repr(FIELD_RULES), period))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def current_period():
+    return datetime.now().strftime("%Y-%m")
+
+def valid_period(period):
+    """期间格式为 YYYY-MM"""
+    return re.fullmatch(r"\d{4}-(0[1-9]|1[0-2])", period or "") is not None
+
+def find_run(key, db_path=None):
+    """按 run_key 查找已记录的运行，返回 run_id 或 None (历史库尚不存在时不创建)"""
+    if not os.path.exists(db_path or HISTORY_DB):
+        return None
+    with closing(connect(db_path)) as conn:
+        row = conn.execute("SELECT run_id FROM runs WHERE run_key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def record_run(key, meta, sheet_stats, errors, missing_contracts, db_path=None):
+    """
+    记录一次审核 (单个事务)。已记录过的 run_key 直接返回原 run_id。
+    meta: {"period", "source", "tc_file", "ref_files"}
+    sheet_stats: {sheet: {"rows", "total_errors", "error_rows", "unmatched_contracts"}}
+    errors: DataFrame(sheet, row, contract, contract_key, column, main_value, ref_value) (见 audit_core.error_details)
+    missing_contracts: 漏填合同号 (标准化 Key) 列表
+    """
+    with closing(connect(db_path)) as conn:
+        row = conn.execute("SELECT run_id FROM runs WHERE run_key = ?", (key,)).fetchone()
+        if row:
+            return row[0]
+        with conn:
+            cur = conn.execute(
+                "INSERT INTO runs (run_key, created_at, period, source, tc_file, ref_files, total_errors, error_rows,"
+                " missing_contracts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, datetime.now().isoformat(timespec="seconds"), meta.get("period") or current_period(),
+                 meta.get("source", ""), meta.get("tc_file"), json.dumps(meta.get("ref_files", {}), ensure_ascii=False),
+                 sum(s["total_errors"] for s in sheet_stats.values()),
+                 sum(s["error_rows"] for s in sheet_stats.values()), len(missing_contracts))
+            )
+            run_id = cur.lastrowid
+            conn.executemany(
+                "INSERT INTO run_sheets (run_id, sheet, rows, total_errors, error_rows, unmatched_contracts)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [(run_id, sheet, s["rows"], s["total_errors"], s["error_rows"], s.get("unmatched_contracts"))
+                 for sheet, s in sheet_stats.items()]
+            )
+            conn.executemany(
+                "INSERT INTO errors (run_id, sheet, row, contract, contract_key, field, main_value, ref_value)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((run_id, r.sheet, int(r.row), r.contract, r.contract_key, r.column, r.main_value, r.ref_value)
+                 for r in errors.itertuples(index=False))
+            )
+            conn.executemany(
+                "INSERT INTO missing_contracts (run_id, contract_key) VALUES (?, ?)",
+                ((run_id, k) for k in missing_contracts)
+            )
+    return run_id
+
+def record_audit(key, meta, sheets, all_std_dfs, ref_index, missing_contracts, db_path=None):
+    """
+    记录 app / 命令行的一次审核：sheets 为 {sheet: (提成表 DataFrame, audit_one_sheet 结果)}。
+    分块审核的结果自带行数与错误明细 (见 audit_core.stream_audit_sheet)，DataFrame 处可为 sheet 名。
+    已记录过的 run_key 不再查找参考值，直接返回 (run_id, False)；新记录返回 (run_id, True)。
+    """
+    run_id = find_run(key, db_path)
+    if run_id is not None:
+        return run_id, False
+    sheet_stats, parts = {}, []
+    for tag, (df, result) in sheets.items():
+        sheet_stats[tag] = {"rows": result["rows"] if "rows" in result else len(df), "total_errors": result["total_errors"],
+                            "error_rows": result["error_rows"], "unmatched_contracts": len(result["unmatched_rows"])}
+        details = result.get("error_details")
+        if details is None:
+            details = error_details(df, result, all_std_dfs, ref_index)
+        parts.append(details.assign(sheet=tag))
+    errors = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(
+        columns=["sheet", "row", "contract", "contract_key", "column", "main_value", "ref_value"])
+    return record_run(key, meta, sheet_stats, errors, missing_contracts, db_path), True
+
+def _query(sql, params=(), db_path=None):
+    with closing(connect(db_path)) as conn:
+        return pd.read_sql_query(sql, conn, params=params)
+
+def list_runs(db_path=None):
+    """所有运行 (最新的在前)"""
+    return _query("SELECT run_id, period, created_at, source, tc_file, total_errors, error_rows, missing_contracts"
+                  " FROM runs ORDER BY run_id DESC", db_path=db_path)
+
+def run_errors(run_id, db_path=None):
+    """一次运行的全部错误单元格 (excel_row 为工作表中的行号，第 1 行是表头)"""
+    return _query("SELECT sheet, row, row + 2 AS excel_row, contract, contract_key, field, main_value, ref_value"
+                  " FROM errors WHERE run_id = ? ORDER BY sheet, row, field", (run_id,), db_path)
+
+def run_missing(run_id, db_path=None):
+    return _query("SELECT contract_key FROM missing_contracts WHERE run_id = ? ORDER BY contract_key", (run_id,), db_path)
+
+def contract_history(contract, db_path=None):
+    """
+    一个合同在各次运行中的记录 (合同号按审核时的规则标准化后查索引)：
+    错误单元格 (kind = 错误) 与漏填 (kind = 漏填)。
+    """
+    key = normalize_contract_key(pd.Series([contract], dtype=object)).iloc[0]
+    return _query(
+        "SELECT r.run_id, r.period, r.created_at, r.tc_file, '错误' AS kind, e.sheet, e.row + 2 AS excel_row,"
+        " e.field, e.main_value, e.ref_value"
+        " FROM errors e JOIN runs r ON r.run_id = e.run_id WHERE e.contract_key = ?"
+        " UNION ALL"
+        " SELECT r.run_id, r.period, r.created_at, r.tc_file, '漏填' AS kind, NULL, NULL, NULL, NULL, NULL"
+        " FROM missing_contracts m JOIN runs r ON r.run_id = m.run_id WHERE m.contract_key = ?"
+        " ORDER BY 1 DESC, 6, 7, 8", (key, key), db_path
+    )
+
+def repeat_flagged(months=3, db_path=None, all_runs=False):
+    """
+    连续 months 个期间 (月) 及以上都有错误单元格的合同。
+    默认每个期间只看最后一次运行 (同月修正后重新上传的，以修正后的结果为准)；
+    all_runs=True 时同一期间的所有运行都计入，错误数为各次运行之和。
+    返回 DataFrame(contract_key, 连续月数, 起始期间, 结束期间, 错误数)，按连续月数降序。
+    """
+    latest = "" if all_runs else " WHERE r.run_id IN (SELECT MAX(run_id) FROM runs GROUP BY period)"
+    flagged = _query(
+        "SELECT e.contract_key, r.period, COUNT(*) AS n_errors FROM errors e JOIN runs r ON r.run_id = e.run_id"
+        + latest + " GROUP BY e.contract_key, r.period", db_path=db_path
+    )
+    columns = ["contract_key", "连续月数", "起始期间", "结束期间", "错误数"]
+    if flagged.empty:
+        return pd.DataFrame(columns=columns)
+    flagged["month"] = pd.PeriodIndex(flagged["period"], freq="M").asi8 # 月份序号
+    flagged = flagged.sort_values(["contract_key", "month"], ignore_index=True)
+    # 同一合同中，月份序号与组内序号之差不变的为一段连续月份
+    streak = flagged["month"] - flagged.groupby("contract_key").cumcount()
+    runs = flagged.groupby(["contract_key", streak]).agg(
+        连续月数=("period", "size"), 起始期间=("period", "first"), 结束期间=("period", "last"), 错误数=("n_errors", "sum")
+    ).reset_index(level=0)
+    runs = runs[runs["连续月数"] >= months]
+    return runs[columns].sort_values(["连续月数", "错误数"], ascending=False, ignore_index=True)
+
+def delete_run(run_id, db_path=None):
+    """删除一次运行及其错误 / 漏填记录，返回是否删除"""
+    with closing(connect(db_path)) as conn, conn:
+        return conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,)).rowcount > 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="审核历史查询 / 导出")
+    parser.add_argument("--db", help=f"历史库路径，默认 {HISTORY_DB} (环境变量 TC_AUDIT_HISTORY_DB)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("runs", help="列出所有运行")
+    p = sub.add_parser("contract", help="一个合同在各次运行中的错误 / 漏填记录")
+    p.add_argument("contract")
+    p = sub.add_parser("repeat", help="连续多个月被标记的合同")
+    p.add_argument("--months", type=int, default=3)
+    p.add_argument("--all-runs", action="store_true", help="同一期间的所有运行都计入 (默认只看每个期间的最后一次运行)")
+    p = sub.add_parser("export", help="导出一次运行的错误单元格 (CSV)")
+    p.add_argument("run_id", type=int)
+    p.add_argument("-o", "--output", help="输出文件，默认输出到标准输出")
+    p = sub.add_parser("delete", help="删除一次运行")
+    p.add_argument("run_id", type=int)
+    args = parser.parse_args(argv)
+
+    if args.command == "delete":
+        print("已删除" if delete_run(args.run_id, args.db) else f"没有运行 {args.run_id}")
+        return 0
+    if args.command == "runs":
+        df = list_runs(args.db)
+    elif args.command == "contract":
+        df = contract_history(args.contract, args.db)
+    elif args.command == "repeat":
+        df = repeat_flagged(args.months, args.db, args.all_runs)
+    else:
+        df = run_errors(args.run_id, args.db)
+        if args.output:
+            df.to_csv(args.output, index=False, encoding="utf-8-sig")
+            print(f"已导出 {len(df)} 行到 {args.output}")
+            return 0
+    print(df.to_string(index=False) if len(df) else "(无记录)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
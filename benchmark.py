@@ -0,0 +1,289 @@
+# =====================================
+# 基准测试：在合成数据上分阶段计时 (读取 / 参考表预处理 / 审核 / 写出)，
+# 结果追加到 bench_results/results.jsonl，并与同规模的上一次结果对比；
+# 同时以注入的错误为基准，检查被标记的单元格是否变化
+# 用法: python benchmark.py [--rows 10000 100000 1000000] [--label 说明]
+#       python benchmark.py --dates [500000]   # 只对比日期解析 (改动前的 pd.to_datetime 与 normalize_date_vec)
+#       python benchmark.py --read-once [20] [--sheet-rows 2500]   # 只对比逐 sheet read_excel 与 read_sheets_once
+# =====================================
+import argparse
+import hashlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+from audit_core import (
+    EXCEL_ENGINE, measure, read_tc_sheets, read_output_sheet, sheet_jobs_of, build_ref_tables,
+    audit_one_sheet, build_sheet_artifact, error_cells_frame, build_key_index, near_miss_report,
+    normalize_date_vec, read_sheets_once,
+)
+from synth_data import generate_dataset, load_dataset
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_DIR = os.path.join(HERE, "bench_data")
+DEFAULT_RESULTS = os.path.join(HERE, "bench_results", "results.jsonl")
+EDITED_ROWS = 20 # 增量复审阶段每个 sheet 改动的行数
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def get_dataset(data_dir, rows, error_rate, seed):
+    """同一 (行数, 错误率, 种子) 的数据集只生成一次"""
+    path = os.path.join(data_dir, f"rows{rows}_err{error_rate}_seed{seed}")
+    data = load_dataset(path)
+    if data is None:
+        print(f"生成数据集 {path} ...", file=sys.stderr, flush=True)
+        data = generate_dataset(path, rows, error_rate, seed)
+    return data
+
+def check_against_truth(flagged, ground_truth):
+    """与注入的错误对比：漏标 (注入了但未标记) / 多标 (未注入但被标记)，按字段计数"""
+    flagged = flagged[["sheet", "row", "column"]]
+    merged = ground_truth.merge(flagged, how="outer", on=["sheet", "row", "column"], indicator=True)
+    missed = merged[merged["_merge"] == "left_only"]
+    extra = merged[merged["_merge"] == "right_only"]
+    digest = hashlib.sha256(
+        flagged.sort_values(["sheet", "row", "column"]).to_csv(index=False).encode("utf-8")
+    ).hexdigest()[:16]
+    return {
+        "injected": len(ground_truth),
+        "flagged": len(flagged),
+        "missed": len(missed),
+        "extra": len(extra),
+        "missed_by_field": missed["column"].value_counts().to_dict(),
+        "extra_by_field": extra["column"].value_counts().to_dict(),
+        "flagged_digest": digest, # 标记结果的指纹：优化前后应保持不变
+    }
+
+def peak_rss_mb():
+    """进程启动以来的峰值 RSS (MB)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024, 1) # macOS 为字节，Linux 为 KB
+
+def run_once(data, write_outputs=True, lean=True):
+    """对一套数据跑完整流程，返回 (各阶段统计, 标记检查结果)；lean=False 时提成表整表读取 (对比内存用)"""
+    files = data["files"]
+    stages = {}
+
+    with measure() as stats:
+        tc_sheets = read_tc_sheets(files["提成"], lean=lean)
+    sheet_jobs = sheet_jobs_of(tc_sheets)
+    stages["读取提成表"] = dict(stats, 行数=sum(len(df) for df in sheet_jobs.values()),
+                             数据内存MB=round(sum(df.memory_usage(deep=True).sum() for df in sheet_jobs.values()) / 1024 ** 2, 1))
+
+    ref_profile = []
+    with measure() as stats:
+        all_std_dfs, ref_index = build_ref_tables(
+            files["放款明细"], files["二次明细"], files["原表"], disk_cache=False, profile=ref_profile
+        )
+    stages["参考表 (合计)"] = dict(stats, 行数=sum(len(df) for df in all_std_dfs.values()))
+    for stage in ["读取参考表", "预处理参考表", "预连接索引"]:
+        records = [r for r in ref_profile if r["阶段"] == stage]
+        stages[stage] = {
+            "耗时(s)": round(sum(r["耗时(s)"] for r in records), 3),
+            "峰值内存(MB)": max((r["峰值内存(MB)"] or 0 for r in records), default=0),
+            "行数": sum(r["行数"] or 0 for r in records),
+        }
+
+    with measure() as stats:
+        sheet_results = {tag: audit_one_sheet(df, all_std_dfs, ref_index) for tag, df in sheet_jobs.items()}
+    stages["审核"] = dict(stats, 行数=sum(len(df) for df in sheet_jobs.values()))
+    field_times = {}
+    for result in sheet_results.values():
+        for r in (result or {}).get("profile", []):
+            if r["阶段"] == "字段比对":
+                field_times[r["字段"]] = round(field_times.get(r["字段"], 0) + r["耗时(s)"], 3)
+    stages["审核"]["字段耗时(s)"] = field_times
+
+    # 增量复审：每个 sheet 改动少量行后，以上一次结果为基准重新审核
+    with measure() as stats:
+        rechecked = 0
+        for tag, result in sheet_results.items():
+            if result is None:
+                continue
+            edited = sheet_jobs[tag].drop(columns=["__ROW_IDX__", "__KEY__"])
+            edited.loc[edited.index[:EDITED_ROWS], "家访"] = 0
+            rechecked += audit_one_sheet(edited, all_std_dfs, ref_index, previous=result)["delta"]["rechecked_rows"]
+    stages["增量复审"] = dict(stats, 行数=sum(len(df) for df in sheet_jobs.values()), 复核行数=rechecked)
+
+    # 合同号近似匹配：构建索引 + 每个 sheet 的未匹配清单
+    with measure() as stats:
+        key_index = build_key_index(all_std_dfs["fk"])
+        near_miss = {tag: near_miss_report(sheet_jobs[tag], result, key_index)
+                     for tag, result in sheet_results.items() if result is not None}
+    stages["合同号近似匹配"] = dict(stats, 行数=sum(len(r) for r in near_miss.values()),
+                              有候选=sum(int((r["建议合同号"] != "").sum()) for r in near_miss.values()))
+
+    if write_outputs:
+        with measure() as stats:
+            written = 0
+            for tag, result in sheet_results.items():
+                if result is None:
+                    continue
+                full_df = read_output_sheet(files["提成"], sheet_jobs[tag]) # 精简读取时含整表重读
+                for kind in ["审核标注版", "错误精简版"]:
+                    _, write_stats = build_sheet_artifact(full_df, result, kind, near_miss[tag])
+                    written += write_stats["行数"]
+        stages["写出 xlsx"] = dict(stats, 行数=written)
+
+    return stages, check_against_truth(error_cells_frame(sheet_results), data["ground_truth"])
+
+def date_columns(rows, seed):
+    """日期解析对比用的几种列：{说明: Series}，日期取 2024 年内，重复度与提成表相近"""
+    rng = np.random.default_rng(seed)
+    days = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 366, rows), unit="D")
+    serial = rng.random(rows) < 0.1
+    as_text = ~serial & (rng.random(rows) < 0.5)
+    mixed = pd.Series(days).astype(object).to_numpy()
+    mixed[as_text] = days[as_text].strftime("%Y/%m/%d")
+    mixed[serial] = (days[serial] - pd.Timestamp("1899-12-30")).days
+    return {
+        "datetime 列": pd.Series(days),
+        "文本 %Y-%m-%d": pd.Series(days.strftime("%Y-%m-%d"), dtype=object),
+        "文本 %Y/%m/%d (不补零)": pd.Series([f"{d.year}/{d.month}/{d.day}" for d in days], dtype=object),
+        "文本 两种格式混合": pd.Series(np.where(rng.random(rows) < 0.5, days.strftime("%Y-%m-%d"),
+                                         days.strftime("%Y年%m月%d日")), dtype=object),
+        "混合 (datetime / 文本 / 序列号)": pd.Series(mixed, dtype=object),
+    }
+
+def bench_dates(rows, seed):
+    """改动前的日期解析 (pd.to_datetime 按首个值推断格式) 与 normalize_date_vec 的耗时与解析结果对比"""
+    print(f"\n== 日期解析 {rows} 行 ==")
+    print(f"{'列':<28}{'旧(s)':>9}{'新(s)':>9}{'加速':>8}{'旧 解析出':>11}{'新 解析出':>11}{'结果不同':>10}")
+    for name, col in date_columns(rows, seed).items():
+        with measure() as old_stats:
+            old = pd.to_datetime(col, errors="coerce").dt.normalize()
+        with measure() as new_stats:
+            new = normalize_date_vec(col)
+        t_old, t_new = old_stats["耗时(s)"], new_stats["耗时(s)"]
+        speedup = f"{t_old / t_new:.1f}x" if t_new else "-"
+        differ = int((old.ne(new) & (old.notna() | new.notna())).sum()) # 序列号被旧实现当作纳秒时间戳等
+        print(f"{name:<28}{t_old:>9}{t_new:>9}{speedup:>8}{int(old.notna().sum()):>11}{int(new.notna().sum()):>11}"
+              f"{differ:>10}")
+    print("参考表的日期列在预处理时解析并随参考表缓存，审核时参考侧不再解析。")
+
+def multi_sheet_workbook(data_dir, sheets, rows, seed):
+    """多 sheet 的工作簿 (每个 sheet 文本 / 整数 / 金额 / 日期 / 比例混合列)，同一参数只生成一次"""
+    path = os.path.join(data_dir, f"multisheet_{sheets}x{rows}_seed{seed}.xlsx")
+    if os.path.exists(path):
+        return path
+    rng = np.random.default_rng(seed)
+    wb = Workbook(write_only=True)
+    for n in range(sheets):
+        ws = wb.create_sheet(f"轻卡{n + 1}")
+        ws.append(["合同号", "客户", "期限", "放款金额", "放款日期", "利率", "备注"])
+        dates = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 700, rows), unit="D")
+        for i in range(rows):
+            ws.append([f"HT-{n:02d}-{i:06d}", f"客户{rng.integers(0, 500)}", int(rng.choice([12, 24, 36])),
+                       float(rng.integers(10000, 500000)), dates[i].to_pydatetime(), f"{rng.integers(1, 99) / 10}%",
+                       None if rng.random() < 0.7 else "加急"])
+    os.makedirs(data_dir, exist_ok=True)
+    wb.save(path)
+    return path
+
+def bench_read_once(data_dir, sheets, rows, seed):
+    """改动前的逐 sheet pd.read_excel (每次重新打开、解析工作簿) 与 read_sheets_once (只打开一次) 的耗时对比"""
+    path = multi_sheet_workbook(data_dir, sheets, rows, seed)
+    print(f"\n== 读取 {sheets} 个 sheet × {rows} 行 ({path}) ==")
+    with measure() as old_stats:
+        names = pd.ExcelFile(path).sheet_names
+        old = {name: pd.read_excel(path, sheet_name=name) for name in names}
+    with measure() as new_stats:
+        new = read_sheets_once(path)
+    same = list(old) == list(new) and all(old[n].equals(new[n]) for n in old)
+    print(f"{'方式':<32}{'耗时(s)':>10}{'峰值内存(MB)':>14}")
+    print(f"{'逐 sheet pd.read_excel (改动前)':<32}{old_stats['耗时(s)']:>10}{old_stats['峰值内存(MB)']:>14}")
+    print(f"{f'read_sheets_once ({EXCEL_ENGINE})':<32}{new_stats['耗时(s)']:>10}{new_stats['峰值内存(MB)']:>14}")
+    print(f"结果一致：{'是' if same else '否 (calamine 与 openpyxl 的类型推断可能不同)'}")
+
+def previous_result(results_path, rows, error_rate, seed):
+    if not os.path.exists(results_path):
+        return None
+    last = None
+    with open(results_path, encoding="utf-8") as f:
+        for line in f:
+            rec = json.loads(line)
+            if (rec["rows"], rec["error_rate"], rec["seed"]) == (rows, error_rate, seed):
+                last = rec
+    return last
+
+def print_report(rec, prev):
+    print(f"\n== {rec['rows']} 行 ({rec['label'] or '未命名'}, commit {rec['commit']}) ==")
+    print(f"{'阶段':<14}{'耗时(s)':>10}{'上次(s)':>10}{'变化':>9}{'峰值内存(MB)':>14}{'行数':>10}")
+    for stage, s in rec["stages"].items():
+        old = (prev or {}).get("stages", {}).get(stage, {}).get("耗时(s)")
+        change = f"{s['耗时(s)'] / old:.2f}x" if old else "-"
+        print(f"{stage:<14}{s['耗时(s)']:>10}{old if old is not None else '-':>10}{change:>9}"
+              f"{s['峰值内存(MB)'] if s['峰值内存(MB)'] is not None else '-':>14}{s['行数']:>10}")
+    c = rec["check"]
+    print(f"进程峰值 RSS：{rec['peak_rss_mb']} MB；提成表数据内存：{rec['stages']['读取提成表']['数据内存MB']} MB"
+          f" ({'整表读取' if rec.get('full_read') else '仅审核列'})")
+    print(f"标记检查：注入 {c['injected']}，标记 {c['flagged']}，漏标 {c['missed']}，多标 {c['extra']}，指纹 {c['flagged_digest']}")
+    if c["missed_by_field"] or c["extra_by_field"]:
+        print(f"  漏标字段 {c['missed_by_field']}；多标字段 {c['extra_by_field']}")
+    if prev and prev["check"]["flagged_digest"] != c["flagged_digest"]:
+        print(f"⚠️ 标记结果与上次 (commit {prev['commit']}) 不同：上次指纹 {prev['check']['flagged_digest']}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="审核流程基准测试 (合成数据)")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000], help="合同数，可给多个，如 10000 100000 1000000")
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="合成数据目录 (已生成的数据会复用)")
+    parser.add_argument("--results", default=DEFAULT_RESULTS, help="结果文件 (JSON Lines，每次运行追加一行)")
+    parser.add_argument("--label", default="", help="本次运行的说明，如改动内容")
+    parser.add_argument("--skip-write", action="store_true", help="不测 xlsx 写出")
+    parser.add_argument("--full-read", action="store_true", help="提成表整表读取 (对比精简读取的内存；峰值 RSS 为进程级，建议每种方式单独运行)")
+    parser.add_argument("--dates", type=int, nargs="?", const=500000, metavar="行数",
+                        help="只对比日期解析的新旧实现 (默认 500000 行)，不跑完整流程")
+    parser.add_argument("--read-once", type=int, nargs="?", const=20, metavar="sheet数",
+                        help="只对比逐 sheet read_excel 与 read_sheets_once 的读取耗时 (默认 20 个 sheet)，不跑完整流程")
+    parser.add_argument("--sheet-rows", type=int, default=2500, help="--read-once 时每个 sheet 的行数")
+    args = parser.parse_args(argv)
+
+    if args.dates:
+        bench_dates(args.dates, args.seed)
+        return 0
+    if args.read_once:
+        bench_read_once(args.data_dir, args.read_once, args.sheet_rows, args.seed)
+        return 0
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+    for rows in args.rows:
+        data = get_dataset(args.data_dir, rows, args.error_rate, args.seed)
+        stages, check = run_once(data, write_outputs=not args.skip_write, lean=not args.full_read)
+        rec = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "label": args.label,
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "engine": EXCEL_ENGINE,
+            "rows": rows,
+            "error_rate": args.error_rate,
+            "seed": args.seed,
+            "full_read": args.full_read,
+            "stages": stages,
+            "peak_rss_mb": peak_rss_mb(),
+            "check": check,
+        }
+        prev = previous_result(args.results, rows, args.error_rate, args.seed)
+        print_report(rec, prev)
+        with open(args.results, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
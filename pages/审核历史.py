@@ -0,0 +1,72 @@
+# =====================================
+# Streamlit 页面：审核历史查询 / 导出
+# 数据来自主页面“保存到审核历史”或 audit_cli.py --history 记录的运行 (见 audit_history.py)
+# =====================================
+import streamlit as st
+
+import audit_history
+
+st.title("🗃️ 审核历史")
+st.caption(f"历史库：{audit_history.HISTORY_DB}")
+
+runs = audit_history.list_runs()
+if runs.empty:
+    st.info("暂无记录：在审核页面侧边栏“🗃️ 保存到审核历史”中保存，或使用 `python audit_cli.py <目录> --history`。")
+    st.stop()
+
+# ========== 运行列表 ==========
+st.subheader("📋 运行记录")
+st.dataframe(runs, use_container_width=True, hide_index=True)
+
+# ========== 按合同查询 ==========
+st.divider()
+st.subheader("🔍 按合同号查询")
+contract = st.text_input("合同号（按审核时的规则标准化后查找）")
+if contract.strip():
+    history = audit_history.contract_history(contract)
+    if history.empty:
+        st.success("该合同在历史记录中没有错误或漏填。")
+    else:
+        st.write(f"共 {len(history)} 条记录，涉及 {history['run_id'].nunique()} 次运行、{history['period'].nunique()} 个期间")
+        st.dataframe(history, use_container_width=True, hide_index=True)
+
+# ========== 连续多月被标记的合同 ==========
+st.divider()
+st.subheader("🔁 连续多月被标记的合同")
+months = st.number_input("连续月数 ≥", min_value=2, max_value=24, value=3)
+st.caption("每个期间按最后一次运行统计 (同月修正后重新审核的，以修正后的结果为准)")
+repeat = audit_history.repeat_flagged(months)
+if repeat.empty:
+    st.success(f"没有连续 {months} 个月及以上被标记的合同。")
+else:
+    st.dataframe(repeat, use_container_width=True, hide_index=True)
+    st.download_button(
+        "📥 导出 (CSV)", data=repeat.to_csv(index=False).encode("utf-8-sig"),
+        file_name=f"连续{months}个月被标记的合同.csv", mime="text/csv", key="download_repeat"
+    )
+
+# ========== 单次运行：导出 / 删除 ==========
+st.divider()
+st.subheader("📤 单次运行")
+run_labels = {
+    r.run_id: f"run {r.run_id}｜{r.period}｜{r.tc_file}｜{r.total_errors} 个错误" for r in runs.itertuples(index=False)
+}
+run_id = st.selectbox("选择运行", list(run_labels), format_func=run_labels.get)
+errors = audit_history.run_errors(run_id)
+missing = audit_history.run_missing(run_id)
+st.write(f"错误单元格 {len(errors)} 个，漏填合同号 {len(missing)} 个")
+st.dataframe(errors, use_container_width=True, hide_index=True)
+st.download_button(
+    "📥 导出错误单元格 (CSV)", data=errors.to_csv(index=False).encode("utf-8-sig"),
+    file_name=f"审核历史_run{run_id}_错误单元格.csv", mime="text/csv", key="download_errors"
+)
+if len(missing):
+    st.download_button(
+        "📥 导出漏填合同号 (CSV)", data=missing.to_csv(index=False).encode("utf-8-sig"),
+        file_name=f"审核历史_run{run_id}_漏填合同号.csv", mime="text/csv", key="download_missing"
+    )
+
+with st.expander("🗑️ 删除该运行"):
+    if st.button(f"确认删除 run {run_id}", key="delete_run"):
+        audit_history.delete_run(run_id)
+        st.rerun()
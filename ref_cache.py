@@ -0,0 +1,263 @@
+# =====================================
+# 参考表磁盘缓存：标准化后的 fk_std / ec_std / orig_std 按
+# “文件内容哈希 + 列配置” 保存到本地目录，参考文件不变时直接加载
+# 条目为 Parquet 文件 (需要 pyarrow，未安装时不使用磁盘缓存)；不用 pickle，读取条目不会执行代码
+# 用法: python ref_cache.py list | clear
+# =====================================
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # 未安装 pyarrow：不使用磁盘缓存
+    pa = pq = None
+
+REF_CACHE_DIR = os.environ.get("TC_AUDIT_CACHE_DIR") or \
+    os.path.join(os.path.expanduser("~"), ".cache", "tc_audit", "ref_tables")
+REF_CACHE_MAX_BYTES = int(os.environ.get("TC_AUDIT_CACHE_MAX_MB", "512")) * 1024 ** 2 # 超出按最久未用淘汰
+CACHE_FORMAT_VERSION = 4 # 预处理逻辑或存储格式变化时递增，旧条目自动失效
+ENTRY_SUFFIX = ".parquet"
+LEGACY_SUFFIXES = (".pkl",) # 旧格式的条目：不再读取，只计入容量并随淘汰 / 清空删除
+META_KEY = b"tc_audit" # Parquet 文件元数据中的还原信息 (列名、dtype、object 列的编码、提示)
+
+def available():
+    """是否可以使用磁盘缓存 (需要 pyarrow)"""
+    return pq is not None
+
+def content_digest(file):
+    """文件内容的 SHA-256 摘要；file 为路径或带 getvalue() 的文件对象 (如 Streamlit 上传的文件)"""
+    if hasattr(file, "getvalue"):
+        return hashlib.sha256(file.getvalue()).hexdigest()
+    h = hashlib.sha256()
+    with open(file, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def entry_key(file_digest, prefix, spec):
+    """缓存键：文件内容 + 数据源前缀 + 列配置 / sheet 规则 + 格式版本 + pandas 版本"""
+    raw = repr((CACHE_FORMAT_VERSION, pd.__version__, file_digest, prefix, spec))
+    return f"{prefix}-{hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]}"
+
+def _entry_path(key, cache_dir=None):
+    return os.path.join(cache_dir or REF_CACHE_DIR, key + ENTRY_SUFFIX)
+
+def _owned(st):
+    """条目由当前用户写入 (别人可写入的目录中的文件不读取)"""
+    return not hasattr(os, "getuid") or st.st_uid == os.getuid()
+
+# ========== object 列的编码 ==========
+# 混合类型的 object 列 (如文本与数字混排的金额) 拆为逐值的类型标记 + 按存储类型分开的值列；
+# 还原时按标记恢复原来的 Python 类型 (行指纹按值的类型区分，1 与 "1"、datetime 与 Timestamp 不能混同)。
+# 类型: (标记, 存储列, 存储值, 还原一组存储值)；不在表中的类型不缓存
+_MICROS = timedelta(microseconds=1)
+_VALUE_TYPES = {
+    type(None): ("none", None, None, lambda n: [None] * n),
+    str: ("str", "str", str, lambda a: a),
+    bool: ("bool", "int", int, lambda a: a.astype(bool).tolist()),
+    int: ("int", "int", int, lambda a: a.tolist()),
+    float: ("float", "float", float, lambda a: a.tolist()),
+    datetime: ("datetime", "datetime", lambda v: v, lambda a: pd.DatetimeIndex(a).to_pydatetime()),
+    pd.Timestamp: ("Timestamp", "datetime", lambda v: v, lambda a: list(pd.DatetimeIndex(a))),
+    date: ("date", "datetime", lambda v: v, lambda a: [v.date() for v in pd.DatetimeIndex(a)]),
+    type(pd.NaT): ("NaT", None, None, lambda n: [pd.NaT] * n),
+    dt_time: ("time", "int", lambda v: (v.hour * 3600 + v.minute * 60 + v.second) * 10 ** 6 + v.microsecond,
+              lambda a: [(datetime.min + int(v) * _MICROS).time() for v in a]),
+    timedelta: ("timedelta", "int", lambda v: v // _MICROS, lambda a: [int(v) * _MICROS for v in a]),
+}
+_TAGS = {t[0]: t for t in _VALUE_TYPES.values()}
+_STORAGE_FILL = {"str": None, "int": 0, "float": np.nan, "datetime": pd.NaT}
+_STORAGE_DTYPE = {"str": object, "int": "int64", "float": "float64", "datetime": "datetime64[ns]"}
+
+def _encode_objects(values, name):
+    """object 值 -> ({存储列名: 数组}, 类型标记列表)；有不支持的类型 (或带时区的时间) 时抛出 TypeError"""
+    tags, codes = [], np.empty(len(values), dtype=np.int8)
+    storage = {}
+    for i, v in enumerate(values):
+        spec = _VALUE_TYPES.get(type(v))
+        if spec is None or getattr(v, "tzinfo", None) is not None:
+            raise TypeError(f"参考表缓存不支持的值类型：{type(v).__name__}")
+        tag, kind, to_storage, _ = spec
+        if tag not in tags:
+            tags.append(tag)
+        codes[i] = tags.index(tag)
+        if kind is not None:
+            if kind not in storage:
+                storage[kind] = [_STORAGE_FILL[kind]] * len(values)
+            storage[kind][i] = to_storage(v)
+    columns = {f"{name}.tag": codes}
+    for kind, data in storage.items():
+        columns[f"{name}.{kind}"] = pd.Series(data, dtype=_STORAGE_DTYPE[kind]).to_numpy()
+    return columns, tags
+
+def _decode_objects(frame, name, tags):
+    codes = frame[f"{name}.tag"].to_numpy()
+    out = np.empty(len(codes), dtype=object)
+    for code, tag in enumerate(tags):
+        _, kind, _, restore = _TAGS[tag]
+        rows = np.flatnonzero(codes == code)
+        out[rows] = restore(len(rows)) if kind is None else restore(frame[f"{name}.{kind}"].to_numpy()[rows])
+    return out
+
+def _encode_frame(std_df, notices):
+    """DataFrame -> (只含 Parquet 可存类型的 DataFrame, 还原信息)；object / category 列与索引按 _encode_objects 编码"""
+    columns, specs = {}, []
+    series = [("index", std_df.index.to_series(index=range(len(std_df))))] + \
+             [(f"c{i}", std_df.iloc[:, i].reset_index(drop=True)) for i in range(std_df.shape[1])]
+    for name, s in series:
+        dtype = s.dtype
+        if dtype == object or isinstance(dtype, pd.CategoricalDtype):
+            encoded, tags = _encode_objects(np.asarray(s, dtype=object), name)
+            columns.update(encoded)
+            specs.append({"tags": tags, "category": isinstance(dtype, pd.CategoricalDtype)})
+        else:
+            columns[name] = s.to_numpy()
+            specs.append({"dtype": str(dtype)})
+    index = std_df.index
+    meta = {
+        "columns": list(std_df.columns), "specs": specs, "index_name": index.name,
+        "range_index": [index.start, index.stop, index.step] if isinstance(index, pd.RangeIndex) else None,
+        "notices": [list(n) for n in notices],
+    }
+    return pd.DataFrame(columns, index=range(len(std_df))), meta
+
+def _decode_frame(frame, meta):
+    def column(name, spec):
+        if "dtype" in spec:
+            return frame[name].astype(spec["dtype"]).to_numpy()
+        values = _decode_objects(frame, name, spec["tags"])
+        return pd.Categorical(values) if spec["category"] else values
+
+    specs = meta["specs"]
+    if meta["range_index"] is not None:
+        index = pd.RangeIndex(*meta["range_index"], name=meta["index_name"])
+    else:
+        index = pd.Index(column("index", specs[0]), name=meta["index_name"])
+    data = {i: column(f"c{i}", spec) for i, spec in enumerate(specs[1:])}
+    std_df = pd.DataFrame(data, index=index)
+    std_df.columns = meta["columns"]
+    return std_df, [tuple(n) for n in meta["notices"]]
+
+def load(key, cache_dir=None):
+    """
+    读取缓存条目，返回 (std_df, notices)；未命中、条目损坏或不是当前用户写入时返回 None。
+    notices 为预处理时产生的提示 [(level, msg)]，命中缓存时由调用方重新显示。
+    """
+    if not available():
+        return None
+    path = _entry_path(key, cache_dir)
+    try:
+        if not _owned(os.stat(path)):
+            return None
+        table = pq.read_table(path)
+        hit = _decode_frame(table.to_pandas(), json.loads(table.schema.metadata[META_KEY]))
+        os.utime(path) # 记录最近使用时间 (淘汰依据)
+        return hit
+    except FileNotFoundError:
+        return None
+    except Exception: # 写入中断 / 版本不兼容：丢弃该条目
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+def store(key, std_df, notices, cache_dir=None, max_bytes=None):
+    """
+    写入缓存条目 (先写临时文件再替换，避免并发读到半个文件)，然后按容量淘汰。
+    含不支持的值类型、或未安装 pyarrow 时不缓存。缓存目录只允许当前用户访问。
+    """
+    if not available():
+        return
+    cache_dir = cache_dir or REF_CACHE_DIR
+    try:
+        frame, meta = _encode_frame(std_df, notices)
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                               META_KEY: json.dumps(meta, ensure_ascii=False).encode("utf-8")})
+    except (TypeError, ValueError, OverflowError, pa.ArrowException):
+        return
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        path = _entry_path(key, cache_dir)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        pq.write_table(table, tmp)
+        os.replace(tmp, path)
+    except OSError:
+        return # 缓存目录不可写时只是不缓存
+    evict(REF_CACHE_MAX_BYTES if max_bytes is None else max_bytes, cache_dir, keep=key)
+
+def list_entries(cache_dir=None):
+    """缓存条目列表 (最近使用的在前)：[{"key", "file", "bytes", "last_used"}]，含旧格式的条目"""
+    cache_dir = cache_dir or REF_CACHE_DIR
+    if not os.path.isdir(cache_dir):
+        return []
+    entries = []
+    for name in os.listdir(cache_dir):
+        suffix = next((s for s in (ENTRY_SUFFIX,) + LEGACY_SUFFIXES if name.endswith(s)), None)
+        if suffix is None:
+            continue
+        try:
+            st = os.stat(os.path.join(cache_dir, name))
+        except OSError:
+            continue
+        entries.append({"key": name[:-len(suffix)], "file": name, "bytes": st.st_size, "last_used": st.st_mtime})
+    return sorted(entries, key=lambda e: e["last_used"], reverse=True)
+
+def evict(max_bytes, cache_dir=None, keep=None):
+    """总大小超过 max_bytes 时，从最久未用的条目开始删除 (keep 指定的条目保留)"""
+    entries = list_entries(cache_dir)
+    total = sum(e["bytes"] for e in entries)
+    removed = 0
+    for e in reversed(entries):
+        if total <= max_bytes:
+            break
+        if keep is not None and e["file"] == keep + ENTRY_SUFFIX:
+            continue
+        try:
+            os.remove(os.path.join(cache_dir or REF_CACHE_DIR, e["file"]))
+        except OSError:
+            continue
+        total -= e["bytes"]
+        removed += 1
+    return removed
+
+def clear(cache_dir=None):
+    """删除全部缓存条目，返回删除的条目数"""
+    removed = 0
+    for e in list_entries(cache_dir):
+        try:
+            os.remove(os.path.join(cache_dir or REF_CACHE_DIR, e["file"]))
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="参考表磁盘缓存管理")
+    parser.add_argument("command", choices=["list", "clear"], help="list: 查看缓存条目；clear: 清空缓存")
+    parser.add_argument("--cache-dir", help=f"缓存目录，默认 {REF_CACHE_DIR}")
+    args = parser.parse_args(argv)
+
+    if args.command == "clear":
+        print(f"已删除 {clear(args.cache_dir)} 个缓存条目")
+        return 0
+    entries = list_entries(args.cache_dir)
+    for e in entries:
+        used = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(e["last_used"]))
+        print(f"{e['key']}\t{e['bytes'] / 1024 ** 2:.2f} MB\t最近使用 {used}")
+    total_mb = sum(e["bytes"] for e in entries) / 1024 ** 2
+    print(f"共 {len(entries)} 个条目，{total_mb:.2f} MB / 上限 {REF_CACHE_MAX_BYTES / 1024 ** 2:.0f} MB ({args.cache_dir or REF_CACHE_DIR})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+# =====================================
+# 合成测试数据：提成表 (总 / 轻卡 / 重卡) + 放款明细 (潮掣) + 二次明细 + 原表
+# 含混合类型、百分号字符串、全角“－”合同号、Excel 序列号日期；
+# 按错误率注入错误，注入位置写入 ground_truth.csv 作为标注基准
+# 用法: python synth_data.py <输出目录> [--rows N] [--error-rate R] [--seed S]
+# =====================================
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+PEOPLE = ["张三", "李四", "王五", "赵六", "Ｚｈａｏ Ｌｅｉ", "钱 七"]
+MANAGERS = ["经理A", "经理B", "经理C", "Ｍａｎａｇｅｒ Ｄ"]
+EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+
+# 注入错误的字段 (提成表列名)；人员类型会改变收益率取值来源与 sheet 归属，不注入
+ERROR_FIELDS = ["放款日期", "提报人员", "城市经理", "租赁本金", "收益率", "期限", "家访", "二次交接", "计算提成金额"]
+
+def _write_workbook(path, sheets):
+    """以 write_only 模式写出 {sheet名: DataFrame}；NaN / NaT 写为空单元格"""
+    wb = Workbook(write_only=True)
+    for name, df in sheets.items():
+        ws = wb.create_sheet(name)
+        ws.append(list(df.columns))
+        for row in df.itertuples(index=False, name=None):
+            ws.append([None if (v is None or (not isinstance(v, str) and pd.isna(v))) else
+                       (v.to_pydatetime() if isinstance(v, pd.Timestamp) else v) for v in row])
+    wb.save(path)
+
+def _mixed(values, mask, fmt):
+    """把 mask 位置的值格式化为字符串 (模拟手工录入的文本型数字)"""
+    out = values.astype(object)
+    out[mask] = [fmt(v) for v in values[mask]]
+    return out
+
+def generate_dataset(out_dir, n_rows, error_rate=0.05, seed=0):
+    """
+    生成一套审核输入文件，返回 {"files": {...}, "ground_truth": DataFrame(sheet, row, column)}。
+    n_rows 为放款明细的合同数；提成表“总” sheet 少约 0.5% 的合同 (用于反向漏填检查)，
+    另有约 0.5% 的合同在参考表中不存在 (查不到参考值，不计为错误)。
+    row 为 sheet 中的数据行号 (从 0 开始，不含表头)。
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    n = n_rows
+
+    # --- 参考数据 (放款明细) ---
+    numeric_key = rng.random(n) < 0.1 # 约 10% 的合同号为纯数字
+    keys = np.where(numeric_key, (20250000000 + np.arange(n)).astype(str),
+                    np.char.add("HT-2025-", np.char.zfill(np.arange(n).astype(str), 7)))
+    fk_keys = np.where(numeric_key, (20250000000 + np.arange(n)).astype(object), keys.astype(object))
+    loan_date = EXCEL_EPOCH + pd.to_timedelta(rng.integers(45292, 45657, n), unit="D") # 2024 年内
+    people = rng.choice(PEOPLE, n)
+    managers = rng.choice(MANAGERS, n)
+    principal = rng.integers(50, 500, n) * 1000.0
+    xirr = rng.uniform(0.05, 0.2, n).round(4)
+    term_years = rng.choice([1, 2, 3], n)
+    visit = rng.choice([0, 100, 200], n)
+    truck = rng.choice(["轻卡", "重卡"], n)
+    amount = rng.uniform(1000, 9000, n).round(2)
+    nim = rng.uniform(0.05, 0.2, n).round(4)
+    handover = loan_date + pd.to_timedelta(rng.integers(1, 30, n), unit="D")
+
+    fk = pd.DataFrame({
+        "合同号": fk_keys, "放款日期": loan_date, "提报人员": people, "城市经理": managers,
+        "租赁本金": principal, "xirr": xirr, "租赁期限/年": term_years, "家访": visit,
+        "类型": truck, "放款金额": amount,
+    })
+    half = n // 2
+    files = {
+        "放款明细": os.path.join(out_dir, "放款明细.xlsx"),
+        "二次明细": os.path.join(out_dir, "二次明细.xlsx"),
+        "原表": os.path.join(out_dir, "原表.xlsx"),
+        "提成": os.path.join(out_dir, "提成.xlsx"),
+    }
+    _write_workbook(files["放款明细"], {"潮掣1": fk.iloc[:half], "潮掣2": fk.iloc[half:], "其他": fk.iloc[: min(50, n)]})
+    _write_workbook(files["二次明细"], {"二次明细": pd.DataFrame({"合同号": fk_keys, "出本流程时间": handover})})
+    _write_workbook(files["原表"], {"原表": pd.DataFrame({"合同号": fk_keys, "年化nim": nim})})
+
+    # --- 提成表 (正确值 + 录入差异，均应判为一致) ---
+    contract = keys.astype(object)
+    fullwidth = ~numeric_key & (rng.random(n) < 0.15)
+    contract[fullwidth] = np.char.replace(keys[fullwidth], "-", "－")
+    unknown = rng.random(n) < 0.005 # 参考表中查不到的合同
+    contract[unknown] = np.char.add(keys[unknown].astype(str), "X")
+
+    serial = rng.random(n) < 0.1 # 约 10% 的放款日期为 Excel 序列号
+    as_text = ~serial & (rng.random(n) < 0.5)
+    tc_loan_date = pd.Series(loan_date).astype(object).to_numpy()
+    tc_loan_date[as_text] = loan_date[as_text].strftime("%Y/%m/%d")
+    tc_loan_date[serial] = (loan_date[serial] - EXCEL_EPOCH).days
+
+    rate = np.where(truck == "轻卡", nim, xirr)
+    tc = pd.DataFrame({
+        "序号": np.arange(1, n + 1),
+        "合同号": contract,
+        "放款日期": tc_loan_date,
+        "提报人员": np.char.lower(np.char.replace(people, " ", "")).astype(object),
+        "城市经理": managers.astype(object),
+        "租赁本金": _mixed(principal, rng.random(n) < 0.2, lambda v: f"{v:,.2f}"),
+        "收益率": _mixed(rate, rng.random(n) < 0.3, lambda v: f"{v * 100:.2f}%"),
+        "期限": _mixed(term_years * 12, rng.random(n) < 0.2, str),
+        "家访": _mixed(visit, rng.random(n) < 0.2, str),
+        "人员类型": truck.astype(object),
+        "二次交接": pd.Series(handover).astype(object).to_numpy(),
+        "计算提成金额": amount.astype(object),
+        "备注": np.full(n, None, dtype=object),
+    })
+
+    # --- 注入错误 (只在参考值可查到的行) ---
+    candidates = np.flatnonzero(~unknown)
+    n_errors = min(int(round(n * error_rate)), len(candidates))
+    err_rows = rng.choice(candidates, n_errors, replace=False)
+    err_fields = rng.choice(ERROR_FIELDS, n_errors)
+    for i, field in zip(err_rows, err_fields):
+        if field == "放款日期":
+            tc.at[i, field] = (loan_date[i] + pd.Timedelta(days=400)).strftime("%Y/%m/%d")
+        elif field == "二次交接":
+            tc.at[i, field] = handover[i] - pd.Timedelta(days=365)
+        elif field == "提报人员":
+            tc.at[i, field] = "错误人员"
+        elif field == "城市经理":
+            tc.at[i, field] = "经理X"
+        elif field == "收益率":
+            tc.at[i, field] = round(rate[i] + 0.05, 4)
+        elif field == "期限":
+            tc.at[i, field] = int(term_years[i] * 12 + 12)
+        elif field == "租赁本金":
+            tc.at[i, field] = principal[i] + 1000
+        elif field == "家访":
+            tc.at[i, field] = int(visit[i] + 50)
+        else: # 计算提成金额
+            tc.at[i, field] = round(amount[i] + 100, 2)
+    truth_total = pd.DataFrame({"row": err_rows, "column": err_fields})
+
+    # “总” sheet 去掉约 0.5% 的合同 (放款明细中有、提成表中漏填)
+    dropped = rng.random(n) < 0.005
+    dropped[err_rows] = False
+    keep_rows = np.flatnonzero(~dropped)
+
+    # 轻卡 分两个 sheet，重卡 一个 sheet；行号映射回各 sheet
+    sheet_rows = {"总": keep_rows}
+    light = keep_rows[truck[keep_rows] == "轻卡"]
+    heavy = keep_rows[truck[keep_rows] == "重卡"]
+    sheet_rows["轻卡1"], sheet_rows["轻卡2"] = light[: len(light) // 2], light[len(light) // 2:]
+    sheet_rows["重卡"] = heavy
+    sheet_names = {"总": "总", "轻卡1": "轻卡-1", "轻卡2": "轻卡-2", "重卡": "重卡"}
+    _write_workbook(files["提成"], {sheet_names[tag]: tc.iloc[rows] for tag, rows in sheet_rows.items()})
+
+    truth = []
+    for tag, rows in sheet_rows.items():
+        pos = pd.Series(np.arange(len(rows)), index=rows)
+        hit = truth_total[truth_total["row"].isin(pos.index)]
+        truth.append(pd.DataFrame({"sheet": tag, "row": pos[hit["row"]].to_numpy(), "column": hit["column"].to_numpy()}))
+    ground_truth = pd.concat(truth, ignore_index=True).sort_values(["sheet", "row", "column"], ignore_index=True)
+    ground_truth.to_csv(os.path.join(out_dir, "ground_truth.csv"), index=False)
+
+    meta = {
+        "rows": n, "error_rate": error_rate, "seed": seed,
+        "injected_errors": n_errors, "missing_contracts": int(dropped.sum()),
+        "sheets": {tag: len(rows) for tag, rows in sheet_rows.items()},
+    }
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return {"files": files, "ground_truth": ground_truth, "meta": meta}
+
+def load_dataset(out_dir):
+    """读取已生成的数据集 (不存在时返回 None)"""
+    meta_path = os.path.join(out_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    files = {name: os.path.join(out_dir, f"{name}.xlsx") for name in ["放款明细", "二次明细", "原表", "提成"]}
+    ground_truth = pd.read_csv(os.path.join(out_dir, "ground_truth.csv"), dtype={"sheet": str, "column": str})
+    return {"files": files, "ground_truth": ground_truth, "meta": meta}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="生成合成的提成表 / 参考表测试数据")
+    parser.add_argument("out_dir", help="输出目录")
+    parser.add_argument("--rows", type=int, default=10000, help="合同数 (放款明细行数)")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="注入错误的比例 (按行)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    data = generate_dataset(args.out_dir, args.rows, args.error_rate, args.seed)
+    print(json.dumps(data["meta"], ensure_ascii=False, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+# =====================================
+# 审核历史：连续多月被标记的合同 (repeat_flagged)
+# 同月修正后重新审核、中间缺一个月的情况
+# =====================================
+import pandas as pd
+import pytest
+
+import audit_history
+
+ERROR_COLUMNS = ["sheet", "row", "contract", "contract_key", "column", "main_value", "ref_value"]
+
+
+def record(db, key, period, contracts):
+    """记录一次运行：contracts 为 {合同 Key: 错误单元格数}"""
+    errors = pd.DataFrame(
+        [("总", i, k, k, f"字段{j}", "1", "2") for i, (k, n) in enumerate(contracts.items()) for j in range(n)],
+        columns=ERROR_COLUMNS,
+    )
+    stats = {"总": {"rows": 10, "total_errors": len(errors), "error_rows": len(contracts), "unmatched_contracts": 0}}
+    return audit_history.record_run(key, {"period": period, "source": "cli"}, stats, errors, [], db)
+
+
+@pytest.fixture
+def db(tmp_path):
+    return str(tmp_path / "history.sqlite3")
+
+
+def streaks(df):
+    return {(r.contract_key, r.起始期间, r.结束期间): (r.连续月数, r.错误数) for r in df.itertuples(index=False)}
+
+
+def test_fixed_rerun_in_same_period(db):
+    record(db, "r1", "2025-01", {"A": 2, "B": 1})
+    record(db, "r2", "2025-02", {"A": 1, "B": 1})
+    record(db, "r3", "2025-03", {"A": 1, "B": 3})
+    record(db, "r4", "2025-03", {"B": 1}) # 3 月修正 A 后重新审核
+    assert streaks(audit_history.repeat_flagged(2, db)) == {
+        ("A", "2025-01", "2025-02"): (2, 3),
+        ("B", "2025-01", "2025-03"): (3, 3),
+    }
+    # 所有运行都计入时，3 月的 A 仍算被标记，B 的错误数为两次运行之和
+    assert streaks(audit_history.repeat_flagged(2, db, all_runs=True)) == {
+        ("A", "2025-01", "2025-03"): (3, 4),
+        ("B", "2025-01", "2025-03"): (3, 6),
+    }
+
+
+def test_gap_month_breaks_streak(db):
+    record(db, "r1", "2025-01", {"A": 1})
+    record(db, "r2", "2025-02", {"A": 1})
+    record(db, "r3", "2025-03", {}) # 3 月没有错误
+    record(db, "r4", "2025-04", {"A": 1})
+    record(db, "r5", "2025-05", {"A": 1})
+    record(db, "r6", "2025-06", {"A": 1})
+    assert streaks(audit_history.repeat_flagged(2, db)) == {
+        ("A", "2025-01", "2025-02"): (2, 2),
+        ("A", "2025-04", "2025-06"): (3, 3),
+    }
+    assert streaks(audit_history.repeat_flagged(3, db)) == {("A", "2025-04", "2025-06"): (3, 3)}
+    # 缺少运行的月份同样中断连续
+    record(db, "r7", "2025-08", {"A": 1})
+    assert ("A", "2025-04", "2025-08") not in streaks(audit_history.repeat_flagged(2, db))
+
+
+def test_latest_run_is_by_period_not_by_record_order(db):
+    record(db, "r1", "2025-02", {"A": 1})
+    record(db, "r2", "2025-01", {"A": 1})
+    record(db, "r3", "2025-02", {"A": 1}) # 补录 1 月之后再审 2 月
+    assert streaks(audit_history.repeat_flagged(2, db)) == {("A", "2025-01", "2025-02"): (2, 2)}
+
+
+def test_empty_history(db):
+    df = audit_history.repeat_flagged(2, db)
+    assert df.empty and list(df.columns) == ["contract_key", "连续月数", "起始期间", "结束期间", "错误数"]
@@ -0,0 +1,143 @@
+# =====================================
+# 增量审核 (audit_one_sheet 的 previous / audit_delta)：结果与整表重新审核一致，
+# 覆盖行指纹变化 (改值、重排、增删行)、未变行的参考数据变化、数值列整列判定 (as_num) 变化与已修正单元格清单
+# =====================================
+import numpy as np
+import pandas as pd
+import pytest
+
+import synth_data
+from audit_core import audit_delta, audit_one_sheet, build_ref_index, build_ref_tables, read_tc_sheets, sheet_jobs_of
+
+RESULT_KEYS = ["marked_cols", "total_errors", "error_rows"]
+ARRAY_KEYS = ["error_bitmap", "row_flags", "unmatched_rows"]
+
+
+@pytest.fixture(scope="module")
+def data(tmp_path_factory):
+    out = tmp_path_factory.mktemp("incremental")
+    files = synth_data.generate_dataset(str(out), 200, error_rate=0.1, seed=7)["files"]
+    all_std_dfs, ref_index = build_ref_tables(files["放款明细"], files["二次明细"], files["原表"], disk_cache=False)
+    sheet = sheet_jobs_of(read_tc_sheets(files["提成"]))["总"]
+    return sheet, all_std_dfs, ref_index
+
+
+def audit(df, all_std_dfs, ref_index, previous=None):
+    return audit_one_sheet(df.copy(), all_std_dfs, ref_index, previous=previous)
+
+
+def assert_same(got, expected):
+    for k in RESULT_KEYS:
+        assert got[k] == expected[k], k
+    for k in ARRAY_KEYS:
+        np.testing.assert_array_equal(got[k], expected[k], err_msg=k)
+
+
+def edit(df, cells):
+    """改写单元格：cells 为 [(行号, 列名, 值)]"""
+    df = df.copy()
+    for row, col, value in cells:
+        if isinstance(df[col].dtype, pd.CategoricalDtype) or not isinstance(value, (int, np.integer)):
+            df[col] = df[col].astype(object)
+        df.loc[row, col] = value
+    return df
+
+
+def clean_rows(result, n):
+    """没有错误、且在放款明细中查得到合同号的前 n 行"""
+    rows = np.flatnonzero(~result["row_flags"])
+    return [int(r) for r in rows if r not in set(result["unmatched_rows"])][:n]
+
+
+def test_unchanged_rerun_reuses_everything(data):
+    sheet, all_std_dfs, ref_index = data
+    full = audit(sheet, all_std_dfs, ref_index)
+    again = audit(sheet, all_std_dfs, ref_index, previous=full)
+    assert_same(again, full)
+    assert again["delta"]["rechecked_rows"] == 0 and again["delta"]["reused_rows"] == len(sheet)
+    assert again["delta"]["fixed_cells"].empty
+
+
+def test_fingerprint_changes(data):
+    sheet, all_std_dfs, ref_index = data
+    base = audit(sheet, all_std_dfs, ref_index)
+    rows = clean_rows(base, 3)
+    changed = edit(sheet, [(rows[0], "租赁本金", 1.0), (rows[1], "提报人员", "某某"), (rows[2], "期限", 99)])
+    # 重排、删除与新增行 (新增行复制已有行，合同号重复)
+    rng = np.random.default_rng(0)
+    changed = changed.drop(index=rng.choice(len(changed), 5, replace=False))
+    changed = pd.concat([changed, changed.iloc[:3]]).sample(frac=1, random_state=1).reset_index(drop=True)
+    full = audit(changed, all_std_dfs, ref_index)
+    inc = audit(changed, all_std_dfs, ref_index, previous=base)
+    assert_same(inc, full)
+    assert 0 < inc["delta"]["rechecked_rows"] < len(changed)
+
+
+def test_reference_change_for_unchanged_rows(data):
+    sheet, all_std_dfs, ref_index = data
+    base = audit(sheet, all_std_dfs, ref_index)
+    keys = sheet["合同号"].astype(str).head(20).tolist()
+    fk = all_std_dfs["fk"].copy()
+    hit = fk["__KEY__"].astype(str).isin(keys[:10])
+    fk.loc[hit, "ref_fk_租赁本金"] = 1.0
+    fk.loc[fk["__KEY__"].astype(str).isin(keys[10:]), "ref_fk_提报人员"] = "某某"
+    new_refs = dict(all_std_dfs, fk=fk)
+    new_index = build_ref_index(new_refs)
+    full = audit(sheet, new_refs, new_index)
+    inc = audit(sheet, new_refs, new_index, previous=base)
+    assert_same(inc, full)
+    assert full["total_errors"] > base["total_errors"]
+    assert inc["delta"]["rechecked_rows"] >= int(hit.sum())
+
+
+@pytest.mark.parametrize("direction", ["flip", "flip_back"])
+def test_as_num_flag_change(data, direction):
+    sheet, all_std_dfs, ref_index = data
+    rows = clean_rows(audit(sheet, all_std_dfs, ref_index), 4)
+    # 数值列含空值：只有数值与空值时空值算数值 (参考值为文本时记为错误)，出现文本后整列判定改变，
+    # 未变的空值行结果也随之改变
+    blanks = edit(sheet, [(r, "租赁本金", np.nan) for r in rows[:3]])
+    text = edit(blanks, [(rows[3], "租赁本金", "待定")])
+    fk = all_std_dfs["fk"].astype({"ref_fk_租赁本金": object})
+    fk.loc[fk["__KEY__"].astype(str).isin(sheet.loc[rows[:3], "合同号"].astype(str)), "ref_fk_租赁本金"] = "待核"
+    refs = dict(all_std_dfs, fk=fk)
+    index = build_ref_index(refs)
+    before, after = (blanks, text) if direction == "flip" else (text, blanks)
+    prev = audit(before, refs, index)
+    full = audit(after, refs, index)
+    inc = audit(after, refs, index, previous=prev)
+    assert prev["delta_state"]["num_flags"][3] != full["delta_state"]["num_flags"][3]
+    assert prev["error_bitmap"].sum() != full["error_bitmap"].sum()
+    assert_same(inc, full)
+    assert inc["delta"]["rechecked_rows"] == 1
+
+
+def test_fixed_cells(data):
+    sheet, all_std_dfs, ref_index = data
+    base = audit(sheet, all_std_dfs, ref_index)
+    rows = clean_rows(base, 4)
+    # 上一次：4 个单元格改错；本次：改回原值 (其中一行的合同已删去)，并打乱行序
+    wrong = edit(sheet, [(rows[0], "租赁本金", 1.0), (rows[1], "提报人员", "某某"), (rows[2], "期限", 99),
+                         (rows[2], "城市经理", "某某"), (rows[3], "家访", 7)])
+    prev = audit(wrong, all_std_dfs, ref_index)
+    current = sheet.drop(index=rows[3]).sample(frac=1, random_state=2).reset_index(drop=True)
+    result = audit(current, all_std_dfs, ref_index, previous=prev)
+    assert_same(result, audit(current, all_std_dfs, ref_index))
+
+    cur = {r: int(np.flatnonzero(current["合同号"].to_numpy() == sheet.loc[r, "合同号"])[0]) for r in rows[:3]}
+    expected = pd.DataFrame({
+        "row": [cur[rows[0]], cur[rows[1]], cur[rows[2]], cur[rows[2]]],
+        "column": ["租赁本金", "提报人员", "城市经理", "期限"],
+    })
+    expected["excel_row"] = expected["row"] + 2
+    expected["contract"] = current["合同号"].to_numpy()[expected["row"]]
+    expected = expected.sort_values(["row", "column"], ignore_index=True)[["row", "excel_row", "contract", "column"]]
+    fixed = result["delta"]["fixed_cells"]
+    pd.testing.assert_frame_equal(fixed.reset_index(drop=True), expected, check_dtype=False)
+    assert result["delta"]["rechecked_rows"] == 3
+
+    # 缓存的结果由另一个上一次结果复用时，audit_delta 给出相同的增量信息
+    delta = audit_delta(current, audit(current, all_std_dfs, ref_index), prev)
+    pd.testing.assert_frame_equal(delta["fixed_cells"], fixed)
+    assert (delta["rechecked_rows"], delta["reused_rows"]) == (3, len(current) - 3)
+    assert audit_delta(current, result, None) is None
@@ -0,0 +1,103 @@
+# =====================================
+# 合同号近似匹配 (build_key_index / suggest_keys) 与逐个计算编辑距离 (OSA：替换、增删、相邻交换) 的对比
+# 距离上限、同距离按 Key 排序与 limit 截断
+# =====================================
+import numpy as np
+import pandas as pd
+
+from audit_core import build_key_index, suggest_keys, _near_miss_frame
+
+ALPHABET = "0123456789-HTA"
+
+
+def osa(a, b):
+    """逐个计算的编辑距离 (optimal string alignment)"""
+    d = [list(range(len(b) + 1))] + [[i] + [0] * len(b) for i in range(1, len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            d[i][j] = min(d[i - 1][j] + 1, d[i][j - 1] + 1, d[i - 1][j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                d[i][j] = min(d[i][j], d[i - 2][j - 2] + 1)
+    return d[-1][-1]
+
+
+def deletions(s):
+    return {s} | {s[:j] + s[j + 1:] for j in range(len(s))}
+
+
+def edit_once(s, rng):
+    op, j = rng.integers(4), int(rng.integers(len(s)))
+    c = ALPHABET[rng.integers(len(ALPHABET))]
+    if op == 0:
+        return s[:j] + c + s[j + 1:]
+    if op == 1:
+        return s[:j] + c + s[j:]
+    if op == 2:
+        return s[:j] + s[j + 1:]
+    return s[:j] + s[j + 1:j + 2] + s[j] + s[j + 2:] if j + 1 < len(s) else s
+
+
+def make_keys(rng, n=400):
+    """共同前缀的合同号 (HT-2025-xxxx) 与纯数字合同号，编号相邻、彼此距离多为 1"""
+    keys = {f"HT-2025-{i:04d}" for i in rng.integers(0, 1500, n)} | {str(20250000000 + i) for i in rng.integers(0, 300, n // 4)}
+    return sorted(keys)
+
+
+def expected_suggestions(query, keys):
+    """距离 1 的全部 Key 与有相同删除变体的距离 2 Key，按 (距离, Key) 排序 (长度差超过 2 的距离必然大于 2)"""
+    q_vars = deletions(query)
+    found = []
+    for key in keys:
+        if abs(len(key) - len(query)) > 2:
+            continue
+        d = osa(query, key)
+        if d == 1 or (d == 2 and q_vars & deletions(key)):
+            found.append((d, key))
+    return [(key, d) for d, key in sorted(found)]
+
+
+def test_matches_brute_force():
+    rng = np.random.default_rng(0)
+    keys = make_keys(rng)
+    index = build_key_index(pd.DataFrame({"__KEY__": keys}))
+    queries = []
+    while len(queries) < 250:
+        q = keys[rng.integers(len(keys))]
+        for _ in range(rng.integers(1, 4)): # 1~3 处修改 (距离 1~3)
+            q = edit_once(q, rng)
+        if q and q not in keys and q not in queries:
+            queries.append(q)
+    expected = {q: expected_suggestions(q, keys) for q in queries}
+    assert any(len(e) > 3 for e in expected.values()) and any(not e for e in expected.values())
+    for limit in (1, 3, 50):
+        got = suggest_keys(index, queries, limit)
+        by_query = {q: list(zip(g["key"], g["distance"])) for q, g in got.groupby("query", sort=False)}
+        mismatches = [q for q in queries if by_query.get(q, []) != expected[q][:limit]]
+        assert mismatches == [], limit
+
+
+def test_cutoff_ties_and_limit():
+    keys = ["HT-001", "HT-002", "HT-003", "HT-0012", "HT-01", "HT-100", "XY-999"]
+    index = build_key_index(pd.DataFrame({"__KEY__": keys + [None, ""]}))
+    got = suggest_keys(index, ["HT-004", "HT-004", "HT-010", "ZZZZZZ", "HT-00"], limit=3)
+    rows = list(got.itertuples(index=False, name=None))
+    # 同距离按 Key 排序、截断到 limit；重复的 query 只出现一次
+    assert [r for r in rows if r[0] == "HT-004"] == [("HT-004", "HT-001", 1), ("HT-004", "HT-002", 1), ("HT-004", "HT-003", 1)]
+    # 替换 / 相邻交换 / 删除为 1，相同删除变体的距离 2 排在后面
+    assert [r for r in rows if r[0] == "HT-010"] == [("HT-010", "HT-001", 1), ("HT-010", "HT-01", 1), ("HT-010", "HT-100", 1)]
+    assert [r for r in rows if r[0] == "HT-00"] == [("HT-00", "HT-001", 1), ("HT-00", "HT-002", 1), ("HT-00", "HT-003", 1)]
+    # 距离超过上限的没有候选
+    assert "ZZZZZZ" not in set(got["query"])
+    # limit 较大时距离 2 的候选 (有相同的删除变体 "HT-00") 排在距离 1 之后；
+    # 距离同为 2、但没有相同删除变体的 HT-0012 / HT-01 不在结果中
+    wide = suggest_keys(index, ["HT-004"], limit=10)
+    assert list(zip(wide["key"], wide["distance"])) == [("HT-001", 1), ("HT-002", 1), ("HT-003", 1), ("HT-100", 2)]
+    assert osa("HT-004", "HT-0012") == osa("HT-004", "HT-01") == 2
+
+
+def test_near_miss_frame_without_candidates():
+    index = build_key_index(pd.DataFrame({"__KEY__": ["HT-001"]}))
+    frame = _near_miss_frame(np.array([0, 4]), np.array(["HT-002", "完全不同"], dtype=object), index)
+    assert frame["行号"].tolist() == [2, 6]
+    assert frame["建议合同号"].tolist() == ["HT-001", ""]
+    assert frame["编辑距离"][0] == 1 and pd.isna(frame["编辑距离"][1]) # 无候选时留空
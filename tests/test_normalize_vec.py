@@ -0,0 +1,165 @@
+# =====================================
+# 列式标准化 / 比较与逐值版本 (normalize_text / normalize_num) 的等价性测试
+# 随机生成混合类型的列，逐值结果作为标准答案；日期按逐值写出的预期日期
+# =====================================
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from audit_core import (
+    normalize_text, normalize_num, normalize_text_vec, num_parts_vec, _none_as_num, compare_series_vec,
+    normalize_date_vec,
+)
+
+# 各类容易出错的值：空值、"NaN" 字符串、全角、百分号、千分位、Timestamp、整数与浮点
+VALUE_POOL = [
+    None, np.nan, pd.NaT, "NaN", "nan", "None", "", " ", "-", "　",
+    "abc", "ABC", " Ab c\n", "ＡＢＣ", "张三", "张　三", "ｔｅｓｔ１",
+    "12", " 12 ", "12.0", "１２", "１２.５", "-3.5", "+5", "1e3", "1_000",
+    "1,234.5", "1,234", "12%", "12.5%", "０.５%", "%", "abc%", "1,2%",
+    0, 1, 12, -3, 1234, 12.0, 12.5, 0.125, 1e-7, 1234.5,
+    pd.Timestamp("2025-01-03"), pd.Timestamp("2025-01-03 08:30"), True, False,
+]
+NUM_POOL = [v for v in VALUE_POOL if isinstance(v, (int, float)) and not isinstance(v, bool)] + [None, np.nan]
+NUM_TEXT_POOL = ["12", "1,234.5", "12%", "-3.5", "", "-", None, np.nan, "１２", "NaN"]
+
+# (值, 预期日期)：小数秒与时区按所写的当地日期，不换算时区；None 表示不算日期
+SHANGHAI = dt.timezone(dt.timedelta(hours=8))
+DATE_POOL = [
+    ("2025-01-03", "2025-01-03"), ("2025/1/3", "2025-01-03"), ("2025年1月3日", "2025-01-03"), ("20250103", "2025-01-03"),
+    ("2025-01-03 08:30:15", "2025-01-03"), ("2025-01-03 08:30:15.123", "2025-01-03"),
+    ("2025-01-03T08:30:15.5", "2025-01-03"), ("2025-01-03T23:30:00+08:00", "2025-01-03"),
+    ("2025-01-03T23:30:00.123456Z", "2025-01-03"), ("2025/1/3 08:30:00 +0800", "2025-01-03"),
+    ("2025-01-03 23:30-05:00", "2025-01-03"), (" 2025.1.3 ", "2025-01-03"),
+    ("2025-01-03 -0800", None), ("2025-01-03 08:30:15.", None), ("abc", None), ("", None), (None, None), (np.nan, None),
+    (45660, "2025-01-03"), (45660.75, "2025-01-03"), (20250103, "2025-01-03"), (20250103.0, "2025-01-03"),
+    (np.int64(20250103), "2025-01-03"), (20251340, None), (20250103.5, None), (True, None), (dt.time(8, 30), None),
+    (pd.Timestamp("2025-01-03 08:30"), "2025-01-03"), (dt.date(2025, 1, 3), "2025-01-03"),
+    (pd.Timestamp("2025-01-03 23:30", tz="Asia/Shanghai"), "2025-01-03"),
+    (dt.datetime(2025, 1, 3, 1, 0, tzinfo=dt.timezone.utc), "2025-01-03"),
+    (dt.datetime(2025, 1, 3, 23, 59, 59, 999999, tzinfo=SHANGHAI), "2025-01-03"),
+]
+
+
+def random_column(rng, n, pool):
+    picks = rng.integers(0, len(pool), n)
+    return pd.Series([pool[i] for i in picks], dtype=object)
+
+
+def columns(rng, n=200):
+    """同一随机源生成的几类列：混合 object、纯整数、带 NaN 的浮点、只含数字文本与空值的列"""
+    return {
+        "mixed": random_column(rng, n, VALUE_POOL),
+        "int": pd.Series(rng.integers(-1000, 1000, n)),
+        "float": pd.Series(np.where(rng.random(n) < 0.2, np.nan, rng.normal(0, 1000, n).round(2))),
+        "num_object": random_column(rng, n, NUM_POOL),
+        "num_text": random_column(rng, n, NUM_TEXT_POOL),
+    }
+
+
+def reference_compare(s_main, s_ref, compare_type="text", tolerance=0, multiplier=1):
+    """逐值实现的比较 (向量化之前的版本，日期以外的分支)"""
+    merge_failed_mask = s_ref.isna()
+    main_is_na = pd.isna(s_main) | (s_main.astype(str).str.strip().isin(["", "nan", "None"]))
+    ref_is_na = pd.isna(s_ref) | (s_ref.astype(str).str.strip().isin(["", "nan", "None"]))
+    both_are_na = main_is_na & ref_is_na
+    errors = pd.Series(False, index=s_main.index)
+    if compare_type in ("num", "rate", "term"):
+        s_main_norm = s_main.apply(normalize_num)
+        s_ref_norm = s_ref.apply(normalize_num)
+        if compare_type == "term":
+            s_ref_norm = pd.to_numeric(s_ref_norm, errors="coerce") * multiplier
+        is_num_main = s_main_norm.apply(lambda x: isinstance(x, (int, float)))
+        is_num_ref = s_ref_norm.apply(lambda x: isinstance(x, (int, float)))
+        both_are_num = is_num_main & is_num_ref
+        if both_are_num.any():
+            diff = (s_main_norm[both_are_num] - s_ref_norm[both_are_num]).abs()
+            errors.loc[both_are_num] = (diff > (tolerance + 1e-6))
+        errors |= (is_num_main & ~is_num_ref & ~ref_is_na) | (~is_num_main & ~main_is_na & is_num_ref)
+    else:
+        errors = s_main.apply(normalize_text) != s_ref.apply(normalize_text)
+    return errors & ~both_are_na & ~(merge_failed_mask & ~main_is_na)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_normalize_text_vec_matches_per_value(seed):
+    for name, s in columns(np.random.default_rng(seed)).items():
+        expected = s.apply(normalize_text)
+        got = normalize_text_vec(s)
+        assert got.tolist() == expected.tolist(), name
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_num_parts_vec_matches_per_value(seed):
+    for name, s in columns(np.random.default_rng(seed)).items():
+        expected = s.apply(normalize_num)
+        exp_is_num = expected.apply(lambda x: isinstance(x, (int, float))).to_numpy()
+        values, is_num = _none_as_num(*num_parts_vec(s))
+        assert is_num.tolist() == exp_is_num.tolist(), name
+        exp_values = pd.to_numeric(expected[exp_is_num], errors="coerce").to_numpy(dtype=float)
+        np.testing.assert_array_equal(values.to_numpy()[exp_is_num], exp_values, err_msg=name)
+
+
+@pytest.mark.parametrize("compare_type,tolerance,multiplier", [
+    ("text", 0, 1), ("num", 0, 1), ("num", 1, 1), ("rate", 0.001, 1), ("term", 0, 12),
+])
+@pytest.mark.parametrize("seed", range(10))
+def test_compare_series_vec_matches_per_value(seed, compare_type, tolerance, multiplier):
+    rng = np.random.default_rng(seed)
+    main, ref = columns(rng), columns(rng)
+    for a in main:
+        for b in ref:
+            s_main, s_ref = main[a], ref[b]
+            expected = reference_compare(s_main, s_ref, compare_type, tolerance, multiplier)
+            got = compare_series_vec(s_main, s_ref, compare_type, tolerance, multiplier)
+            assert got.tolist() == expected.tolist(), (a, b)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_normalize_date_vec_matches_per_value(seed):
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(DATE_POOL), 200)
+    s = pd.Series([DATE_POOL[i][0] for i in picks], dtype=object)
+    expected = [DATE_POOL[i][1] for i in picks]
+    got = normalize_date_vec(s)
+    assert [None if pd.isna(v) else v.strftime("%Y-%m-%d") for v in got] == expected
+    # 只含文本的列 (首个文本的格式可能是任一种)
+    texts = [i for i in picks if isinstance(DATE_POOL[i][0], str)]
+    got = normalize_date_vec(pd.Series([DATE_POOL[i][0] for i in texts], dtype=object))
+    assert [None if pd.isna(v) else v.strftime("%Y-%m-%d") for v in got] == [DATE_POOL[i][1] for i in texts]
+
+
+def test_normalize_date_vec_yyyymmdd_numbers():
+    """19000101~29991231 之间的整数按 yyyymmdd 解析 (与文本 "20250103" 一致)，其余数值仍按 Excel 序列号"""
+    # 29991231 按 yyyymmdd 解析但超出 datetime64[ns] 的范围，与 20250230 (无效日期) 一样为 NaT，不落到序列号
+    ints = pd.Series([20250103, 19000101, 29991231, 20250230, 45660, 18991231, 0])
+    expected = [pd.Timestamp("2025-01-03"), pd.Timestamp("1900-01-01"), None, None, pd.Timestamp("2025-01-03"), None, None]
+    for s in (ints, ints.astype(float), ints.astype(object)):
+        got = normalize_date_vec(s)
+        assert [None if pd.isna(v) else v for v in got] == expected, s.dtype
+    text = normalize_date_vec(pd.Series(["20250103", 20250103, 20250103.0, "2025-01-03"], dtype=object))
+    assert text.tolist() == [pd.Timestamp("2025-01-03")] * 4
+
+
+def test_normalize_date_vec_tz_aware_column():
+    """带时区的 datetime 列取当地日期，结果无时区，可与参考表的日期比较"""
+    s = pd.Series(pd.to_datetime(["2025-01-03 23:30", "2025-01-04 00:10", None]).tz_localize("Asia/Shanghai"))
+    got = normalize_date_vec(s)
+    assert got.dt.tz is None
+    assert got[:2].tolist() == [pd.Timestamp("2025-01-03"), pd.Timestamp("2025-01-04")]
+    assert pd.isna(got[2])
+
+
+def test_single_values():
+    """逐个覆盖几个典型值 (与逐值函数一致)"""
+    s = pd.Series(["1,234.5", "12%", "１２", "NaN", "-", None, 7, 7.5, "abc"], dtype=object)
+    values, is_num = _none_as_num(*num_parts_vec(s))
+    assert is_num.tolist() == [True, True, True, True, False, False, True, True, False]
+    np.testing.assert_array_equal(values.to_numpy()[[0, 1, 2, 6, 7]], [1234.5, 0.12, 12.0, 7.0, 7.5])
+    assert np.isnan(values[3])
+    # 只含数值与空值的列：apply 推断为 float64，空值也算数值
+    _, is_num = _none_as_num(*num_parts_vec(s[:8]))
+    assert is_num.all()
+    assert normalize_text_vec(pd.Series([" ＡＢ　c\n", None, np.nan, 12])).tolist() == ["abc", "", "", "12"]
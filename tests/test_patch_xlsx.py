@@ -0,0 +1,176 @@
+# =====================================
+# 原文件标注版 (patch_marked_xlsx)：与审核标注版的填充一致、与逐块复制的块大小无关、
+# 自闭合的 <row/> / <c/>、已有 s= 的单元格与带命名空间前缀 (x:) 的 XML
+# =====================================
+import re
+import zipfile
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font, PatternFill
+
+from audit_core import (
+    RED_FILL, YELLOW_FILL, build_sheet_artifact, patch_marked_xlsx, _patch_sheet_xml, _style_patcher, _xlsx_parts,
+)
+
+HEADER = ["合同号", "客户", "金额", "日期", "备注"]
+MARK_COLORS = {RED_FILL.fgColor.rgb: "red", YELLOW_FILL.fgColor.rgb: "yellow"}
+
+
+def styled_workbook(rows=40, seed=0):
+    """带格式的提成表：数字格式、字体、原有填充、公式、列宽，另有一个不审核的 sheet；部分单元格为空"""
+    rng = np.random.default_rng(seed)
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "总"
+    ws.append(HEADER)
+    for cell in ws[1]:
+        cell.fill = PatternFill(start_color="DDEBF7", end_color="DDEBF7", fill_type="solid")
+        cell.font = Font(bold=True)
+    for i in range(rows):
+        ws.append([f"HT{i:04d}", f"客户{i % 7}", float(rng.integers(1000, 9000)),
+                   pd.Timestamp("2025-01-01") + pd.Timedelta(days=int(i)), None if i % 3 else "加急"])
+        ws.cell(i + 2, 3).number_format = "#,##0.00"
+        ws.cell(i + 2, 4).number_format = "yyyy-mm-dd"
+    ws.cell(rows + 3, 3, f"=SUM(C2:C{rows + 1})")
+    ws.column_dimensions["B"].width = 30
+    other = wb.create_sheet("说明")
+    other.append(["不审核的 sheet"])
+    out = BytesIO()
+    wb.save(out)
+    out.seek(0)
+    return out
+
+
+def audit_result(n_rows, marked_cols, seed=0, rate=0.15):
+    rng = np.random.default_rng(seed)
+    bitmap = rng.random((n_rows, len(marked_cols))) < rate
+    flags = bitmap.any(axis=1)
+    return {"error_bitmap": bitmap, "row_flags": flags, "marked_cols": marked_cols, "contract_col": "合同号",
+            "error_rows": int(flags.sum()), "total_errors": int(bitmap.sum())}
+
+
+def marks_of(data, sheet=None):
+    """{单元格坐标: "red" / "yellow"}"""
+    wb = load_workbook(BytesIO(data))
+    ws = wb[sheet] if sheet else wb.worksheets[0]
+    return {c.coordinate: MARK_COLORS[c.fill.fgColor.rgb] for row in ws.iter_rows() for c in row
+            if c.fill.fill_type == "solid" and c.fill.fgColor.rgb in MARK_COLORS}
+
+
+@pytest.mark.parametrize("by_name", [False, True])
+def test_fills_match_rebuild(by_name):
+    src = styled_workbook()
+    df = pd.read_excel(src, sheet_name="总")
+    df.attrs["sheet_name"] = "总"
+    result = audit_result(len(df), ["金额", "日期", "备注"])
+    rebuilt, _ = build_sheet_artifact(df, result, "审核标注版")
+    patched, stats = patch_marked_xlsx(src, {"总": ("总" if by_name else df, result)})
+    expected = marks_of(rebuilt.getvalue())
+    assert expected and marks_of(patched.getvalue(), "总") == expected
+    assert stats["行数"] == result["error_rows"]
+
+
+def test_formats_formulas_widths_survive():
+    src = styled_workbook()
+    df = pd.read_excel(src, sheet_name="总")
+    df.attrs["sheet_name"] = "总"
+    result = audit_result(len(df), ["金额", "日期", "备注"], rate=0.5)
+    patched, _ = patch_marked_xlsx(src, {"总": (df, result)})
+    before, after = load_workbook(src), load_workbook(BytesIO(patched.getvalue()))
+    for name in before.sheetnames:
+        for row_a, row_b in zip(before[name].iter_rows(), after[name].iter_rows()):
+            for a, b in zip(row_a, row_b):
+                assert (a.value, a.number_format, a.font.b) == (b.value, b.number_format, b.font.b), a.coordinate
+    assert after["总"].column_dimensions["B"].width == 30
+    assert after["总"]["A1"].fill.fgColor.rgb == before["总"]["A1"].fill.fgColor.rgb # 表头原有填充
+    # 不审核的 sheet 与其他部件逐字节复制
+    with zipfile.ZipFile(src) as a, zipfile.ZipFile(BytesIO(patched.getvalue())) as b:
+        parts = _xlsx_parts(a)
+        changed = {parts["sheets"]["总"], parts["styles"]}
+        assert sorted(a.namelist()) == sorted(b.namelist()) # styles.xml 最后写出
+        assert all(a.read(n) == b.read(n) for n in a.namelist() if n not in changed)
+
+
+def test_no_errors_copies_file():
+    src = styled_workbook()
+    df = pd.read_excel(src, sheet_name="总")
+    result = audit_result(len(df), ["金额"], rate=0)
+    patched, stats = patch_marked_xlsx(src, {"总": ("总", result)})
+    assert stats["行数"] == 0 and marks_of(patched.getvalue(), "总") == {}
+
+
+def fake_style(style, color):
+    return 100 + 2 * style + (color == "red")
+
+
+def patch(xml, marks, block_size):
+    dst = BytesIO()
+    _patch_sheet_xml(BytesIO(xml), dst, marks, fake_style, block_size)
+    return dst.getvalue()
+
+
+def test_block_size_independent():
+    src = styled_workbook(rows=300)
+    with zipfile.ZipFile(src) as zf:
+        xml = zf.read(_xlsx_parts(zf)["sheets"]["总"])
+    rng = np.random.default_rng(1)
+    marks = {int(r): {int(c): ("red" if c > 1 else "yellow") for c in rng.choice(range(1, 7), 3, replace=False)}
+             for r in rng.choice(range(1, 305), 60, replace=False)}
+    outputs = {block: patch(xml, marks, block) for block in (1, 7, 64, 1000, len(xml) + 1)}
+    assert len(set(outputs.values())) == 1
+    assert outputs[7] != xml
+
+
+ROWS_XML = (
+    b'<worksheet><sheetData>'
+    b'<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" s="5" t="s"><v>1</v></c></row>'
+    b'<row r="2"/>'
+    b'<row r="3" spans="1:3"><c r="A3"/><c r="C3" s=\'7\'><v>3</v></c></row>'
+    b'<row r="4"><c r="B4"><f>SUM(A1:A2)</f><v>0</v></c></row>'
+    b'</sheetData></worksheet>'
+)
+
+
+@pytest.mark.parametrize("block_size", [1, 5, 1 << 20])
+def test_row_and_cell_forms(block_size):
+    marks = {1: {2: "red"}, 2: {1: "yellow", 3: "red"}, 3: {1: "yellow", 2: "red", 3: "red"}, 4: {2: "red", 4: "red"}}
+    assert patch(ROWS_XML, marks, block_size) == (
+        b'<worksheet><sheetData>'
+        b'<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" s="111" t="s"><v>1</v></c></row>'
+        b'<row r="2"><c r="A2" s="100"/><c r="C2" s="101"/></row>'
+        b'<row r="3" spans="1:3"><c r="A3" s="100"/><c r="B3" s="101"/><c r="C3" s=\'115\'><v>3</v></c></row>'
+        b'<row r="4"><c r="B4" s="101"><f>SUM(A1:A2)</f><v>0</v></c><c r="D4" s="101"/></row>'
+        b'</sheetData></worksheet>'
+    )
+
+
+def test_prefixed_markup():
+    xml = (b'<x:worksheet xmlns:x="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><x:sheetData>'
+           b'<x:row r="1"><x:c r="A1" s="2"><x:v>1</x:v></x:c></x:row><x:row r="2"/>'
+           b'</x:sheetData></x:worksheet>')
+    got = patch(xml, {1: {1: "red", 2: "red"}, 2: {1: "yellow"}}, 4)
+    assert got == (b'<x:worksheet xmlns:x="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><x:sheetData>'
+                   b'<x:row r="1"><x:c r="A1" s="105"><x:v>1</x:v></x:c><x:c r="B1" s="101"/></x:row>'
+                   b'<x:row r="2"><x:c r="A2" s="100"/></x:row>'
+                   b'</x:sheetData></x:worksheet>')
+
+
+def test_prefixed_styles():
+    styles = (b'<x:styleSheet xmlns:x="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+              b'<x:fills count="2"><x:fill><x:patternFill patternType="none"/></x:fill>'
+              b'<x:fill><x:patternFill patternType="gray125"/></x:fill></x:fills>'
+              b'<x:cellXfs count="2"><x:xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+              b'<x:xf numFmtId="14" fontId="1" fillId="0" borderId="0" xfId="0" applyNumberFormat="1">'
+              b'<x:alignment horizontal="center"/></x:xf></x:cellXfs></x:styleSheet>')
+    style_of, render = _style_patcher(styles)
+    assert (style_of(1, "red"), style_of(0, "yellow"), style_of(1, "red")) == (2, 3, 2)
+    out = render()
+    assert b'<x:fills count="4">' in out and b'<x:cellXfs count="4">' in out
+    assert out.count(b"<x:fill>") == 4
+    xfs = re.findall(rb"<x:xf\b.*?(?:/>|</x:xf>)", out)
+    assert xfs[2].startswith(b'<x:xf numFmtId="14" fontId="1" fillId="2"') and b"<x:alignment" in xfs[2]
+    assert b'fillId="3"' in xfs[3] and b'applyFill="1"' in xfs[3]
@@ -0,0 +1,99 @@
+# =====================================
+# 参考表磁盘缓存 (ref_cache)：Parquet 条目的还原 (值类型、索引、category、提示)、
+# 目录权限与条目属主、损坏 / 不支持的条目、旧格式条目与未安装 pyarrow 时不缓存
+# =====================================
+import datetime as dt
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ref_cache
+
+pytest.importorskip("pyarrow")
+
+
+def mixed_frame():
+    return pd.DataFrame({
+        "__KEY__": ["A", "B", "C", "D", "E"],
+        "金额": [1, "12,000", 3.5, None, np.nan],
+        "日期": [dt.datetime(2024, 1, 2, 3, 4), pd.Timestamp("2024-02-03"), dt.date(2024, 3, 4), pd.NaT, "2024/1/1"],
+        "其他": [dt.time(8, 30, 15, 123), dt.timedelta(days=1, seconds=3), True, False, 2 ** 40],
+        "期限": [1, 2, 3, 4, 5],
+        "费率": [1.5, np.nan, 2, 3, 4],
+        "放款日": pd.to_datetime(["2024-01-01", None, "2024-01-03", "2024-01-04", "2024-01-05"]),
+        "城市": pd.Categorical(["x", "y", "x", None, "z"]),
+    }, index=pd.Index([10, 3, 7, 7, 0], name="行"))
+
+
+def same_values(a, b):
+    return a is b or (pd.isna(a) and pd.isna(b) and type(a) is type(b)) or (type(a) is type(b) and a == b)
+
+
+def test_round_trip_keeps_value_types(tmp_path):
+    df = mixed_frame()
+    notices = [("warning", "放款明细缺少列：家访"), ("info", "x")]
+    ref_cache.store("fk-1", df, notices, cache_dir=str(tmp_path))
+    assert os.listdir(tmp_path) == ["fk-1" + ref_cache.ENTRY_SUFFIX]
+    got, got_notices = ref_cache.load("fk-1", cache_dir=str(tmp_path))
+    pd.testing.assert_frame_equal(got, df)
+    # 行指纹按值的类型区分：1 与 1.0、datetime 与 Timestamp、None 与 NaN 都要原样还原
+    for col in df.columns:
+        mismatches = [(a, b) for a, b in zip(got[col], df[col]) if not same_values(a, b)]
+        assert mismatches == [], col
+    assert got_notices == notices
+
+
+def test_unsupported_values_not_cached(tmp_path):
+    df = pd.DataFrame({"__KEY__": ["A", "B"], "x": [1, {"a": 1}]})
+    ref_cache.store("bad", df, [], cache_dir=str(tmp_path))
+    tz = pd.DataFrame({"__KEY__": ["A"], "x": pd.Series([pd.Timestamp("2024-01-01", tz="Asia/Shanghai")], dtype=object)})
+    ref_cache.store("tz", tz, [], cache_dir=str(tmp_path))
+    assert ref_cache.list_entries(str(tmp_path)) == []
+    assert ref_cache.load("bad", cache_dir=str(tmp_path)) is None
+
+
+def test_directory_private_and_foreign_entries_refused(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    ref_cache.store("fk-1", mixed_frame(), [], cache_dir=cache_dir)
+    assert os.stat(cache_dir).st_mode & 0o777 == 0o700
+    assert ref_cache.load("fk-1", cache_dir=cache_dir) is not None
+    if not hasattr(os, "getuid"):
+        return
+    monkeypatch.setattr(os, "getuid", lambda: os.stat(cache_dir).st_uid + 1)
+    assert ref_cache.load("fk-1", cache_dir=cache_dir) is None
+    assert ref_cache.list_entries(cache_dir) # 不读取，也不删除
+
+
+def test_corrupt_entry_removed(tmp_path):
+    ref_cache.store("fk-1", mixed_frame(), [], cache_dir=str(tmp_path))
+    path = tmp_path / ("fk-1" + ref_cache.ENTRY_SUFFIX)
+    path.write_bytes(path.read_bytes()[:100])
+    assert ref_cache.load("fk-1", cache_dir=str(tmp_path)) is None
+    assert not path.exists()
+    assert ref_cache.load("missing", cache_dir=str(tmp_path)) is None
+
+
+def test_legacy_entries_listed_evicted_and_cleared(tmp_path):
+    legacy = tmp_path / "fk-old.pkl"
+    legacy.write_bytes(b"x" * 1000)
+    os.utime(legacy, (0, 0))
+    ref_cache.store("fk-1", mixed_frame(), [], cache_dir=str(tmp_path))
+    assert {e["key"] for e in ref_cache.list_entries(str(tmp_path))} == {"fk-old", "fk-1"}
+    assert ref_cache.load("fk-old", cache_dir=str(tmp_path)) is None # 旧格式不读取
+    assert legacy.exists()
+    # 容量不足时先淘汰最久未用的旧条目，刚写入的条目保留
+    assert ref_cache.evict(1, str(tmp_path), keep="fk-1") == 1
+    assert [e["key"] for e in ref_cache.list_entries(str(tmp_path))] == ["fk-1"]
+    legacy.write_bytes(b"x")
+    assert ref_cache.clear(str(tmp_path)) == 2
+    assert os.listdir(tmp_path) == []
+
+
+def test_without_pyarrow_is_noop(tmp_path, monkeypatch):
+    monkeypatch.setattr(ref_cache, "pq", None)
+    assert not ref_cache.available()
+    ref_cache.store("fk-1", mixed_frame(), [], cache_dir=str(tmp_path))
+    assert os.listdir(tmp_path) == []
+    assert ref_cache.load("fk-1", cache_dir=str(tmp_path)) is None
@@ -0,0 +1,75 @@
+# =====================================
+# 分块流式审核 (stream_audit_sheet) 与整表审核 (read_tc_sheets + audit_one_sheet) 的结果一致性
+# 整表读取分别用 openpyxl / calamine (已安装时)，块大小取 7 等使列类型在块间变化
+# =====================================
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import load_workbook
+
+import audit_core
+import synth_data
+from audit_core import audit_one_sheet, build_ref_tables, read_tc_sheets, sheet_jobs_of, stream_audit_sheet, tc_sheet_names
+
+try:
+    import python_calamine # noqa: F401
+    HAS_CALAMINE = True
+except ImportError:
+    HAS_CALAMINE = False
+
+ENGINES = ["openpyxl", pytest.param("calamine", marks=pytest.mark.skipif(not HAS_CALAMINE, reason="未安装 python-calamine"))]
+
+
+def variant(value, rng):
+    """同一个值的另一种写法 (整数值的浮点、文本数字、千分位、序列号 / 文本日期、带时间的日期) 或空值"""
+    if rng.random() < 0.15:
+        return None
+    if isinstance(value, dt.datetime):
+        return [value + dt.timedelta(hours=9, minutes=30), (value - dt.datetime(1899, 12, 30)).days,
+                value.strftime("%Y/%m/%d"), value.strftime("%Y%m%d")][rng.integers(4)]
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return [float(value), str(value), f"{value:,}", int(value) if float(value).is_integer() else value][rng.integers(4)]
+    return value
+
+
+@pytest.fixture(scope="module")
+def dataset(tmp_path_factory):
+    out = tmp_path_factory.mktemp("stream")
+    data = synth_data.generate_dataset(str(out), 150, error_rate=0.1, seed=5)
+    files = data["files"]
+    # 改写一部分单元格的写法，使各列在不同块中推断出不同的类型
+    rng = np.random.default_rng(5)
+    wb = load_workbook(files["提成"])
+    for ws in wb.worksheets:
+        for row in ws.iter_rows(min_row=2):
+            for cell in row[1:]:
+                if rng.random() < 0.2:
+                    cell.value = variant(cell.value, rng)
+    drifted = str(out / "提成_类型混合.xlsx")
+    wb.save(drifted)
+    all_std_dfs, ref_index = build_ref_tables(files["放款明细"], files["二次明细"], files["原表"], disk_cache=False)
+    return {"提成": files["提成"], "提成_类型混合": drifted}, all_std_dfs, ref_index
+
+
+@pytest.mark.parametrize("tc", ["提成", "提成_类型混合"])
+@pytest.mark.parametrize("engine", ENGINES)
+def test_stream_matches_whole_sheet(dataset, tc, engine, monkeypatch):
+    files, all_std_dfs, ref_index = dataset
+    monkeypatch.setattr(audit_core, "EXCEL_ENGINE", engine)
+    jobs = sheet_jobs_of(read_tc_sheets(files[tc]))
+    names = tc_sheet_names(files[tc])
+    assert list(jobs) == list(names)
+    for tag, df in jobs.items():
+        whole = audit_one_sheet(df, all_std_dfs, ref_index)
+        for chunk_rows in (7, 64, 100_000):
+            streamed = stream_audit_sheet(files[tc], names[tag], all_std_dfs, ref_index, chunk_rows=chunk_rows)
+            where = (tag, chunk_rows)
+            assert streamed["rows"] == len(df), where
+            assert streamed["marked_cols"] == whole["marked_cols"], where
+            np.testing.assert_array_equal(streamed["error_bitmap"], whole["error_bitmap"], err_msg=str(where))
+            np.testing.assert_array_equal(streamed["row_flags"], whole["row_flags"], err_msg=str(where))
+            assert streamed["total_errors"] == whole["total_errors"], where
+            np.testing.assert_array_equal(streamed["unmatched_rows"], whole["unmatched_rows"], err_msg=str(where))
+    assert any(audit_one_sheet(df, all_std_dfs, ref_index)["total_errors"] for df in jobs.values())